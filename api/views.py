@@ -7,7 +7,6 @@ from rest_framework.renderers import JSONRenderer
 from rest_framework_swagger.views import get_swagger_view
 from rest_framework_swagger.renderers import OpenAPIRenderer, SwaggerUIRenderer
 
-from django.template.loader import render_to_string
 from django.db.models import Prefetch, Q, Min, Count
 
 from interaction.models import ResidueFragmentInteraction
@@ -25,7 +24,9 @@ from api.serializers import (ProteinSerializer, ProteinFamilySerializer, Species
                              MutationSerializer, ReceptorListSerializer, GuidetoPharmacologySerializer, EndogenousLigandSerializer)
 from api.renderers import PDBRenderer
 from common.alignment import Alignment
-from common.definitions import AMINO_ACIDS, AMINO_ACID_GROUPS
+from common.alignment_serializer import (alignment_sequences, alignment_statistics, get_alignment_format,
+    streaming_alignment_response)
+from common.alignment_store import AlignmentStore
 from drugs.models import Drugs
 from contactnetwork.models import InteractionPeptide, Interaction, InteractingPeptideResiduePair
 
@@ -538,6 +539,7 @@ class FamilyAlignment(views.APIView):
     Note that this method only includes Swiss-Prot sequences in the alignment.
     \n/alignment/family/{slug}/
     \n{slug} is a protein family identifier, e.g. 001_001_001
+    \nAdd ?output=fasta, ?output=csv or ?output=json to stream the alignment, e.g. for large family_all alignments
     """
 
     def get(self, request, slug=None, segments=None, latin_name=None, statistics=False, include_trembl=False):
@@ -588,66 +590,56 @@ class FamilyAlignment(views.APIView):
             elif protein_family == "200":
                 ss = [ s for s in ss if s.proteinfamily == 'Arrestin']
 
-            # create an alignment object
-            a = Alignment()
-            a.show_padding = False
+            # slice the alignment from the precomputed store when it contains exactly the selected proteins
+            stored = None
+            store = AlignmentStore.load(protein_family)
+            if store is not None:
+                entry_names = list(ps.values_list('entry_name', flat=True))
+                rows = store.select_proteins(slug=slug, latin_name=latin_name, include_trembl=include_trembl,
+                    entry_names=entry_names)
+                if len(rows) == len(entry_names):
+                    stored = store.slice(rows, [s.slug for s in ss],
+                        [g.default_generic_number.label for g in gen_list])
+
+            extra = OrderedDict()
+            if stored is not None:
+                sequences = stored.sequences()
+                extra["CONSENSUS"] = stored.consensus()
+                if statistics == True:
+                    extra["statistics"] = stored.statistics()
+            else:
+                # create an alignment object
+                a = Alignment()
+                a.show_padding = False
 
-            # load data from selection into the alignment
-            a.load_proteins(ps)
+                # load data from selection into the alignment
+                a.load_proteins(ps)
 
-            # load generic numbers and TMs seperately
-            if gen_list:
-                a.load_segments(gen_list)
-            a.load_segments(ss)
+                # load generic numbers and TMs seperately
+                if gen_list:
+                    a.load_segments(gen_list)
+                a.load_segments(ss)
 
-            # build the alignment data matrix
-            a.build_alignment()
+                # build the alignment data matrix
+                a.build_alignment()
 
-            a.calculate_statistics()
+                a.calculate_statistics()
 
-            residue_list = []
-            for aa in a.full_consensus:
-                residue_list.append(aa.amino_acid)
+                sequences = alignment_sequences(a)
+                extra["CONSENSUS"] = "".join([aa.amino_acid for aa in a.full_consensus])
 
-            # render the fasta template as string
-            response = render_to_string('alignment/alignment_fasta.html', {'a': a}).split("\n")
+                # render statistics for output
+                if statistics == True:
+                    extra["statistics"] = alignment_statistics(a)
 
-            # convert the list to a dict
-            ali_dict = OrderedDict({})
-            protein = "reference"
-            for row in response:
-                if row.strip() != "":
-                    if row.startswith(">"):
-                        protein = row[1:]
-                    else:
-                        ali_dict[protein] = row
-                        protein = False
-
-            ali_dict["CONSENSUS"] = "".join(residue_list)
-
-            # render statistics for output
-            if statistics == True:
-                feat = {}
-                for i, feature in enumerate(AMINO_ACID_GROUPS):
-                    feature_stats = a.feature_stats[i]
-                    feature_stats_clean = []
-                    for d in feature_stats:
-                        sub_list = [x[0] for x in d]
-                        feature_stats_clean.append(sub_list) # remove feature frequencies
-                    # print(feature_stats_clean)
-                    feat[feature] = [item for sublist in feature_stats_clean for item in sublist]
-
-                for i, AA in enumerate(AMINO_ACIDS):
-                    feature_stats = a.amino_acid_stats[i]
-                    feature_stats_clean = []
-                    for d in feature_stats:
-                        sub_list = [x[0] for x in d]
-                        feature_stats_clean.append(sub_list) # remove feature frequencies
-                    # print(feature_stats_clean)
-                    feat[AA] = [item for sublist in feature_stats_clean for item in sublist]
-
-                ali_dict["statistics"] = feat
+            sequences = ((entry_name, sequence) for entry_name, sequence in sequences if sequence.strip() != "")
+
+            alignment_format = get_alignment_format(request)
+            if alignment_format:
+                return streaming_alignment_response(sequences, alignment_format, extra, slug + "_alignment")
 
+            ali_dict = OrderedDict(sequences)
+            ali_dict.update(extra)
             return Response(ali_dict)
 
 class FamilyAlignmentAll(FamilyAlignment):
@@ -766,28 +758,15 @@ class ProteinSimilaritySearchAlignment(views.APIView):
             # calculate identity and similarity of each row compared to the reference
             a.calculate_similarity()
 
-            # render the fasta template as string
-            response = render_to_string('alignment/alignment_fasta.html', {'a': a}).split("\n")
-
-            # convert the list to a dict
+            # convert the alignment to a dict
             ali_dict = {}
-            k = False
-            num = 0
-            for i, row in enumerate(response):
-                if row.startswith(">"):
-                    k = row[1:]
-                elif k:
-                    # add the query as 100 identical/similar to the beginning (like on the website)
-                    if num == 0:
-                        a.proteins[num].identity = 100
-                        a.proteins[num].similarity = 100
-                    # order dict after custom list
-                    keyorder = ["similarity","identity","AA"]
-                    ali_dict[k] = {"AA": row, "identity": int(str(a.proteins[num].identity).replace(" ","")),
-                    "similarity": int(str(a.proteins[num].similarity).replace(" ",""))}
-                    ali_dict[k] = OrderedDict(sorted(ali_dict[k].items(), key=lambda t: keyorder.index(t[0])))
-                    num+=1
-                    k = False
+            for num, (k, row) in enumerate(alignment_sequences(a)):
+                # add the query as 100 identical/similar to the beginning (like on the website)
+                if num == 0:
+                    a.proteins[num].identity = 100
+                    a.proteins[num].similarity = 100
+                ali_dict[k] = OrderedDict([("similarity", int(str(a.proteins[num].similarity).replace(" ",""))),
+                    ("identity", int(str(a.proteins[num].identity).replace(" ",""))), ("AA", row)])
             ali_dict_ordered = OrderedDict(sorted(ali_dict.items(), key=lambda x: x[1]['similarity'], reverse=True))
             return Response(ali_dict_ordered)
 
@@ -798,6 +777,7 @@ class ProteinAlignment(views.APIView):
     \n/alignment/protein/{proteins}/
     \n{proteins} is a comma separated list of protein identifiers, e.g. adrb2_human,5ht2a_human. PDB IDs can also be
     used to align structure sequences with wild type sequences, e.g. adrb2_human,3SN6
+    \nAdd ?output=fasta, ?output=csv or ?output=json to stream the alignment
     """
 
     def get(self, request, proteins=None, segments=None, statistics=False):
@@ -843,61 +823,49 @@ class ProteinAlignment(views.APIView):
             elif protein_family == "200":
                 ss = [ s for s in ss if s.proteinfamily == 'Arrestin']
 
-            # create an alignment object
-            a = Alignment()
-            a.show_padding = False
+            # slice the alignment from the precomputed store when all proteins are wild-type members of the class
+            stored = None
+            store = AlignmentStore.load(protein_family)
+            if store is not None:
+                entry_names = list(ps.values_list('entry_name', flat=True))
+                rows = store.select_proteins(entry_names=entry_names)
+                if len(rows) == len(entry_names):
+                    stored = store.slice(rows, [s.slug for s in ss], [g.default_generic_number.label for g in gen_list])
+
+            extra = OrderedDict()
+            if stored is not None:
+                sequences = stored.sequences()
+                if statistics == True:
+                    extra["statistics"] = stored.statistics()
+            else:
+                # create an alignment object
+                a = Alignment()
+                a.show_padding = False
 
-            # load data from selection into the alignment
-            a.load_proteins(ps)
+                # load data from selection into the alignment
+                a.load_proteins(ps)
 
-            # load generic numbers and TMs seperately
-            if gen_list:
-                a.load_segments(gen_list)
-            a.load_segments(ss)
+                # load generic numbers and TMs seperately
+                if gen_list:
+                    a.load_segments(gen_list)
+                a.load_segments(ss)
 
-            # build the alignment data matrix
-            a.build_alignment()
+                # build the alignment data matrix
+                a.build_alignment()
 
-            # calculate statistics
-            if statistics == True:
-                a.calculate_statistics()
+                sequences = alignment_sequences(a)
 
-            # render the fasta template as string
-            response = render_to_string('alignment/alignment_fasta.html', {'a': a}).split("\n")
+                # calculate statistics
+                if statistics == True:
+                    a.calculate_statistics()
+                    extra["statistics"] = alignment_statistics(a)
 
-            # convert the list to a dict
-            ali_dict = {}
-            k = False
-            for row in response:
-                if row.startswith(">"):
-                    k = row[1:]
-                elif k:
-                    ali_dict[k] = row
-                    k = False
-
-            # render statistics for output
-            if statistics == True:
-                feat = {}
-                for i, feature in enumerate(AMINO_ACID_GROUPS):
-                    feature_stats = a.feature_stats[i]
-                    feature_stats_clean = []
-                    for d in feature_stats:
-                        sub_list = [x[0] for x in d]
-                        feature_stats_clean.append(sub_list) # remove feature frequencies
-                    # print(feature_stats_clean)
-                    feat[feature] = [item for sublist in feature_stats_clean for item in sublist]
-
-                for i, AA in enumerate(AMINO_ACIDS):
-                    feature_stats = a.amino_acid_stats[i]
-                    feature_stats_clean = []
-                    for d in feature_stats:
-                        sub_list = [x[0] for x in d]
-                        feature_stats_clean.append(sub_list) # remove feature frequencies
-                    # print(feature_stats_clean)
-                    feat[AA] = [item for sublist in feature_stats_clean for item in sublist]
-
-                ali_dict["statistics"] = feat
+            alignment_format = get_alignment_format(request)
+            if alignment_format:
+                return streaming_alignment_response(sequences, alignment_format, extra, "protein_alignment")
 
+            ali_dict = OrderedDict(sequences)
+            ali_dict.update(extra)
             return Response(ali_dict)
 
 class ProteinAlignmentStatistics(ProteinAlignment):
@@ -1,10 +1,13 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management import call_command
 from django.conf import settings
-from django.db import connection
+from django.db import connection, transaction
 
 import datetime
 import logging
+import queue
+import time
+import traceback
 from multiprocessing import Queue, Process, Value, Lock
 
 
@@ -13,6 +16,12 @@ class Command(BaseCommand):
 
     logger = logging.getLogger(__name__)
 
+    # work queue settings, used by subclasses that implement process_item(item, iteration) instead of main_func
+    # number of times a failed item is retried, only for subclasses whose process_item can safely run again
+    max_retries = 0
+    progress_interval = 60 # seconds between progress reports
+    num_slowest_items = 5 # number of slowest items listed in the final report
+
     def add_arguments(self, parser):
         parser.add_argument('-p', '--proc',
             type=int,
@@ -27,6 +36,9 @@ class Command(BaseCommand):
             help='Include only a subset of data for testing')
 
     def prepare_input(self, proc, items, iteration=1):
+        if hasattr(self, 'process_item'):
+            return self.run_work_queue(proc, items, iteration)
+
         q = Queue()
         procs = list()
         num_items = len(items)
@@ -54,4 +66,96 @@ class Command(BaseCommand):
             p.start()
 
         for p in procs:
-            p.join()
\ No newline at end of file
+            p.join()
+
+    def run_work_queue(self, proc, items, iteration=1):
+        """Process items with a pool of workers that take one item at a time from a shared queue.
+
+        Each item is passed to self.process_item(item, iteration) in a transaction, so the database changes of a failed
+        attempt are rolled back. Failed items are retried up to max_retries times.
+        Progress and throughput are logged while running, followed by a report of the slowest and failed items.
+        Returns a list of (item, error) of the items that failed.
+        """
+        items = list(items)
+        num_items = len(items)
+        if not num_items:
+            return []
+        if proc > num_items:
+            proc = num_items
+
+        tasks = Queue()
+        results = Queue()
+        for index in range(num_items):
+            tasks.put(index)
+        for i in range(proc):
+            tasks.put(None)
+
+        connection.close()
+        procs = list()
+        for i in range(proc):
+            p = Process(target=self.work_queue_worker, args=(items, tasks, results, iteration))
+            procs.append(p)
+            p.start()
+
+        start = time.time()
+        last_report = start
+        timings = []
+        failed = []
+        while len(timings) < num_items:
+            try:
+                index, success, duration, attempts, error = results.get(timeout=5)
+            except queue.Empty:
+                # stop waiting if all workers have died, e.g. killed by the OS
+                if not any(p.is_alive() for p in procs) and results.empty():
+                    self.logger.error('All workers stopped with {} of {} items done'.format(len(timings), num_items))
+                    break
+                continue
+
+            timings.append((duration, index))
+            if not success:
+                failed.append((items[index], error))
+                self.logger.error('Failed to process {} after {} attempt(s): {}'.format(items[index], attempts, error))
+            if time.time() - last_report > self.progress_interval or len(timings) == num_items:
+                last_report = time.time()
+                self.report_progress(len(timings), num_items, len(failed), last_report - start)
+
+        for p in procs:
+            p.join()
+
+        for duration, index in sorted(timings, reverse=True)[:self.num_slowest_items]:
+            self.logger.info('Slowest item {} took {:.1f}s'.format(items[index], duration))
+        if failed:
+            self.logger.error('{} of {} items failed: {}'.format(len(failed), num_items,
+                ', '.join([str(item) for item, error in failed])))
+        return failed
+
+    def work_queue_worker(self, items, tasks, results, iteration):
+        while True:
+            index = tasks.get()
+            if index is None:
+                break
+
+            start = time.time()
+            attempts = 0
+            error = None
+            while attempts <= self.max_retries:
+                attempts += 1
+                try:
+                    with transaction.atomic():
+                        self.process_item(items[index], iteration)
+                    error = None
+                    break
+                except Exception:
+                    error = traceback.format_exc(limit=3)
+                    # a failed query leaves the connection unusable, reconnect for the retry
+                    connection.close()
+            results.put((index, error is None, time.time() - start, attempts, error))
+
+    def report_progress(self, done, total, num_failed, elapsed):
+        throughput = done / elapsed if elapsed else 0
+        remaining = (total - done) / throughput if throughput else 0
+        message = 'Processed {} of {} items ({} failed) in {}, {:.2f} items/s, {} remaining'.format(done, total,
+            num_failed, datetime.timedelta(seconds=round(elapsed)), throughput,
+            datetime.timedelta(seconds=round(remaining)))
+        print(message)
+        self.logger.info(message)
@@ -24,6 +24,7 @@ from Bio import pairwise2
 
 from structure.assign_generic_numbers_gpcr import GenericNumbering
 from structure.functions import StructureBuildCheck, ParseAFModelsCSV
+from structure import structure_info_index
 from ligand.models import Ligand, LigandType, LigandRole, LigandPeptideStructure
 from interaction.models import *
 from interaction.views import runcalculation_2022, regexaa, check_residue, extract_fragment_rotamer
@@ -171,6 +172,9 @@ class Command(BaseBuild):
             print(msg)
             self.logger.error(msg)
 
+        # existing structures may have been updated
+        structure_info_index.invalidate()
+
     @staticmethod
     def queryset_iterator(qs, batchsize = 5000, gc_collect = True):
         # See https://www.guguweb.com/2020/03/27/optimize-django-memory-usage/
@@ -0,0 +1,96 @@
+from build.management.commands.base_build import Command as BaseBuild
+from common.alignment import Alignment
+from common.alignment_matrix import alignment_columns, encode_alignment
+from common.alignment_store import AlignmentStore
+from protein.models import Protein, ProteinSegment
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class Command(BaseBuild):
+    help = 'Builds the store of precomputed wild-type alignments (one per protein class) used by the alignment API'
+
+    # number of proteins aligned at once, the alignments of all chunks are merged by position
+    chunk_size = 250
+    # the alignment of a class is written as a whole, so a failed class can be built again
+    max_retries = 1
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--classes',
+            nargs='+',
+            action='store',
+            dest='classes',
+            default=False,
+            help='Only build the alignments of these protein classes, e.g. 001 002')
+
+    def handle(self, *args, **options):
+        family_slugs = Protein.objects.filter(sequence_type__slug='wt').values_list('family__slug', flat=True).distinct()
+        self.protein_classes = sorted(set([slug[:3] for slug in family_slugs]))
+        if options['classes']:
+            self.protein_classes = [c for c in self.protein_classes if c in options['classes']]
+
+        try:
+            self.logger.info('BUILDING ALIGNMENT STORE')
+            self.prepare_input(options['proc'], self.protein_classes)
+            self.logger.info('COMPLETED BUILDING ALIGNMENT STORE')
+        except Exception as msg:
+            print(msg)
+            self.logger.error(msg)
+
+    def process_item(self, protein_class, iteration):
+        self.build_class_alignment(protein_class)
+
+    def build_class_alignment(self, protein_class):
+        self.logger.info('Building alignment store for class {}'.format(protein_class))
+        proteins = Protein.objects.filter(sequence_type__slug='wt', family__slug__startswith=protein_class)
+        protein_ids = list(proteins.order_by('family__slug', 'entry_name').values_list('id', flat=True))
+        protein_info = {p[0]: p[1:] for p in proteins.values_list('id', 'family__slug', 'source_id',
+                                                                     'species__latin_name')}
+        segments = ProteinSegment.objects.filter(partial=False)
+
+        # align the proteins in chunks, labels of unaligned positions only depend on the protein itself
+        records = []
+        chunks = []
+        segment_labels = OrderedDict()
+        for start in range(0, len(protein_ids), self.chunk_size):
+            a = Alignment()
+            a.show_padding = False
+            a.load_proteins(Protein.objects.filter(id__in=protein_ids[start:start + self.chunk_size]))
+            a.load_segments(segments)
+            if a.build_alignment() == 'Too large':
+                self.logger.error('Alignment of class {} is too large, reduce the chunk size'.format(protein_class))
+                return
+
+            chunk_labels = []
+            for segment, label, occurrence in alignment_columns(a.proteins):
+                if segment not in segment_labels:
+                    segment_labels[segment] = set()
+                segment_labels[segment].add(label)
+                chunk_labels.append((segment, label))
+            for pc in a.proteins:
+                records.append([pc.protein.entry_name] + list(protein_info[pc.protein_id]))
+            chunks.append((chunk_labels, encode_alignment(a.proteins)))
+
+        # merge the chunks into one matrix, positions are ordered as in Alignment.build_alignment
+        column_lookup = {}
+        store_segments = []
+        for segment, labels in segment_labels.items():
+            labels = sorted(labels, key=lambda x: x.split('x'))
+            for label in labels:
+                column_lookup[(segment, label)] = len(column_lookup)
+            store_segments.append([segment, labels])
+
+        residues = np.full((len(records), len(column_lookup)), ord('-'), dtype=np.uint8)
+        row = 0
+        for chunk_labels, encoded in chunks:
+            columns = [column_lookup[label] for label in chunk_labels]
+            residues[row:row + encoded.shape[0], columns] = encoded
+            row += encoded.shape[0]
+        residues[residues == ord('_')] = ord('-')
+
+        AlignmentStore.save(protein_class, records, store_segments, residues)
+        self.logger.info('Completed alignment store for class {} ({} proteins, {} positions)'.format(protein_class,
+            len(records), len(column_lookup)))
@@ -55,6 +55,7 @@ class Command(BaseCommand):
             # ['build_all_gtp_ligands', {'test_run': options['test']}],
             # ['build_endogenous_data_from_gtp_source', {'test_run': options['test']}],
             ['build_bias_preprocess_data', {'test_run': options['test']}],
+            ['build_bias_calculations', {'proc': options['proc']}],
             #['build_balanced_ligands', {'test_run': options['test']}],
             # ['build_chembl_data', {'test_run': options['test']}],
             ['build_mutant_data', {'test_run': options['test']}],
@@ -83,11 +84,15 @@ class Command(BaseCommand):
             ['build_residue_sets'],
             ['build_dynamine_annotation', {'proc': options['proc']}],
             ['build_complex_interactions'],
+            ['build_residue_contacts'],
             ['assign_structure_states'],
             ['build_contact_representative'],
             ['build_mammalian_representative'],
             ['upload_excel_bias_pathways'],
             ['build_receptor_similarity'],
+            ['build_alignment_store', {'proc': options['proc']}],
+            ['build_tree_cache'],
+            ['build_structure_info_index'],
             ['build_text'],
             ['build_release_notes'],
         ]
@@ -0,0 +1,43 @@
+from build.management.commands.base_build import Command as BaseBuild
+from ligand.functions import MaterializeOnTheFly
+from ligand.models import BiasedData, BiasCalculation
+
+
+class Command(BaseBuild):
+    help = 'Stores the on the fly bias calculations of all receptors, for the bias browsers and rank order pages'
+
+    # the calculations of a receptor are replaced as a whole, so a failed receptor can be calculated again
+    max_retries = 1
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--full',
+            action='store_true',
+            dest='full',
+            default=False,
+            help='Recalculate all publications, e.g. after endogenous ligand data changed. By default only publications with changed bias data are recalculated')
+        parser.add_argument('--receptors',
+            nargs='+',
+            type=int,
+            action='store',
+            dest='receptors',
+            default=False,
+            help='Only calculate these receptors (protein ids)')
+
+    def handle(self, *args, **options):
+        self.full = options['full']
+        receptors = list(BiasedData.objects.values_list('receptor_id', flat=True).distinct().order_by('receptor_id'))
+        if options['receptors']:
+            receptors = [r for r in receptors if r in options['receptors']]
+        else:
+            # receptors without any bias data anymore
+            BiasCalculation.objects.exclude(receptor__in=receptors).delete()
+
+        self.logger.info('CALCULATING BIAS OF {} RECEPTORS'.format(len(receptors)))
+        self.prepare_input(options['proc'], receptors)
+        self.logger.info('COMPLETED CALCULATING BIAS')
+
+    def process_item(self, receptor_id, iteration):
+        num_changed = MaterializeOnTheFly(receptor_id, full=self.full)
+        if num_changed:
+            self.logger.info('Calculated bias of {} publication(s) of receptor {}'.format(num_changed, receptor_id))
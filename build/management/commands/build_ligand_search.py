@@ -3,6 +3,7 @@ from django.db import connection
 from django.db import IntegrityError
 
 from ligand.models import Ligand, LigandFingerprint, LigandMol
+from ligand import fingerprint_index
 
 import os
 import django.apps
@@ -17,6 +18,10 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         super(Command, self).add_arguments(parser=parser)
         parser.add_argument('--verbose', default=False, action='store_true', help='Print progress in stdout.')
+        parser.add_argument('-p', '--proc', type=int, action='store', dest='proc', default=1,
+            help='Number of processes used to export the fingerprint index')
+        parser.add_argument('--skip-fingerprint-index', default=False, action='store_true',
+            help='Do not export the fingerprint index used for searches without the RDKit cartridge.')
 
     logger = logging.getLogger(__name__)
 
@@ -54,6 +59,12 @@ class Command(BaseCommand):
             self.logger.info(txt)
             if options['verbose']: print(txt)
 
-
-
- 
\ No newline at end of file
+        if not options['skip_fingerprint_index']:
+            txt = 'Exporting fingerprint index...'
+            self.logger.info(txt)
+            if options['verbose']: print(txt)
+            ligands = Ligand.objects.exclude(smiles__isnull=True).exclude(smiles='').order_by('pk').values_list('pk', 'smiles')
+            count = fingerprint_index.build_index(ligands.iterator(), processes=options['proc'])
+            txt = 'COMPLETED exporting fingerprint index of {} ligands'.format(count)
+            self.logger.info(txt)
+            if options['verbose']: print(txt)
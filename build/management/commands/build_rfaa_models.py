@@ -18,6 +18,7 @@ from Bio.PDB import PDBParser, PPBuilder, PDBIO
 from Bio import pairwise2
 
 from structure.functions import ParseRFAAModels
+from structure import structure_info_index
 from ligand.models import Ligand, LigandPeptideStructure
 from interaction.models import *
 from interaction.views import regexaa, check_residue, extract_fragment_rotamer
@@ -167,6 +168,9 @@ class Command(BaseBuild):
             print(msg)
             self.logger.error(msg)
 
+        # existing structures may have been updated
+        structure_info_index.invalidate()
+
     @staticmethod
     def queryset_iterator(qs, batchsize = 5000, gc_collect = True):
         # See https://www.guguweb.com/2020/03/27/optimize-django-memory-usage/
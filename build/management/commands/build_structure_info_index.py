@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from structure import structure_info_index
+
+import logging
+
+
+class Command(BaseCommand):
+    help = 'Builds the index of structure and model metadata used to annotate structure similarity search hits'
+
+    logger = logging.getLogger(__name__)
+
+    def handle(self, *args, **options):
+        try:
+            index = structure_info_index.get_index(rebuild=True)
+            for database, entries in index.items():
+                self.logger.info('Structure info index {} contains {} entries'.format(database, len(entries)))
+        except Exception as msg:
+            print(msg)
+            self.logger.error(msg)
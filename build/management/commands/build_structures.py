@@ -23,6 +23,7 @@ from Bio import pairwise2
 
 from structure.assign_generic_numbers_gpcr import GenericNumbering
 from structure.functions import StructureBuildCheck, ParseStructureCSV
+from structure import structure_info_index
 from ligand.models import Ligand, LigandType, LigandRole, LigandPeptideStructure
 from interaction.models import *
 from interaction.views import runcalculation_2022, regexaa, check_residue, extract_fragment_rotamer
@@ -180,6 +181,9 @@ class Command(BaseBuild):
             print(msg)
             self.logger.error(msg)
 
+        # existing structures may have been updated
+        structure_info_index.invalidate()
+
         print('Construct errors:')
         print(self.construct_errors)
         print('Rotamer erros:')
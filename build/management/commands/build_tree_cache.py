@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from common.selection import SimpleSelection, SelectionItem
+from phylogenetic_trees.tree_builder import BOOTSTRAP_PROCESSES
+from phylogenetic_trees.tree_cache import tree_cache
+from phylogenetic_trees.views import Treeclass
+from protein.models import ProteinFamily, ProteinSegment, Species
+
+import logging
+
+
+class Command(BaseCommand):
+    help = 'Writes the class-level statistics trees and pre-warms the phylogenetic tree cache with the default ' \
+        + 'class selections of the tree workflow'
+
+    logger = logging.getLogger(__name__)
+    classes = ['001','002','003','004','006','007']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--classes',
+            nargs='+',
+            action='store',
+            dest='classes',
+            default=False,
+            help='Only calculate the trees of these protein classes, e.g. 001 002')
+
+    def get_default_selection(self, protein_class):
+        """Selection of a whole class in the tree workflow: human receptors, the default annotation, the alignable
+        (TM) segments and the default tree settings."""
+        selection = SimpleSelection()
+        selection.targets = [SelectionItem('family', ProteinFamily.objects.get(slug=protein_class))]
+        selection.species = [SelectionItem('species', Species.objects.get(common_name='Human'))]
+        selection.segments = [SelectionItem(segment.category, segment) for segment in
+            ProteinSegment.objects.filter(partial=False, slug__startswith='TM')]
+        return selection
+
+    def handle(self, *args, **options):
+        classes = options['classes'] if options['classes'] else self.classes
+
+        # trees cached before this (re)build may be based on outdated data
+        tree_cache.new_version()
+        for cl in classes:
+            self.logger.info('Calculating trees of class {}'.format(cl))
+            try:
+                # statistics tree
+                Tree = Treeclass()
+                Tree.Prepare_file('', cl)
+
+                # tree of the default user selection, served from the cache
+                Tree = Treeclass()
+                Tree.processes = BOOTSTRAP_PROCESSES
+                Tree.Prepare_file(None, simple_selection=self.get_default_selection(cl))
+            except Exception as msg:
+                print(msg)
+                self.logger.error(msg)
+
+        num_trees, size = tree_cache.get_size()
+        self.logger.info('Tree cache contains {} trees ({:.1f} MB)'.format(num_trees, size / 1024 / 1024))
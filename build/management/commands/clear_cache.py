@@ -1,7 +1,10 @@
 from django.core.management.base import BaseCommand
 from django.core.cache import cache
 
+from phylogenetic_trees.tree_cache import tree_cache
+
 class Command(BaseCommand):
     def handle(self, *args, **options):
         cache.clear()
-        print("Cache cleared")
\ No newline at end of file
+        tree_cache.clear()
+        print("Cache cleared")
@@ -57,47 +57,40 @@ class Command(BaseBuild):
             print(msg)
             self.logger.error(msg)
 
-    def main_func(self, positions, iteration):
-        # pconfs
-        if not positions[1]:
-            pconfs = self.pconfs[positions[0]:]
-        else:
-            pconfs = self.pconfs[positions[0]:positions[1]]
-
+    def process_item(self, pconf, iteration):
         # find templates
-        for pconf in pconfs:
-            # filter structure sequence queryset to include only sequences from within the same class
-            pconf_class = pconf.protein.family.slug[:3]
-            class_sps = self.structures.filter(
-                protein_conformation__protein__parent__family__slug__startswith=pconf_class)
-            sps = []
-            sps_str = []
-            if class_sps.exists():
-                for structure in class_sps:
-                    sps.append(structure.protein_conformation.protein.parent) # use the wild-type sequence for main tpl
-                    sps_str.append(structure.protein_conformation.protein) # use the structure sequence for segment tpl
-            else:
-                for structure in self.structures:
-                    sps.append(structure.protein_conformation.protein.parent)
-                    sps_str.append(structure.protein_conformation.protein)
-
-            # overall
-            template = self.find_segment_template(pconf, sps, self.segments)
-            template_structure = self.fetch_template_structure(self.structures, template.protein.entry_name)
-            pconf.template_structure = template_structure
-            pconf.save()
-            self.logger.info("Assigned {} as overall template for {}".format(template_structure, pconf))
-
-            # for each segment
-            for segment in self.segments:
-                template = self.find_segment_template(pconf, sps_str, [segment])
-                template_structure = self.fetch_template_structure(self.structures, template.protein.parent.entry_name)
-                pcts, created = ProteinConformationTemplateStructure.objects.get_or_create(protein_conformation=pconf,
-                    protein_segment=segment, defaults={'structure': template_structure})
-                if pcts.structure != template_structure:
-                    pcts.structure = template_structure
-                    pcts.save()
-                self.logger.info("Assigned {} as {} template for {}".format(template_structure, segment, pconf))
+        # filter structure sequence queryset to include only sequences from within the same class
+        pconf_class = pconf.protein.family.slug[:3]
+        class_sps = self.structures.filter(
+            protein_conformation__protein__parent__family__slug__startswith=pconf_class)
+        sps = []
+        sps_str = []
+        if class_sps.exists():
+            for structure in class_sps:
+                sps.append(structure.protein_conformation.protein.parent) # use the wild-type sequence for main tpl
+                sps_str.append(structure.protein_conformation.protein) # use the structure sequence for segment tpl
+        else:
+            for structure in self.structures:
+                sps.append(structure.protein_conformation.protein.parent)
+                sps_str.append(structure.protein_conformation.protein)
+
+        # overall
+        template = self.find_segment_template(pconf, sps, self.segments)
+        template_structure = self.fetch_template_structure(self.structures, template.protein.entry_name)
+        pconf.template_structure = template_structure
+        pconf.save()
+        self.logger.info("Assigned {} as overall template for {}".format(template_structure, pconf))
+
+        # for each segment
+        for segment in self.segments:
+            template = self.find_segment_template(pconf, sps_str, [segment])
+            template_structure = self.fetch_template_structure(self.structures, template.protein.parent.entry_name)
+            pcts, created = ProteinConformationTemplateStructure.objects.get_or_create(protein_conformation=pconf,
+                protein_segment=segment, defaults={'structure': template_structure})
+            if pcts.structure != template_structure:
+                pcts.structure = template_structure
+                pcts.save()
+            self.logger.info("Assigned {} as {} template for {}".format(template_structure, segment, pconf))
 
     def find_segment_template(self, pconf, sconfs, segments):
             a = Alignment()
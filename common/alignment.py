@@ -8,7 +8,9 @@ from operator import itemgetter
 import numpy as np
 
 from alignment.functions import prepare_aa_group_preference
-from Bio.Align import substitution_matrices
+from common.alignment_matrix import (AlignmentMatrix, alignment_columns, count_residues, encode_alignment,
+                                     format_similarity, get_scoring_matrix, group_membership,
+                                     pairwise_similarity_matrix, percentages)
 from common.definitions import *
 from django.conf import settings
 from django.core.cache import cache, caches
@@ -60,6 +62,7 @@ class Alignment:
         self.normalized_scores = OrderedDict()
         self.stats_done = False
         self.zscales = OrderedDict()
+        self.matrix = None # columnar store of the built alignment (AlignmentMatrix)
 
         # refers to which ProteinConformation attribute to order by (identity, similarity or similarity score)
         self.order_by = 'similarity'
@@ -326,13 +329,17 @@ class Alignment:
 
     # AJK: point for optimization - primary bottleneck (#1 cleaning, #2 last for-loop in this function)
     def build_alignment(self):
-        """Fetch selected residues from DB and build an alignment."""
+        """Fetch selected residues from DB and build an alignment.
+
+        Residues are fetched as value rows (no Residue objects are created) and collected in a columnar
+        AlignmentMatrix, from which the alignment property of each protein is formatted.
+        """
         # AJK: prevent prefetching all data for large alignments before checking #residues (DB + memory killer)
         rs = Residue.objects.filter(protein_segment__slug__in=self.segments, protein_conformation__in=self.proteins)
 
 
-        self.number_of_residues_total = len(rs)
-        if self.number_of_residues_total>125000: #300 receptors, 400 residues limit
+        self.number_of_residues_total = rs.count()
+        if self.number_of_residues_total>500000: #1200 receptors, 400 residues limit
             return "Too large"
 
         # AJK: performance boost -> Internal caching (not for very small alignments)
@@ -341,17 +348,9 @@ class Alignment:
 
         #cache_alignments.set(cache_key, 0, 0)
         if self.number_of_residues_total < 2500 or not cache_alignments.has_key(cache_key):
-            # fetch segment residues
-            if not self.ignore_alternative_residue_numbering_schemes and len(self.numbering_schemes) > 1:
-                rs = Residue.objects.filter(
-                    protein_segment__slug__in=self.segments, protein_conformation__in=self.proteins).prefetch_related(
-                    'protein_conformation__protein', 'protein_conformation__state', 'protein_segment',
-                    'generic_number__scheme', 'display_generic_number__scheme', 'alternative_generic_numbers__scheme')
-            else:
-                rs = Residue.objects.filter(
-                    protein_segment__slug__in=self.segments, protein_conformation__in=self.proteins).prefetch_related(
-                    'protein_conformation__protein', 'protein_conformation__state', 'protein_segment',
-                    'generic_number__scheme', 'display_generic_number__scheme')
+            residue_fields = ('id', 'protein_conformation_id', 'protein_segment__slug', 'protein_segment__category',
+                              'generic_number__label', 'display_generic_number_id', 'display_generic_number__label',
+                              'display_generic_number__scheme__short_name', 'amino_acid', 'sequence_number')
 
             # If segment flagged to only include the alignable residues, exclude the ones with no GN
             for s in self.segments_only_alignable:
@@ -361,29 +360,31 @@ class Alignment:
             crs = {}
             for segment in self.segments:
                 if segment == self.custom_segment_label or self.use_residue_groups:
-                    if not self.ignore_alternative_residue_numbering_schemes and len(self.numbering_schemes) > 1:
-                        crs[segment] = Residue.objects.filter(
-                            generic_number__label__in=self.segments[segment],
-                            protein_conformation__in=self.proteins).prefetch_related(
-                            'protein_conformation__protein', 'protein_conformation__state', 'protein_segment',
-                            'generic_number__scheme', 'display_generic_number__scheme', 'alternative_generic_numbers__scheme')
-                    else:
-                        crs[segment] = Residue.objects.filter(
-                            generic_number__label__in=self.segments[segment],
-                            protein_conformation__in=self.proteins).prefetch_related(
-                            'protein_conformation__protein', 'protein_conformation__state', 'protein_segment',
-                            'generic_number__scheme', 'display_generic_number__scheme')
+                    crs[segment] = Residue.objects.filter(generic_number__label__in=self.segments[segment],
+                                                          protein_conformation__in=self.proteins)
 
-            # create a dict of proteins, segments and residues
+            # fetch alternative generic numbers, only required to display numbers in other schemes
+            alternative_numbers = {}
+            if not self.ignore_alternative_residue_numbering_schemes and len(self.numbering_schemes) > 1:
+                for residues in [rs] + list(crs.values()):
+                    arns = Residue.alternative_generic_numbers.through.objects.filter(
+                        residue__in=residues.values('id')).values_list('residue_id', 'residuegenericnumber__label',
+                                                                       'residuegenericnumber__scheme__slug')
+                    residue_arns = {}
+                    for residue_id, label, scheme_slug in arns:
+                        residue_arns.setdefault(residue_id, []).append((label, scheme_slug))
+                    for residue_id, labels in residue_arns.items():
+                        alternative_numbers.setdefault(residue_id, labels)
+
+            # create a dict of protein conformations, segments and residues
             proteins = {}
             segment_counters = {}
             aligned_residue_encountered = {}
-            fusion_protein_inserted = {}
-            for r in rs:
-                ps = r.protein_segment.slug
+            for r in rs.values_list(*residue_fields, named=True):
+                ps = r.protein_segment__slug
 
-                # identifiers for protein/state
-                pcid = r.protein_conformation.protein.entry_name + "-" + r.protein_conformation.state.slug
+                # identifier for protein/state
+                pcid = r.protein_conformation_id
 
                 # update protein dict
                 if pcid not in proteins:
@@ -402,7 +403,7 @@ class Alignment:
                 # 2. The part before the aligned part in a partially aligned segment
                 # 3. The part after the aligned part in a partially aligned segment
                 # 4. An unaligned segment (then there is only one part)
-                if r.generic_number:
+                if r.generic_number__label:
                     segment_part = 1
                 elif ps in settings.REFERENCE_POSITIONS and not aligned_residue_encountered[pcid][ps]:
                     segment_part = 2
@@ -423,16 +424,9 @@ class Alignment:
                 else:
                     segment_counters[pcid][part_ps] += 1
 
-
-                # update fusion protein tracker
-                if pcid not in fusion_protein_inserted:
-                    fusion_protein_inserted[pcid] = {}
-                if ps not in fusion_protein_inserted[pcid]:
-                    fusion_protein_inserted[pcid][ps] = False
-
                 # user generic numbers as keys for aligned segments
-                if r.generic_number:
-                    proteins[pcid][ps][r.generic_number.label] = r
+                if r.generic_number__label:
+                    proteins[pcid][ps][r.generic_number__label] = r
 
                     # register the presence of an aligned residue
                     aligned_residue_encountered[pcid][ps] = True
@@ -461,6 +455,7 @@ class Alignment:
             # correct alignment of split segments
             for pcid, segments in proteins.items():
                 for ps, positions in segments.items():
+                    segment_positions = set(self.segments[ps])
                     pos_num = 1
                     pos_num_after = 1
                     for pos_label in sorted(positions):
@@ -468,7 +463,7 @@ class Alignment:
                         right_align = False
                         # In a "normal", non split, unaligned segment, is this past the middle?
                         if (pos_label.startswith('01-')
-                                and res_obj.protein_segment.category != 'terminus'
+                                and res_obj.protein_segment__category != 'terminus'
                                 and pos_num > (segment_counters[pcid][ps] / 2 + 0.5)):
                             right_align = True
                         # In an partially aligned segment (prefixed with 00), where conserved residues are lacking, treat
@@ -476,10 +471,10 @@ class Alignment:
                         elif (pos_label.startswith('00-')
                               and not aligned_residue_encountered[pcid][ps]
                               and pos_num > (segment_counters[pcid][ps] / 2 + 0.5)
-                              or res_obj.protein_segment.slug == 'N-term'):
+                              or res_obj.protein_segment__slug == 'N-term'):
                             right_align = True
                         # In an N-terminus, always right align everything
-                        elif pos_label.startswith('01-') and res_obj.protein_segment.slug == 'N-term':
+                        elif pos_label.startswith('01-') and res_obj.protein_segment__slug == 'N-term':
                             right_align = True
 
                         if right_align:
@@ -505,21 +500,22 @@ class Alignment:
                             proteins[pcid][ps][updated_index] = proteins[pcid][ps].pop(pos_label)
                             pos_label = updated_index
                             pos_num_after += 1
-                        if pos_label not in self.segments[ps]:
+                        if pos_label not in segment_positions:
                             self.segments[ps].append(pos_label)
+                            segment_positions.add(pos_label)
                         pos_num += 1
 
             # individually selected residues (Custom segment)
             for segment in self.segments:
                 if segment == self.custom_segment_label or self.use_residue_groups:
-                    for r in crs[segment]:
+                    for r in crs[segment].values_list(*residue_fields, named=True):
                         ps = segment
-                        pcid = r.protein_conformation.protein.entry_name + "-" + r.protein_conformation.state.slug
+                        pcid = r.protein_conformation_id
                         if pcid not in proteins:
                             proteins[pcid] = {}
                         if ps not in proteins[pcid]:
                             proteins[pcid][ps] = {}
-                        proteins[pcid][ps][r.generic_number.label] = r
+                        proteins[pcid][ps][r.generic_number__label] = r
 
             # remove split segments from segment list and order segment positions
             for segment, positions in self.segments.items():
@@ -533,99 +529,78 @@ class Alignment:
                         sorted_segment.append(gn)
                     self.segments[segment] = sorted_segment
 
+            # fill the alignment matrix
             self.unique_proteins = list(set(self.proteins))
-            for pc in self.unique_proteins:
-                row = OrderedDict()
-                pc.alignment_list = []
-                for segment, positions in self.segments.items():
-                    s = []
-                    first_residue_found = False
-
-                    # counters to keep track of gaps at the end of a segment
-                    gap_counter = 0
-                    position_counter = 1
-
-                    # numbering scheme
-                    ns_slug = pc.protein.residue_numbering_scheme.slug
-
-                    # loop all positions in this segment
-                    for pos in positions:
-                        try:
-                            # find the residue record from the dict defined above
-                            pcid = pc.protein.entry_name + "-" + pc.state.slug
-                            r = proteins[pcid][segment][pos]
-
-                            # add position to the list of positions that are not empty
-                            if pos not in self.positions:
-                                self.positions.add(pos)
-
-                            # add display number to list of display numbers for this position
-                            if r.display_generic_number:
-                                if pos not in self.generic_numbers[ns_slug][segment]:
-                                    self.generic_numbers[ns_slug][segment][pos] = []
-                                if r.display_generic_number.label not in self.generic_numbers[ns_slug][segment][pos]:
-                                    self.generic_numbers[ns_slug][segment][pos].append(r.display_generic_number.label)
-                            else:
-                                if pos not in self.generic_numbers[ns_slug][segment]:
-                                    self.generic_numbers[ns_slug][segment][pos] = []
-
-                            # add display numbers for other numbering schemes of selected proteins
-                            if (not self.ignore_alternative_residue_numbering_schemes and len(self.numbering_schemes) > 1):
-                                if r.generic_number:
-                                    for arn in r.alternative_generic_numbers.all():
-                                        for ns in self.numbering_schemes:
-                                            if (arn.scheme.slug == ns[0] and arn.scheme.slug != ns_slug):
-                                                self.generic_numbers[arn.scheme.slug][segment][pos].append(arn.label)
-                                                break
-                                else:
-                                    for ns in self.numbering_schemes:
-                                        if pos not in self.generic_numbers[ns[0]][segment] and ns[0] != ns_slug:
-                                            self.generic_numbers[ns[0]][segment][pos] = []
-
-                            # append the residue to the matrix
-                            if r.generic_number:
-                                # s.append([pos, r.display_generic_number.label, r.amino_acid,
-                                #   r.display_generic_number.scheme.short_name, r.sequence_number])
-
-                                s.append([pos, r.display_generic_number.label, r.amino_acid,
-                                          r.display_generic_number.scheme.short_name, r.sequence_number, r.generic_number.label])
-
-
-                                # update generic residue object dict
-                                if pos not in self.generic_number_objs:
-                                    self.generic_number_objs[pos] = r.display_generic_number
-                            else:
-                                s.append([pos, "", r.amino_acid, "", r.sequence_number])
+            self.matrix = AlignmentMatrix([pc.id for pc in self.unique_proteins], self.segments)
+            selected_schemes = [ns[0] for ns in self.numbering_schemes]
+            display_number_ids = {}
+            for i, pc in enumerate(self.unique_proteins):
+                # numbering scheme
+                ns_slug = pc.protein.residue_numbering_scheme.slug
+                protein_residues = proteins.get(pc.id, {})
 
-                            first_residue_found = True
+                for segment, positions in self.segments.items():
+                    segment_residues = protein_residues.get(segment, {})
+                    for column, pos in enumerate(positions, start=self.matrix.segments[segment][0]):
+                        # find the residue record from the dict defined above, positions without one are gaps
+                        r = segment_residues.get(pos)
+                        if r is None:
+                            continue
 
-                            # reset gap counter
-                            gap_counter = 0
-                        except:
-                            if self.show_padding:
-                                padding_symbol = '_'
-                            else:
-                                padding_symbol = '-'
-                            if first_residue_found:
-                                s.append([pos, False, '-', 0])
-
-                                # update gap counter
-                                gap_counter += 1
-
-                                # if this is the last residue and there are gaps and the end of the segment, update them to
-                                # end gaps
-                                if self.show_padding:
-                                    if (position_counter) == len(positions):
-                                        for i in range(gap_counter):
-                                            s[len(positions)-(i+1)][2] = padding_symbol
+                        # add position to the list of positions that are not empty
+                        self.positions.add(pos)
+
+                        # add display number to list of display numbers for this position
+                        if pos not in self.generic_numbers[ns_slug][segment]:
+                            self.generic_numbers[ns_slug][segment][pos] = []
+                        if (r.display_generic_number_id
+                                and r.display_generic_number__label not in self.generic_numbers[ns_slug][segment][pos]):
+                            self.generic_numbers[ns_slug][segment][pos].append(r.display_generic_number__label)
+
+                        # add display numbers for other numbering schemes of selected proteins
+                        if (not self.ignore_alternative_residue_numbering_schemes and len(self.numbering_schemes) > 1):
+                            if r.generic_number__label:
+                                try:
+                                    for label, scheme_slug in alternative_numbers.get(r.id, []):
+                                        if scheme_slug in selected_schemes and scheme_slug != ns_slug:
+                                            self.generic_numbers[scheme_slug][segment][pos].append(label)
+                                except KeyError:
+                                    # position unknown in the other scheme, shown as a gap
+                                    continue
                             else:
-                                s.append([pos, False, padding_symbol, 0])
-
-                        # update position counter
-                        position_counter += 1
-                    row[segment] = s
-                    pc.alignment_list.append(s)
-                pc.alignment = row
+                                for ns in selected_schemes:
+                                    if pos not in self.generic_numbers[ns][segment] and ns != ns_slug:
+                                        self.generic_numbers[ns][segment][pos] = []
+
+                        # add the residue to the matrix, aligned residues without a display number are shown as gaps
+                        if r.generic_number__label:
+                            if not r.display_generic_number_id:
+                                continue
+                            self.matrix.set_residue(i, column, r.amino_acid, r.sequence_number,
+                                                    r.display_generic_number__label,
+                                                    r.display_generic_number__scheme__short_name)
+
+                            # update generic residue object dict
+                            if pos not in display_number_ids:
+                                display_number_ids[pos] = r.display_generic_number_id
+                        else:
+                            self.matrix.set_residue(i, column, r.amino_acid, r.sequence_number)
+
+            # gaps at the beginning or end of a segment
+            if self.show_padding:
+                self.matrix.mark_padding('_')
+
+            # generic residue objects, fetched in one query
+            display_number_objs = ResidueGenericNumber.objects.filter(
+                pk__in=set(display_number_ids.values())).select_related('scheme').in_bulk()
+            for pos, display_number_id in display_number_ids.items():
+                if pos not in self.generic_number_objs:
+                    self.generic_number_objs[pos] = display_number_objs[display_number_id]
+
+            # format the matrix rows
+            for i, pc in enumerate(self.unique_proteins):
+                pc.alignment = self.matrix.row(i)
+                pc.alignment_list = list(pc.alignment.values())
             #                pc.alignment_list = row_list # FIXME redundant, remove when dependecies are removed
 
             self.sort_generic_numbers()
@@ -655,7 +630,8 @@ class Alignment:
                               #                            'numbering_schemes': self.numbering_schemes,
                               'positions': self.positions,
                               'segments': self.segments,
-                              'zscales': self.zscales}
+                              'zscales': self.zscales,
+                              'matrix': self.matrix}
                 cache_alignments.set(cache_key, cache_data, 60*60*24*14)
         else:
             cache_data = cache_alignments.get(cache_key)
@@ -678,6 +654,7 @@ class Alignment:
             self.positions = cache_data['positions']
             self.segments = cache_data['segments']
             self.zscales = cache_data['zscales']
+            self.matrix = cache_data.get('matrix')
             self.stats_done = True
 
         # Adapt alignment to order in current self.proteins
@@ -721,6 +698,10 @@ class Alignment:
         #                        if pos in self.segments[segment]:
         #                            self.segments[segment].remove(pos)
 
+        # columnar store
+        if self.matrix is not None:
+            self.matrix = self.matrix.select_positions(self.positions)
+
         # proteins
         # AJK optimized cleaning alignment - deepcopy not required and faster removal
         #proteins = deepcopy(self.proteins) # deepcopy is required because the list changes during the loop
@@ -786,131 +767,97 @@ class Alignment:
         return generic_number
 
     def calculate_statistics(self, ignore={}):
-        """Calculate consensus sequence and amino acid and feature frequency."""
+        """Calculate consensus sequence and amino acid and feature frequency.
+
+        Residues are counted for all positions at once on the encoded alignment. Residues of the proteins (entry names)
+        listed for a generic number in ignore are not counted, and neither are gaps when ignore is given.
+        """
         if not self.stats_done:
-            feature_count = OrderedDict()
-            most_freq_aa = OrderedDict()
-            amino_acids = OrderedDict([(a, 0) for a in AMINO_ACIDS]) # from common.definitions
             self.amino_acids = list(AMINO_ACIDS.keys())
-
-            # AJK: optimized for speed - split into multiple steps
-            for i, p in enumerate(self.unique_proteins):
-                entry_name = p.protein.entry_name
-                # print(entry_name)
-                for j, s in p.alignment.items():
-                    if i == 0:
-                        self.aa_count[j] = OrderedDict()
-                    for p in s:
-                        generic_number = p[0]
-                        display_generic_number = p[1]
-                        amino_acid = p[2]
-
-                        ignore_list = ignore.get(generic_number, [])
-
-                        # Indicate gap and collect statistics
-                        if amino_acid in self.gaps:
-                            amino_acid = '-'
-
-                        # Skip when unknown amino acid type
-                        elif amino_acid == 'X':
-                            continue
-
-                        # skip when position is on the ignore list
-                        if entry_name in ignore_list:
-                            continue
-
-                        if ignore and amino_acid in self.gaps:
-                            continue
-
-                        # Init counters
-                        if generic_number not in self.aa_count[j]:
-                            self.aa_count[j][generic_number] = amino_acids.copy()
-                            #                        if generic_number in self.generic_number_objs:
-                            self.aa_count_with_protein[generic_number] = {}
-
-                        # update amino acid counter for this generic number
-                        self.aa_count[j][generic_number][amino_acid] += 1
-
-                        #if generic_number in self.generic_number_objs:
-                        if amino_acid not in self.aa_count_with_protein[generic_number]:
-                            self.aa_count_with_protein[generic_number][amino_acid] = {entry_name}
-                        elif entry_name not in self.aa_count_with_protein[generic_number][amino_acid]:
-                            self.aa_count_with_protein[generic_number][amino_acid].add(entry_name)
-
-
-            # AJK: Only need for update at the end of loop
-            # 1. Update most frequent amino_acids for this generic number
-            # 2. Update feature counter for this generic number
-            features = OrderedDict([(a, 0) for a in AMINO_ACID_GROUPS])
             self.features_combo = [(x, y['display_name_short'], y['length']) for x,y in zip(list(AMINO_ACID_GROUP_NAMES.values()), list(AMINO_ACID_GROUP_PROPERTIES.values()))]
             self.features = list(AMINO_ACID_GROUP_NAMES.values())
 
-            for j in self.aa_count:
-                most_freq_aa[j] = OrderedDict()
-                feature_count[j] = OrderedDict()
-                for generic_number in self.aa_count[j]:
-                    feature_count[j][generic_number] = features.copy()
-                    most_freq_aa[j][generic_number] = [[], 0]
-                    for amino_acid in self.aa_count[j][generic_number]:
-                        # Most frequent AA
-                        if self.aa_count[j][generic_number][amino_acid] > most_freq_aa[j][generic_number][1]:
-                            most_freq_aa[j][generic_number] = [[amino_acid], self.aa_count[j][generic_number][amino_acid]]
-                        elif self.aa_count[j][generic_number][amino_acid] == most_freq_aa[j][generic_number][1]:
-                            if amino_acid not in most_freq_aa[j][generic_number][0]:
-                                most_freq_aa[j][generic_number][0].append(amino_acid)
-
-                        # create property frequency
-                        if self.aa_count[j][generic_number][amino_acid] > 0:
-                            for feature in AMINO_ACID_GROUPS_AA[amino_acid]:
-                                feature_count[j][generic_number][feature] += self.aa_count[j][generic_number][amino_acid]
+            # encode the alignment, the columns are labelled by generic number and grouped per segment. Positions that
+            # are missing from some rows of a ragged alignment are encoded as NUL, which is not counted
+            encoded = encode_alignment(self.unique_proteins, missing='\0')
+            entry_names = np.array([p.protein.entry_name for p in self.unique_proteins], dtype=object)
+            segment_columns = OrderedDict()
+            column_labels = []
+            for segment, generic_number, occurrence in alignment_columns(self.unique_proteins):
+                segment_columns.setdefault(segment, OrderedDict()).setdefault(generic_number, len(column_labels))
+                column_labels.append(generic_number)
+
+            # residues left out of the statistics
+            skip = None
+            if ignore:
+                skip = np.isin(encoded, [ord(gap) for gap in self.gaps])
+                for column, generic_number in enumerate(column_labels):
+                    if generic_number in ignore:
+                        skip[:, column] |= [entry_name in ignore[generic_number] for entry_name in entry_names]
+
+            # amino acid counts (amino acids x positions) and feature counts (features x positions)
+            codes, counts = count_residues(encoded, self.amino_acids, self.gaps, skip)
+            feature_counts = group_membership(self.amino_acids, AMINO_ACID_GROUPS).T.astype(np.int64) @ counts
+            most_frequent = counts == counts.max(axis=0)
+            counted = codes >= 0
+
+            # generic numbers are registered in the order in which they are first counted, protein by protein
+            first_counted = np.where(counted.any(axis=0), counted.argmax(axis=0), -1).tolist()
+            for segment, columns in segment_columns.items():
+                self.aa_count[segment] = OrderedDict()
+                counted_columns = [column for column in columns.values() if first_counted[column] >= 0]
+                for column in sorted(counted_columns, key=lambda c: (first_counted[c], c)):
+                    generic_number = column_labels[column]
+                    self.aa_count[segment][generic_number] = OrderedDict(zip(self.amino_acids, counts[:, column].tolist()))
+
+                    # proteins with each amino acid at this generic number
+                    if generic_number not in self.aa_count_with_protein:
+                        self.aa_count_with_protein[generic_number] = {}
+                    for code in np.flatnonzero(counts[:, column]).tolist():
+                        proteins_with_aa = set(entry_names[codes[:, column] == code])
+                        if self.amino_acids[code] not in self.aa_count_with_protein[generic_number]:
+                            self.aa_count_with_protein[generic_number][self.amino_acids[code]] = proteins_with_aa
+                        else:
+                            self.aa_count_with_protein[generic_number][self.amino_acids[code]] |= proteins_with_aa
 
             # merge the amino acid counts into a consensus sequence
             num_proteins = len(self.unique_proteins)
+            max_percentages = percentages(counts.max(axis=0), num_proteins).tolist()
             sequence_counter = 1
-            for i, s in most_freq_aa.items():
+            for i, s in self.aa_count.items():
                 self.consensus[i] = OrderedDict()
                 self.forced_consensus[i] = OrderedDict()
-                if i == 'Custom' and s == 'x':
-                    sorted_res = sorted(s, key=lambda x: (x.split("x")[0], x.split("x")[1]))
-                elif i == 'Custom' and s == '.':
-                    sorted_res = sorted(s, key=lambda x: (x.split(".")[0], x.split(".")[1]))
-                else:
-                    sorted_res = sorted(s)
-                for p in sorted_res:
-                    r = s[p]
-                    conservation = str(round(r[1]/num_proteins*100))
-                    if len(conservation) == 1:
-                        cons_interval = '0'
-                    else:
-                        # the intervals are defined as 0-10, where 0 is 0-9, 1 is 10-19 etc. Used for colors.
-                        cons_interval = conservation[:-1]
+                for p in sorted(s):
+                    column = segment_columns[i][p]
+                    most_freq_aa = [self.amino_acids[k] for k in np.flatnonzero(most_frequent[:, column])]
+                    cons_interval = self._frequency_interval(max_percentages[column])[1]
 
                     # forced consensus sequence uses the first residue to break ties
-                    self.forced_consensus[i][p] = r[0][0]
+                    self.forced_consensus[i][p] = most_freq_aa[0]
 
                     # consensus sequence displays + in tie situations
-                    num_freq_aa = len(r[0])
+                    num_freq_aa = len(most_freq_aa)
                     if num_freq_aa == 1:
                         # Use raw data
                         self.consensus[i][p] = [
-                            r[0][0],
+                            most_freq_aa[0],
                             cons_interval,
-                            round(r[1]/num_proteins*100),
+                            max_percentages[column],
                             ""
                         ]
                     elif num_freq_aa > 1 and ignore:
                         self.consensus[i][p] = [
-                            r[0][0],
+                            most_freq_aa[0],
                             cons_interval,
-                            round(r[1]/num_proteins*100),
-                            ", ".join(r[0])
+                            max_percentages[column],
+                            ", ".join(most_freq_aa)
                         ]
                     elif num_freq_aa > 1:
                         self.consensus[i][p] = [
                             '+',
                             cons_interval,
-                            round(r[1]/num_proteins*100),
-                            ", ".join(r[0])
+                            max_percentages[column],
+                            ", ".join(most_freq_aa)
                         ]
 
                     # create a residue object full consensus
@@ -920,7 +867,7 @@ class Alignment:
                         res.display_generic_number = self.generic_number_objs[p]
                     res.family_generic_number = p
                     res.segment_slug = i
-                    res.amino_acid = r[0][0]
+                    res.amino_acid = most_freq_aa[0]
                     res.frequency = self.consensus[i][p][2]
                     self.full_consensus.append(res)
 
@@ -928,70 +875,24 @@ class Alignment:
                     sequence_counter += 1
 
             # process amino acid frequency
+            aa_percentages = percentages(counts, num_proteins).tolist()
             for i, amino_acid in enumerate(AMINO_ACIDS):
                 self.amino_acid_stats.append([])
-                j = 0
-                for segment, segment_num in self.aa_count.items():
-                    self.amino_acid_stats[i].append([])
-                    k = 0
-                    # if segment == 'Custom' and segment_num == 'x':
-                    #     sorted_res = sorted(segment_num, key=lambda x: (x.split("x")[0], x.split("x")[1]))
-                    # elif segment == 'Custom' and segment_num == '.':
-                    #     sorted_res = sorted(segment_num, key=lambda x: (x.split(".")[0], x.split(".")[1]))
-                    # else:
-                    #sorted_res = segment_num
-                    for gn in self.generic_numbers[self.numbering_schemes[0][0]][segment]:
-                        aas = segment_num[gn]
-                        self.amino_acid_stats[i][j].append([])
-                        for aa, freq in aas.items():
-                            if aa == amino_acid:
-                                frequency = str(round(freq/num_proteins*100))
-                                if len(frequency) == 1:
-                                    freq_interval = '0'
-                                else:
-                                    # intervals defined in the same way as for the consensus sequence
-                                    freq_interval = frequency[:-1]
-                                self.amino_acid_stats[i][j][k] = [frequency, freq_interval]
-                        k += 1
-                    j += 1
-
-            # create index and prepare stats array
-            index_AAG = {}
+                for segment in self.aa_count:
+                    self.amino_acid_stats[i].append([
+                        self._frequency_interval(aa_percentages[i][segment_columns[segment][gn]])
+                        for gn in self.generic_numbers[self.numbering_schemes[0][0]][segment]
+                    ])
+
+            # process feature frequency per segment
+            feature_percentages = percentages(feature_counts, num_proteins).tolist()
             for i, feature in enumerate(AMINO_ACID_GROUPS):
-                index_AAG[feature] = i
                 self.feature_stats.append([])
-                for segment in feature_count:
-                    self.feature_stats[i].append([])
-
-            j = 0
-            for segment, segment_num in feature_count.items():
-                k = 0
-
-                # first_gn = list(segment_num.items())[0]
-                # if segment == 'Custom' and 'x' in first_gn:
-                #     sorted_res = sorted(segment_num, key=lambda x: (x.split("x")[0], x.split("x")[1]))
-                # elif segment == 'Custom' and '.' in first_gn:
-                #     sorted_res = sorted(segment_num, key=lambda x: (x.split(".")[0], x.split(".")[1]))
-                # else:
-
-                for gn in self.generic_numbers[self.numbering_schemes[0][0]][segment]:
-                    fs = segment_num[gn]
-
-                    for f, freq in fs.items():
-                        # find feature key
-                        i = index_AAG[f]
-
-                        frequency = str(round(freq/num_proteins*100))
-                        if len(frequency) == 1:
-                            freq_interval = '0'
-                        else:
-                            # intervals defined in the same way as for the consensus sequence
-                            freq_interval = frequency[:-1]
-
-                        self.feature_stats[i][j].append([])
-                        self.feature_stats[i][j][k] = [frequency, freq_interval]
-                    k += 1
-                j += 1
+                for segment in self.aa_count:
+                    self.feature_stats[i].append([
+                        self._frequency_interval(feature_percentages[i][segment_columns[segment][gn]])
+                        for gn in self.generic_numbers[self.numbering_schemes[0][0]][segment]
+                    ])
 
             # process feature frequency
             feats = OrderedDict()
@@ -1024,6 +925,14 @@ class Alignment:
             self.calculate_zscales(True)
             self.stats_done = True
 
+    def _frequency_interval(self, percentage):
+        """Format a percentage as [frequency, interval] for colouring."""
+        frequency = str(percentage)
+        if len(frequency) == 1:
+            return [frequency, '0']
+        # the intervals are defined as 0-10, where 0 is 0-9, 1 is 10-19 etc. Used for colors.
+        return [frequency, frequency[:-1]]
+
     def calculate_aa_count_per_generic_number(self):
         """Small function to return a dictionary of display_generic_number and the frequency of each AA."""
         generic_lookup_aa_freq = {}
@@ -1092,14 +1001,18 @@ class Alignment:
             protein_name = "[" + protein.protein.species.common_name + "] " + protein.protein.name
             self.similarity_matrix[protein_key] = {'name': protein_name, 'values': [None] * len(self.proteins)}
 
-        # similarity comparisons
+        # similarity comparisons for all pairs at once on the encoded alignment
+        encoded = encode_alignment(self.proteins)
+        identities, similarities, similarity_scores, total_counts = pairwise_similarity_matrix(encoded, gaps=self.gaps)
+
         for i, protein in enumerate(self.proteins):
             protein_key = protein.protein.entry_name
             self.similarity_matrix[protein_key]['values'][i] = ['-', '-']
 
             for k in range(i+1, len(self.proteins)):
                 # calculate identity, similarity and similarity score to the reference
-                calc_values = self.pairwise_similarity(self.proteins[i], self.proteins[k])
+                calc_values = format_similarity(identities[i, k], similarities[i, k], similarity_scores[i, k],
+                                                total_counts[i, k])
 
                 # Similarity
                 value = calc_values[1].strip()
@@ -1217,7 +1130,7 @@ class Alignment:
         similarityscore = 0
         totalcount = 0
         totalsimilarity = 0
-        scoring_matrix = substitution_matrices.load("BLOSUM62")
+        scoring_matrix = get_scoring_matrix()
         for j, s in protein_2.alignment.items():
             for k, p in enumerate(s):
                 reference_residue = protein_1.alignment[j][k][2]
@@ -1259,7 +1172,7 @@ class Alignment:
         similarities = OrderedDict()
         similarity_scores = OrderedDict()
         ref_seq, temp_seq = '',''
-        scoring_matrix = substitution_matrices.load("BLOSUM62")
+        scoring_matrix = get_scoring_matrix()
         for j, s in protein_2.alignment.items():
             for k, p in enumerate(s):
                 reference_residue = protein_1.alignment[j][k][2]
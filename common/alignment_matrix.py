@@ -0,0 +1,254 @@
+"""
+Vectorized calculations on alignments encoded as (proteins x positions) integer matrices.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from Bio.Align import substitution_matrices
+
+
+GAP_SYMBOLS = ('-', '_')
+
+_scoring_matrix = None
+
+
+def get_scoring_matrix():
+    """Return the BLOSUM62 substitution matrix, loaded only once per process."""
+    global _scoring_matrix
+    if _scoring_matrix is None:
+        _scoring_matrix = substitution_matrices.load("BLOSUM62")
+    return _scoring_matrix
+
+
+class AlignmentMatrix:
+    """Columnar backing store of a built alignment.
+
+    Residues are kept as a (proteins x positions) uint8 matrix of amino acid codes, with parallel matrices for sequence
+    numbers and display generic numbers. Display generic numbers index the shared display_numbers list of
+    (label, scheme short name) tuples, and positions are shared by all rows.
+    """
+    def __init__(self, protein_ids, segments):
+        self.protein_ids = list(protein_ids)
+        self.segments = OrderedDict()
+        self.positions = []
+        self.display_numbers = []
+        self._display_lookup = {}
+        for segment, positions in segments.items():
+            self.segments[segment] = (len(self.positions), len(self.positions) + len(positions))
+            self.positions.extend(positions)
+
+        shape = (len(self.protein_ids), len(self.positions))
+        self.amino_acids = np.full(shape, ord('-'), dtype=np.uint8)
+        self.sequence_numbers = np.zeros(shape, dtype=np.int32)
+        self.display_index = np.full(shape, -1, dtype=np.int32)
+        self.has_residue = np.zeros(shape, dtype=bool)
+
+    def set_residue(self, row, column, amino_acid, sequence_number, display_label=None, display_scheme=None):
+        """Store a residue, display numbers are only given for residues with a generic number."""
+        self.amino_acids[row, column] = ord(amino_acid)
+        self.sequence_numbers[row, column] = sequence_number
+        self.has_residue[row, column] = True
+        if display_label is not None:
+            key = (display_label, display_scheme)
+            if key not in self._display_lookup:
+                self._display_lookup[key] = len(self.display_numbers)
+                self.display_numbers.append(key)
+            self.display_index[row, column] = self._display_lookup[key]
+
+    def mark_padding(self, padding_symbol='_'):
+        """Replace gaps before the first and after the last residue of each segment with the padding symbol."""
+        for start, end in self.segments.values():
+            has_residue = self.has_residue[:, start:end]
+            leading = np.cumsum(has_residue, axis=1) == 0
+            trailing = np.cumsum(has_residue[:, ::-1], axis=1)[:, ::-1] == 0
+            self.amino_acids[:, start:end][(leading | trailing) & ~has_residue] = ord(padding_symbol)
+
+    def select_positions(self, positions):
+        """Return a new matrix containing only the columns whose position label is in positions."""
+        columns = [i for i, pos in enumerate(self.positions) if pos in positions]
+        segments = OrderedDict()
+        for segment, (start, end) in self.segments.items():
+            segments[segment] = [self.positions[i] for i in range(start, end) if self.positions[i] in positions]
+
+        subset = AlignmentMatrix(self.protein_ids, segments)
+        subset.display_numbers = self.display_numbers
+        subset._display_lookup = self._display_lookup
+        subset.amino_acids = self.amino_acids[:, columns]
+        subset.sequence_numbers = self.sequence_numbers[:, columns]
+        subset.display_index = self.display_index[:, columns]
+        subset.has_residue = self.has_residue[:, columns]
+        return subset
+
+    def row(self, index):
+        """Return the residues of one protein in the format of ProteinConformation.alignment.
+
+        Each segment is a list of positions, formatted as [gn, display gn, amino acid, scheme, sequence number, gn]
+        for aligned residues, [gn, "", amino acid, "", sequence number] for unaligned residues and
+        [gn, False, gap symbol, 0] for gaps.
+        """
+        amino_acids = self.amino_acids[index].tobytes().decode('latin-1')
+        sequence_numbers = self.sequence_numbers[index].tolist()
+        display_index = self.display_index[index].tolist()
+        has_residue = self.has_residue[index].tolist()
+
+        row = OrderedDict()
+        for segment, (start, end) in self.segments.items():
+            s = []
+            for column in range(start, end):
+                pos = self.positions[column]
+                if not has_residue[column]:
+                    s.append([pos, False, amino_acids[column], 0])
+                elif display_index[column] >= 0:
+                    display_label, display_scheme = self.display_numbers[display_index[column]]
+                    s.append([pos, display_label, amino_acids[column], display_scheme, sequence_numbers[column], pos])
+                else:
+                    s.append([pos, "", amino_acids[column], "", sequence_numbers[column]])
+            row[segment] = s
+        return row
+
+
+def alignment_columns(proteins):
+    """Return the (segment, position label, occurrence) label of every column of the encoded alignment.
+
+    When all rows have the same number of positions, the columns are those of the first protein. Otherwise (ragged
+    alignments) the columns are the union of the positions of all proteins, grouped per segment in the order in which
+    they first occur.
+    """
+    rows = [[(segment, position[0]) for segment, positions in p.alignment.items() for position in positions]
+        for p in proteins]
+    if all(len(row) == len(rows[0]) for row in rows):
+        rows = rows[:1]
+
+    segments = OrderedDict()
+    for row in rows:
+        occurrences = {}
+        for label in row:
+            occurrence = occurrences[label] = occurrences.get(label, -1) + 1
+            segments.setdefault(label[0], OrderedDict())[label + (occurrence,)] = None
+    return [column for columns in segments.values() for column in columns]
+
+
+def encode_alignment(proteins, missing='-'):
+    """Encode the residues of a built alignment as a uint8 matrix of ASCII codes.
+
+    @param proteins: list of ProteinConformation objects with an alignment property, as set by
+    Alignment.build_alignment. Rows that differ in length are placed in the columns of alignment_columns, by segment
+    and position label.
+    @param missing: symbol of the positions a protein does not have in a ragged alignment
+    """
+    rows = ["".join([position[2] for segment in p.alignment.values() for position in segment]) for p in proteins]
+    length = len(rows[0]) if rows else 0
+    if all(len(row) == length for row in rows):
+        return np.frombuffer("".join(rows).encode('latin-1'), dtype=np.uint8).reshape(len(rows), length)
+
+    column_index = {column: i for i, column in enumerate(alignment_columns(proteins))}
+    encoded = np.full((len(rows), len(column_index)), ord(missing), dtype=np.uint8)
+    for row, p in enumerate(proteins):
+        occurrences = {}
+        columns = []
+        for segment, positions in p.alignment.items():
+            for position in positions:
+                label = (segment, position[0])
+                occurrences[label] = occurrences.get(label, -1) + 1
+                columns.append(column_index[label + (occurrences[label],)])
+        encoded[row, columns] = np.frombuffer(rows[row].encode('latin-1'), dtype=np.uint8)
+    return encoded
+
+
+def count_residues(encoded, alphabet, gaps=GAP_SYMBOLS, skip=None):
+    """Count the residues in every column of an encoded alignment.
+
+    Gap symbols are counted as '-' and residues that are not part of the alphabet (e.g. X) are not counted.
+    Returns the alphabet index of every residue (-1 when not counted) and an (alphabet x positions) count matrix.
+
+    @param skip: optional boolean (proteins x positions) mask of residues to leave out
+    """
+    lookup = np.full(256, -1, dtype=np.int64)
+    for i, letter in enumerate(alphabet):
+        lookup[ord(letter)] = i
+    for gap in gaps:
+        lookup[ord(gap)] = alphabet.index('-')
+
+    codes = lookup[encoded]
+    if skip is not None:
+        codes[skip] = -1
+    counted = codes >= 0
+    columns = np.nonzero(counted)[1]
+    counts = np.bincount(codes[counted] * encoded.shape[1] + columns, minlength=len(alphabet) * encoded.shape[1])
+    return codes, counts.reshape(len(alphabet), encoded.shape[1])
+
+
+def group_membership(alphabet, groups):
+    """Return a boolean (alphabet x groups) matrix marking the members of each residue group."""
+    return np.array([[letter in members for members in groups.values()] for letter in alphabet], dtype=bool)
+
+
+def percentages(counts, total):
+    """Round counts to integer percentages of total, the same way as round(count/total*100)."""
+    return np.rint(counts / total * 100).astype(np.int64)
+
+
+def _pair_sums(left, right, weights, block_size):
+    """For every row pair (i, j) sum weights[left[i, pos], right[j, pos]] over all positions.
+
+    Positions are processed in blocks to keep the one-hot matrices small.
+    """
+    num_codes = weights[0].shape[0]
+    identity = np.eye(num_codes, dtype=np.float32)
+    results = [np.zeros((left.shape[0], right.shape[0]), dtype=np.float64) for _ in weights]
+    for start in range(0, left.shape[1], block_size):
+        left_onehot = identity[left[:, start:start+block_size]]
+        right_onehot = identity[right[:, start:start+block_size]]
+        flat_left = left_onehot.reshape(left.shape[0], -1)
+        for result, weight in zip(results, weights):
+            flat_right = (right_onehot @ weight.T).reshape(right.shape[0], -1)
+            result += flat_left @ flat_right.T
+
+    return [np.rint(result).astype(np.int64) for result in results]
+
+
+def pairwise_similarity_matrix(encoded, other=None, gaps=GAP_SYMBOLS, block_size=128):
+    """Calculate identity, similarity, BLOSUM62 score and compared positions for all pairs of rows.
+
+    Returns four (rows x other rows) integer matrices, counted the same way as Alignment.pairwise_similarity:
+    positions where both residues are gaps are ignored, a position is similar when the BLOSUM62 score is positive
+    and the score is summed over positions without gaps.
+
+    @param encoded: uint8 matrix as returned by encode_alignment
+    @param other: optional second matrix with the same number of positions, defaults to encoded
+    """
+    if other is None:
+        other = encoded
+    letters, codes = np.unique(np.concatenate([encoded, other]), return_inverse=True)
+    codes = codes.reshape(-1, encoded.shape[1])
+    left, right = codes[:encoded.shape[0]], codes[encoded.shape[0]:]
+
+    # substitution scores between the letters present in the alignment, gaps do not score
+    scoring_matrix = get_scoring_matrix()
+    alphabet = scoring_matrix.alphabet
+    lookup = [alphabet.index(chr(l)) if chr(l) in alphabet else alphabet.index('X') for l in letters]
+    is_gap = np.isin(letters, [ord(g) for g in gaps])
+    scores = np.array(scoring_matrix, dtype=np.float32)[np.ix_(lookup, lookup)]
+    scores[is_gap, :] = 0
+    scores[:, is_gap] = 0
+
+    identical = np.diag(~is_gap).astype(np.float32)
+    similar = (scores > 0).astype(np.float32)
+    both_gaps = np.outer(is_gap, is_gap).astype(np.float32)
+    identities, similarities, similarity_scores, gap_pairs = _pair_sums(left, right,
+        [identical, similar, scores, both_gaps], block_size)
+
+    return identities, similarities, similarity_scores, encoded.shape[1] - gap_pairs
+
+
+def format_similarity(identity_count, similarity_count, similarity_score, total_count):
+    """Format counted values as the (identity, similarity, similarity score) tuple of Alignment.pairwise_similarity."""
+    total_count = int(total_count)
+    if total_count:
+        identity = "{:10.0f}".format(int(identity_count) / total_count * 100)
+        similarity = "{:10.0f}".format(int(similarity_count) / total_count * 100)
+        return identity, similarity, int(similarity_score)
+    else:
+        # No aligned residues: return -1
+        return "{:10.0f}".format(-1), "{:10.0f}".format(-1), 0
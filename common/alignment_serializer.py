@@ -0,0 +1,89 @@
+"""
+Serialization of built alignments as FASTA, CSV or JSON without rendering templates.
+
+Sequences are passed around as iterables of (name, aligned sequence) tuples, so that large alignments can be
+streamed to the client one protein at a time.
+"""
+import json
+from collections import OrderedDict
+from itertools import chain
+
+from django.http import StreamingHttpResponse
+
+from common.definitions import AMINO_ACIDS, AMINO_ACID_GROUPS
+
+
+ALIGNMENT_FORMATS = OrderedDict([
+    ('fasta', 'text/fasta'),
+    ('csv', 'text/csv'),
+    ('json', 'application/json'),
+])
+
+
+def alignment_sequences(a):
+    """Yield (entry name, aligned sequence) for each protein of a built Alignment, as in alignment_fasta.html."""
+    for p in a.proteins:
+        sequence = "".join([r[2] for s in p.alignment.values() for r in s])
+        yield p.protein.entry_name, sequence.replace("_", "-")
+
+
+def alignment_statistics(a):
+    """Return the feature and amino acid frequencies per position of an Alignment with calculated statistics."""
+    statistics = OrderedDict()
+    for feature, feature_stats in zip(AMINO_ACID_GROUPS, a.feature_stats):
+        statistics[feature] = [x[0] for d in feature_stats for x in d]
+    for amino_acid, amino_acid_stats in zip(AMINO_ACIDS, a.amino_acid_stats):
+        statistics[amino_acid] = [x[0] for d in amino_acid_stats for x in d]
+    return statistics
+
+
+def fasta_lines(sequences):
+    for name, sequence in sequences:
+        yield ">{}\n{}\n".format(name, sequence)
+
+
+def csv_lines(sequences):
+    """One row per protein with the name followed by the residue of each position."""
+    for name, sequence in sequences:
+        yield "{},{}\n".format(name, ",".join(sequence))
+
+
+def json_lines(items):
+    """Serialize (key, value) tuples as a single JSON object, one member at a time."""
+    separator = "{"
+    for key, value in items:
+        yield "{}{}: {}".format(separator, json.dumps(key), json.dumps(value))
+        separator = ",\n"
+    yield "{}" if separator == "{" else "}"
+
+
+def serialize_alignment(sequences, alignment_format, extra=None):
+    """Yield the serialized alignment in the given format.
+
+    @param sequences: iterable of (name, aligned sequence) tuples
+    @param extra: optional dict of additional members, e.g. CONSENSUS and statistics. Only string values (extra
+    sequences) are included in the FASTA and CSV formats.
+    """
+    if extra is None:
+        extra = {}
+    if alignment_format == 'json':
+        yield from json_lines(chain(sequences, extra.items()))
+    else:
+        lines = fasta_lines if alignment_format == 'fasta' else csv_lines
+        yield from lines(chain(sequences, [(k, v) for k, v in extra.items() if isinstance(v, str)]))
+
+
+def get_alignment_format(request):
+    """Return the requested streaming output format (?output=fasta|csv|json), or None for a regular response."""
+    alignment_format = request.GET.get('output')
+    if alignment_format in ALIGNMENT_FORMATS:
+        return alignment_format
+    return None
+
+
+def streaming_alignment_response(sequences, alignment_format, extra=None, filename='alignment'):
+    response = StreamingHttpResponse(serialize_alignment(sequences, alignment_format, extra),
+                                     content_type=ALIGNMENT_FORMATS[alignment_format])
+    if alignment_format != 'json':
+        response['Content-Disposition'] = "attachment; filename={}.{}".format(filename, alignment_format)
+    return response
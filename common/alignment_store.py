@@ -0,0 +1,210 @@
+"""
+On-disk store of precomputed wild-type alignments, one per protein class (e.g. 001).
+
+Each class is stored as a (protein conformations x positions) uint8 residue matrix, which is memory-mapped when
+loaded, and a JSON index of the proteins, segments and position labels. Alignments of any protein and segment
+selection are sliced from the stored matrix, so the residues do not have to be fetched from the database.
+The store is built by the build_alignment_store command.
+"""
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from common.alignment_matrix import count_residues, group_membership, percentages
+from common.definitions import AMINO_ACIDS, AMINO_ACID_GROUPS
+from django.conf import settings
+
+
+# stores loaded in this process, by protein class, with the modification time of the index
+_loaded_stores = {}
+
+
+def get_store_dir():
+    return os.sep.join([settings.BUILD_CACHE_DIR, 'alignment_store'])
+
+
+class AlignmentStore:
+    """Precomputed alignment of all wild-type proteins in a protein class."""
+    gap = ord('-')
+
+    def __init__(self, protein_class, index, residues):
+        self.protein_class = protein_class
+        # protein records: [entry name, family slug, source id, species latin name]
+        self.proteins = index['proteins']
+        self.residues = residues
+
+        # position labels per segment
+        self.segments = OrderedDict()
+        self.segment_columns = OrderedDict()
+        self.generic_number_columns = {}
+        column = 0
+        for segment, labels in index['segments']:
+            self.segments[segment] = labels
+            self.segment_columns[segment] = list(range(column, column + len(labels)))
+            for label in labels:
+                if label[:3] not in ('00-', '01-', 'zz-') and label not in self.generic_number_columns:
+                    self.generic_number_columns[label] = column
+                column += 1
+        self.num_positions = column
+
+    @staticmethod
+    def get_paths(protein_class):
+        store_dir = get_store_dir()
+        return (os.sep.join([store_dir, protein_class + '.json']), os.sep.join([store_dir, protein_class + '.npy']))
+
+    @classmethod
+    def load(cls, protein_class):
+        """Return the store of a protein class, or None when it has not been built."""
+        index_path, residues_path = cls.get_paths(protein_class)
+        try:
+            modified = os.path.getmtime(index_path)
+        except OSError:
+            return None
+
+        if protein_class in _loaded_stores and _loaded_stores[protein_class][0] == modified:
+            return _loaded_stores[protein_class][1]
+
+        try:
+            with open(index_path) as index_file:
+                index = json.load(index_file)
+            residues = np.load(residues_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+        store = cls(protein_class, index, residues)
+        # the index and matrix are replaced separately during a rebuild, ignore the store until both match
+        if residues.shape != (len(store.proteins), store.num_positions):
+            return None
+        _loaded_stores[protein_class] = (modified, store)
+        return store
+
+    @classmethod
+    def save(cls, protein_class, proteins, segments, residues):
+        """Write the store of a protein class.
+
+        @param proteins: list of protein records [entry name, family slug, source id, species latin name]
+        @param segments: list of [segment slug, position labels], ordered as in the alignment
+        @param residues: (proteins x positions) uint8 matrix of residues, gaps are '-'
+        """
+        os.makedirs(get_store_dir(), exist_ok=True)
+        index_path, residues_path = cls.get_paths(protein_class)
+
+        # write to temporary files first, so that readers never see a partially written file
+        np.save(residues_path + '.tmp.npy', residues)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump({'proteins': proteins, 'segments': segments}, index_file)
+        os.replace(residues_path + '.tmp.npy', residues_path)
+        os.replace(index_path + '.tmp', index_path)
+
+    def select_proteins(self, slug=None, latin_name=None, include_trembl=False, entry_names=None):
+        """Return the rows of the proteins matching the same filters as the alignment API.
+
+        @param slug: family slug the proteins should belong to
+        @param latin_name: species of the proteins, both Swiss-Prot and TrEMBL proteins are included
+        @param include_trembl: include TrEMBL proteins (source 2) when no species is given
+        @param entry_names: entry names of the proteins, not case sensitive
+        """
+        if entry_names is not None:
+            entry_names = set([entry_name.lower() for entry_name in entry_names])
+
+        rows = []
+        for row, (entry_name, family_slug, source_id, species) in enumerate(self.proteins):
+            if slug is not None and not family_slug.startswith(slug):
+                continue
+            if entry_names is not None and entry_name.lower() not in entry_names:
+                continue
+            if latin_name is not None:
+                if species.lower() != latin_name.lower():
+                    continue
+            elif slug is not None and not include_trembl and source_id != 1:
+                continue
+            rows.append(row)
+        return rows
+
+    def slice(self, rows, segments, generic_numbers=[]):
+        """Return the alignment of the given rows and segments, or None when positions are missing from the store.
+
+        @param segments: slugs of the segments to include
+        @param generic_numbers: individually selected positions, collected in a Custom segment
+        """
+        segment_columns = OrderedDict()
+        if generic_numbers:
+            if any(gn not in self.generic_number_columns for gn in generic_numbers):
+                return None
+            segment_columns['Custom'] = [self.generic_number_columns[gn] for gn in
+                                         sorted(generic_numbers, key=lambda x: x.split('x'))]
+        for segment in segments:
+            if segment not in self.segments:
+                return None
+        for segment, columns in self.segment_columns.items():
+            if segment in segments:
+                segment_columns[segment] = columns
+
+        return StoredAlignment(self, rows, segment_columns)
+
+
+class StoredAlignment:
+    """An alignment sliced from an AlignmentStore.
+
+    Positions where none of the selected proteins has a residue are removed, as in Alignment.clear_empty_positions.
+    """
+    def __init__(self, store, rows, segment_columns):
+        self.entry_names = [store.proteins[row][0] for row in rows]
+
+        columns = [column for segment in segment_columns.values() for column in segment]
+        residues = np.asarray(store.residues[np.ix_(rows, columns)]) if rows and columns else np.zeros(
+            (len(rows), 0), dtype=np.uint8)
+        non_empty = (residues != store.gap).any(axis=0).tolist()
+
+        # position labels per segment
+        column_labels = [label for labels in store.segments.values() for label in labels]
+        self.segments = OrderedDict()
+        keep = []
+        i = 0
+        for segment, segment_column_list in segment_columns.items():
+            self.segments[segment] = []
+            for column in segment_column_list:
+                if non_empty[i]:
+                    self.segments[segment].append(column_labels[column])
+                    keep.append(i)
+                i += 1
+        self.residues = residues[:, keep]
+
+    def sequences(self):
+        """Yield (entry name, aligned sequence) for each protein."""
+        for entry_name, row in zip(self.entry_names, self.residues):
+            yield entry_name, row.tobytes().decode('latin-1')
+
+    def count_residues(self):
+        return count_residues(self.residues, list(AMINO_ACIDS))[1]
+
+    def consensus(self):
+        """Return the consensus sequence, ties are broken by the first residue (as Alignment.full_consensus)."""
+        counts = self.count_residues()
+        amino_acids = list(AMINO_ACIDS)
+        counted = counts.sum(axis=0) > 0
+        most_frequent = counts.argmax(axis=0)
+
+        consensus = []
+        column = 0
+        for segment, labels in self.segments.items():
+            segment_columns = [(label, column + i) for i, label in enumerate(labels) if counted[column + i]]
+            for label, c in sorted(segment_columns):
+                consensus.append(amino_acids[most_frequent[c]])
+            column += len(labels)
+        return "".join(consensus)
+
+    def statistics(self):
+        """Return the feature and amino acid frequencies (%) per position, in the format of the alignment API."""
+        counts = self.count_residues()
+        num_proteins = len(self.entry_names)
+        feature_counts = group_membership(list(AMINO_ACIDS), AMINO_ACID_GROUPS).T.astype(np.int64) @ counts
+
+        statistics = {}
+        for feature, frequencies in zip(AMINO_ACID_GROUPS, percentages(feature_counts, num_proteins).tolist()):
+            statistics[feature] = [str(frequency) for frequency in frequencies]
+        for amino_acid, frequencies in zip(AMINO_ACIDS, percentages(counts, num_proteins).tolist()):
+            statistics[amino_acid] = [str(frequency) for frequency in frequencies]
+        return statistics
@@ -114,6 +114,31 @@ def create_cache_dirs(path):
         intermediate_path = os.sep.join([intermediate_path, directory])
         os.chmod(intermediate_path, 0o777)
 
+def prune_cache_dir(path, max_size, suffix=''):
+    """Remove the least recently used files (ending in suffix) of a cache directory until their total size is at most
+    max_size bytes. Files are ordered by modification time, readers touch the files they use."""
+    files = []
+    try:
+        for entry in os.scandir(path):
+            if entry.is_file() and entry.name.endswith(suffix):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+
+    total_size = sum(f[1] for f in files)
+    for mtime, size, file_path in sorted(files):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            # removed by another process
+            pass
+        except OSError:
+            continue
+        total_size -= size
+
 def fetch_from_web_api(url, index, cache_dir=False, xml=False, raw=False):
     logger = logging.getLogger('build')
 
@@ -0,0 +1,106 @@
+"""
+Annotation of hierarchical clusterings of structures: leaf order, silhouette indices and Newick trees.
+
+All functions work on a SciPy linkage matrix Z of N points, where row k describes the merge that creates node N+k
+from the nodes Z[k,0] (left) and Z[k,1] (right). The tree is traversed with explicit stacks instead of recursion, so
+any tree depth is supported, and the silhouette indices of all nodes are computed from cumulative sums of the
+distance matrix.
+"""
+import numpy as np
+
+
+def seriation(Z, N, cur_index):
+    """Return the order of the leaves below node cur_index of the tree Z, left before right.
+
+    Borrowed from https://gmarti.gitlab.io/ml/2017/09/07/how-to-sort-distance-matrix.html
+    """
+    order = []
+    stack = [cur_index]
+    while stack:
+        index = stack.pop()
+        if index < N:
+            order.append(index)
+        else:
+            stack.append(int(Z[index-N, 1]))
+            stack.append(int(Z[index-N, 0]))
+    return order
+
+
+def silhouette_indices(Z, distance_matrix):
+    """Return {node id: average silhouette index} of all internal nodes of the tree Z, the root has index 0.
+
+    The silhouette index of a node is computed against its sibling, following Rousseeuw, P.J. J. Comput. Appl.
+    Math. 20 (1987): 53-65. The members of every node are a contiguous range of the leaf order, so the distance of each
+    point to all members of a node is a difference of cumulative sums over the reordered distance matrix.
+    """
+    distance_matrix = np.asarray(distance_matrix, dtype=np.float64)
+    N = len(distance_matrix)
+    root = 2*N - 2
+    order = np.array(seriation(Z, N, root), dtype=np.int64)
+
+    # leaf range [start, end) in the leaf order of every node
+    start = np.zeros(2*N - 1, dtype=np.int64)
+    end = np.zeros(2*N - 1, dtype=np.int64)
+    start[order] = np.arange(N)
+    end[order] = np.arange(1, N+1)
+    for k in range(N - 1):
+        left, right = int(Z[k, 0]), int(Z[k, 1])
+        start[N+k] = min(start[left], start[right])
+        end[N+k] = max(end[left], end[right])
+
+    # cumulative[i, p] is the summed distance of point i to the first p points in the leaf order
+    cumulative = np.zeros((N, N+1))
+    np.cumsum(distance_matrix[:, order], axis=1, out=cumulative[:, 1:])
+
+    def cluster_silhouette(node, sibling):
+        members = order[start[node]:end[node]]
+        size = end[node] - start[node]
+        ai = (cumulative[members, end[node]] - cumulative[members, start[node]])/(size - 1)
+        bi = (cumulative[members, end[sibling]] - cumulative[members, start[sibling]])/(end[sibling] - start[sibling])
+        # points at zero distance of both clusters, e.g. identical structures, have a silhouette of 0
+        denominator = np.maximum(ai, bi)
+        si = np.divide(bi - ai, denominator, out=np.zeros_like(denominator), where=denominator > 0)
+        return float(np.mean(si))
+
+    results = {root: 0}
+    for k in range(N - 1):
+        left, right = int(Z[k, 0]), int(Z[k, 1])
+        if left >= N:
+            results[left] = cluster_silhouette(left, right)
+        if right >= N:
+            results[right] = cluster_silhouette(right, left)
+    return results
+
+
+def get_newick(Z, leaf_names, silhouette_coefficient):
+    """Return the tree Z in Newick format, with the silhouette indices as internal node labels.
+
+    The right subtree of each node is written before the left one.
+    """
+    N = len(Z) + 1
+    root = 2*N - 2
+    dist = lambda node: Z[node-N, 2] if node >= N else 0
+
+    parts = []
+    # items are node ids with the distance of their parent, or strings to add to the output
+    stack = [(root, dist(root))]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+
+        node, parentdist = item
+        if node < N:
+            parts.append("%s:%.2f" % (leaf_names[node], parentdist - dist(node)))
+            continue
+
+        if node == root:
+            stack.append(");")
+        else:
+            stack.append(")%.2f:%.2f" % (silhouette_coefficient[node], parentdist - dist(node)))
+        stack.append((int(Z[node-N, 0]), dist(node)))
+        stack.append(",")
+        stack.append((int(Z[node-N, 1]), dist(node)))
+        parts.append("(")
+    return "".join(parts)
@@ -0,0 +1,122 @@
+"""
+Amino acid (pair) conservation of the generic number positions of a receptor class.
+
+The residues of the class's human receptors are encoded as a one-hot matrix of (generic number, amino acid) rows by
+receptor columns. The number of receptors sharing any two (generic number, amino acid) rows follows from a single
+matrix product, which is stored as a matrix of percentages, so the lookup stays a few arrays instead of a dict with a
+key per position and amino acid pair.
+"""
+import numpy as np
+
+# marks pairs of amino acids that do not occur together in any receptor
+ABSENT = 255
+
+
+class AminoAcidPairConservation:
+    """Conservation lookup with the keys of the former class pair conservation dict.
+
+    - '<gn>': [most frequent amino acid, fraction of the receptors]
+    - '<gn><aa>': percentage of the receptors with the amino acid at the position
+    - '<gn1>,<gn2><aa1><aa2>': percentage of the receptors with both amino acids, for gn1 before gn2 in the generic
+      number order, only when at least one receptor has both
+    """
+
+    # number of rows whose pairs are counted at once when building the lookup
+    chunk_size = 256
+
+    def __init__(self, gn_labels, amino_acids, aa_counts, pair_percentages, sum_proteins):
+        self.gn_index = {gn: i for i, gn in enumerate(gn_labels)}
+        # the amino acids of every position as a string, rows of a position are consecutive
+        self.amino_acids = amino_acids
+        self.row_offsets = np.concatenate([[0], np.cumsum([len(aas) for aas in amino_acids])]).astype(np.int32)
+        self.aa_counts = aa_counts
+        self.pair_percentages = pair_percentages
+        self.sum_proteins = sum_proteins
+
+    @classmethod
+    def from_residues(cls, residues, gn_labels, sum_proteins):
+        """Build the lookup from (generic number, amino acid, entry name) of the residues of the class.
+
+        @param gn_labels: generic numbers in display order, pairs are stored for gn1 before gn2 in this order
+        @param sum_proteins: number of receptors the percentages are relative to
+        """
+        gn_index = {gn: i for i, gn in enumerate(gn_labels)}
+        position_aas = [{} for gn in gn_labels]
+        proteins = {}
+        cells = set()
+        for gn, aa, entry_name in residues:
+            if gn not in gn_index:
+                continue
+            aas = position_aas[gn_index[gn]]
+            if aa not in aas:
+                aas[aa] = len(aas)
+            cells.add((gn_index[gn], aas[aa], proteins.setdefault(entry_name, len(proteins))))
+
+        amino_acids = [''.join(aas) for aas in position_aas]
+        row_offsets = np.concatenate([[0], np.cumsum([len(aas) for aas in amino_acids])]).astype(np.int64)
+        one_hot = np.zeros((row_offsets[-1], len(proteins)), dtype=np.float32)
+        if cells:
+            cells = np.array(list(cells), dtype=np.int64)
+            one_hot[row_offsets[cells[:, 0]] + cells[:, 1], cells[:, 2]] = 1
+
+        aa_counts = one_hot.sum(axis=1).astype(np.int32)
+        num_rows = len(one_hot)
+        row_positions = np.repeat(np.arange(len(gn_labels)), np.diff(row_offsets))
+        pair_percentages = np.full((num_rows, num_rows), ABSENT, dtype=np.uint8)
+        if sum_proteins:
+            # the pairs are counted for a chunk of rows at a time, which keeps the intermediate matrices small
+            for start in range(0, num_rows, cls.chunk_size):
+                end = min(start + cls.chunk_size, num_rows)
+                # float32 products of 0/1 entries are exact up to 2^24 receptors
+                pair_counts = np.rint(one_hot[start:end] @ one_hot.T)
+                # same arithmetic as round(100*count/sum_proteins)
+                percentages = np.rint(100*pair_counts.astype(np.float64)/sum_proteins)
+                # only pairs that occur in a receptor, of a position with a later position, are kept
+                keep = (pair_counts > 0) & (row_positions[start:end, None] < row_positions[None, :])
+                pair_percentages[start:end][keep] = percentages[keep]
+
+        return cls(gn_labels, amino_acids, aa_counts, pair_percentages, sum_proteins)
+
+    def __len__(self):
+        return len(self.gn_index)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def _row(self, gn, aa):
+        if gn not in self.gn_index or len(aa) != 1:
+            return None
+        i = self.gn_index[gn]
+        position = self.amino_acids[i].find(aa)
+        if position < 0:
+            return None
+        return self.row_offsets[i] + position
+
+    def get(self, key, default=None):
+        if key in self.gn_index:
+            i = self.gn_index[key]
+            counts = self.aa_counts[self.row_offsets[i]:self.row_offsets[i+1]]
+            if not len(counts) or not self.sum_proteins:
+                return default
+            # first amino acid with the highest count, as a stable sort on the frequency
+            best = int(np.argmax(counts))
+            return [self.amino_acids[i][best], int(counts[best])/self.sum_proteins]
+
+        if ',' in key:
+            gn1, gn2 = key[:-2].split(',', 1)
+            row1 = self._row(gn1, key[-2:-1])
+            row2 = self._row(gn2, key[-1:])
+            if row1 is None or row2 is None or self.pair_percentages[row1, row2] == ABSENT:
+                return default
+            return int(self.pair_percentages[row1, row2])
+
+        row = self._row(key[:-1], key[-1:])
+        if row is None or not self.sum_proteins:
+            return default
+        return round(100*int(self.aa_counts[row])/self.sum_proteins)
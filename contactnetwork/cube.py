@@ -14,22 +14,116 @@ from io import StringIO
 from protein.models import ProteinConformation
 
 from structure.models import Structure, StructureExtraProteins
+from structure.coordinates import pdb_checksum
+from common.tools import prune_cache_dir
 
 from signprot.models import SignprotComplex
 
+from django.db import connection
+from multiprocessing import Pool
+
 import copy
+import pickle
+import time
 import yaml
 import os
 
 # Distance between residues in peptide
 NUM_SKIP_RESIDUES = 1
 
+# Parsed structures are pickled here, keyed by the checksum of the PDB data
+PARSED_STRUCTURE_DIR = os.sep.join([settings.BUILD_CACHE_DIR, 'parsed_structures'])
+# least recently used structures are removed when the pickles exceed this size in bytes
+PARSED_STRUCTURE_CACHE_SIZE = getattr(settings, 'PARSED_STRUCTURE_CACHE_SIZE', 4 * 1024**3)
+
+_unnatural_amino_acids = None
+
+def get_unnatural_amino_acids():
+    """Return the unnatural amino acid definitions, read once per process."""
+    global _unnatural_amino_acids
+    if _unnatural_amino_acids is None:
+        with open(os.sep.join([settings.DATA_DIR, 'residue_data', 'unnatural_amino_acids.yaml']), 'r') as f_yaml:
+            unnatural_amino_acids = yaml.safe_load(f_yaml)
+            _unnatural_amino_acids = {str(x):unnatural_amino_acids[x] for x in unnatural_amino_acids}
+    return _unnatural_amino_acids
+
+def get_structure_model(struc):
+    """Return the first model of the Biopython structure of a Structure.
+
+    The parsed structure is pickled in PARSED_STRUCTURE_DIR, so following builds skip parsing the PDB data as long
+    as it is unchanged. Every call returns a new copy, so callers can detach residues. Pickles of changed PDB data are
+    no longer used and are pruned, with the least recently used ones, when the cache exceeds its size.
+    """
+    pdb_data = struc.pdb_data.pdb
+    checksum = pdb_checksum(pdb_data)
+    cache_file = os.sep.join([PARSED_STRUCTURE_DIR, checksum + '.pkl'])
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                s = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        else:
+            # mark as recently used
+            try:
+                os.utime(cache_file)
+            except OSError:
+                pass
+            return s
+
+    s = PDBParser(PERMISSIVE=True, QUIET=True).get_structure('ref', StringIO(pdb_data))[0]
+    try:
+        os.makedirs(PARSED_STRUCTURE_DIR, exist_ok=True)
+        # write to a temporary file first, parallel builds may parse the same structure
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(s, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    prune_cache_dir(PARSED_STRUCTURE_DIR, PARSED_STRUCTURE_CACHE_SIZE, '.pkl')
+    return s
+
+def _compute_interactions_job(job):
+    pdb_name, options = job
+    current = time.time()
+    try:
+        compute_interactions(pdb_name, **options)
+    except Exception as msg:
+        return pdb_name, False, str(msg)
+    return pdb_name, True, time.time()-current
+
+def compute_interactions_batch(pdb_names, processes=1, **options):
+    """Compute and save the interactions of many structures, distributed over a pool of processes.
+
+    Structures are handed out one at a time, so slow structures do not hold up the other workers. The options are
+    passed to compute_interactions, results are always saved to the database.
+
+    Returns a list of (pdb name, error message) of the structures that failed.
+    """
+    options['save_to_db'] = True
+    jobs = [(pdb_name, options) for pdb_name in pdb_names]
+    failed = []
+    if processes > 1 and len(jobs) > 1:
+        # the forked workers must not share the database connection of the parent
+        connection.close()
+        with Pool(min(processes, len(jobs))) as pool:
+            results = list(pool.imap_unordered(_compute_interactions_job, jobs))
+    else:
+        results = map(_compute_interactions_job, jobs)
+
+    for pdb_name, success, result in results:
+        if success:
+            print(pdb_name, "Contact Network", result)
+        else:
+            print('Issue making interactions for', pdb_name, result)
+            failed.append((pdb_name, result))
+    return failed
+
 def compute_interactions(pdb_name, protein=None, signprot=None, lig=None, do_interactions=False, do_complexes=False, do_peptide_ligand=False, save_to_db=False, file_input=False):
     classified = []
     classified_complex = []
-    with open(os.sep.join([settings.DATA_DIR, 'residue_data', 'unnatural_amino_acids.yaml']), 'r') as f_yaml:
-        unnatural_amino_acids = yaml.safe_load(f_yaml)
-        unnatural_amino_acids = {str(x):unnatural_amino_acids[x] for x in unnatural_amino_acids}
+    unnatural_amino_acids = get_unnatural_amino_acids()
 
     if file_input:
         # Get the preferred chain
@@ -66,12 +160,10 @@ def compute_interactions(pdb_name, protein=None, signprot=None, lig=None, do_int
         # Ensure that the PDB name is lowercase
         pdb_name = pdb_name.lower()
         struc = Structure.objects.get(protein_conformation__protein__entry_name=pdb_name)
-        # Get the pdb structure
-        pdb_io = StringIO(struc.pdb_data.pdb)
         # Get the preferred chain
         preferred_chain = struc.preferred_chain.split(',')[0]
         # Get the Biopython structure for the PDB
-        s = PDBParser(PERMISSIVE=True, QUIET=True).get_structure('ref', pdb_io)[0]
+        s = get_structure_model(struc)
         #s = pdb_get_structure(pdb_name)[0]
         chain = s[preferred_chain]
         # remove residues without GN and only those matching receptor.
@@ -130,8 +222,7 @@ def compute_interactions(pdb_name, protein=None, signprot=None, lig=None, do_int
 
                 # Workaround for fused receptor - signaling proteins constructs
                 if signprot_chain == preferred_chain:
-                    pdb_io = StringIO(struc.pdb_data.pdb)
-                    s = PDBParser(PERMISSIVE=True, QUIET=True).get_structure('ref', pdb_io)[0]
+                    s = get_structure_model(struc)
 
             # Get all GPCR residue atoms based on preferred chain
             gpcr_atom_list = [ atom for residue in Selection.unfold_entities(s[preferred_chain], 'R') if is_aa(residue) and residue.get_id()[1] in dbres \
@@ -300,12 +391,12 @@ def compute_interactions(pdb_name, protein=None, signprot=None, lig=None, do_int
                                 # HACK: store water ID as part of first atom name
                                 interaction_pairs[key].interactions.append(WaterMediated(a + "|" + str(water_pair_one[0].get_parent().get_id()[1]), b))
 
-            for p in classified:
-                p.save_into_database()
+            InteractingPair.save_pairs_into_database(classified)
+            if not file_input:
+                ResidueContact.refresh([struc])
 
         if do_complexes:
-            for pair in classified_complex:
-                pair.save_into_database()
+            InteractingPair.save_pairs_into_database(classified_complex)
 
         if do_peptide_ligand and len(ligands)>0:
             for ligand in ligands:
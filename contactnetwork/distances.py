@@ -9,6 +9,7 @@ from residue.models import Residue, ResidueGenericNumber
 from collections import OrderedDict
 
 import numpy as np
+import scipy.spatial.distance as ssd
 
 
 class Distances():
@@ -396,106 +397,110 @@ class Distances():
         #print(data)
             #print(d.interacting_pair.res1.generic_number.label)
 
+    def get_structure_distances(self, pdb, cache_enabled = True):
+        """Return the TM distance data of a single structure.
+
+        Returns the sorted GNs of the structure, a boolean mask marking the GNs with a residue in the structure and a
+        float32 vector with the distances of all GN pairs (upper triangle of the GN x GN matrix, NaN when missing).
+        """
+        cache_key = "distanceTensor-" + pdb
+
+        # Cached?
+        if cache_enabled:
+            cached_data = cache.get(cache_key)
+            if cached_data is not None:
+                return cached_data["gns"], cached_data["present"], cached_data["distances"]
+
+        # grab raw distance data per structure, regardless of the GN filter
+        temp = Distances()
+        temp.load_pdbs([pdb])
+        temp.fetch_distances_tm()
+
+        structure_gn = Residue.objects.filter(protein_conformation__in=temp.pconfs) \
+            .exclude(generic_number=None) \
+            .exclude(generic_number__label__startswith='8x') \
+            .exclude(generic_number__label__startswith='12x') \
+            .exclude(generic_number__label__startswith='23x') \
+            .exclude(generic_number__label__startswith='34x') \
+            .exclude(generic_number__label__startswith='45x') \
+            .values_list('generic_number__label',flat=True)
+        structure_gn = set(structure_gn)
+
+        pairs = [label.split("_") for label in temp.data]
+        gns = sorted(structure_gn.union([gn for pair in pairs for gn in pair]))
+        gn_index = {gn: i for i, gn in enumerate(gns)}
+        present = np.array([gn in structure_gn for gn in gns], dtype=bool)
+
+        # only pairs in GN order are used, as in the GN x GN distance map
+        distances = np.full(len(gns) * (len(gns) - 1) // 2, np.nan, dtype=np.float32)
+        for (res1, res2), d in zip(pairs, temp.data.values()):
+            i, j = gn_index[res1], gn_index[res2]
+            if i < j:
+                distances[self.triangle_index(i, j, len(gns))] = d[0]
+
+        # store in cache
+        if cache_enabled:
+            store = {
+                "gns" : gns,
+                "present" : present,
+                "distances" : distances,
+                }
+            cache.set(cache_key, store, 60*60*24*14)
+
+        return gns, present, distances
+
+    @staticmethod
+    def triangle_index(i, j, n):
+        """Index of cell (i, j), with i < j, in the flattened upper triangle of an n x n matrix."""
+        return i * n - i * (i + 1) // 2 + (j - i - 1)
+
     def get_distance_matrix(self, normalize = True, cache_enabled = True):
         # common GNs
         common_gn = self.fetch_common_gns_tm()
 
-#            .filter(label__in=self.filter_gns) \
-        all_gns = ResidueGenericNumber.objects.filter(scheme__slug='gpcrdb')\
-            .exclude(label__startswith='8x') \
-            .exclude(label__startswith='12x') \
-            .exclude(label__startswith='23x') \
-            .exclude(label__startswith='34x') \
-            .exclude(label__startswith='45x') \
-            .values_list('label',flat=True)
+        # all pairs of common GNs (upper triangle)
+        pair_1, pair_2 = np.triu_indices(len(common_gn), 1)
 
-        if self.filtered_gns:
-            all_gns = all_gns.filter(label__in=self.filter_gns)
-
-        all_gns = sorted(list(all_gns))
-
-        pdb_distance_maps = {}
-        pdb_gns = {}
-        for pdb in self.pdbs:
-            cache_key = "distanceMap-" + pdb
-
-            # Cached?
-            if cache.has_key(cache_key) and cache_enabled:
-                cached_data = cache.get(cache_key)
-                distance_map = cached_data["map"]
-                structure_gn = cached_data["gns"]
-            else:
-                # grab raw distance data per structure
-                temp = Distances()
-                temp.load_pdbs([pdb])
-                temp.fetch_distances_tm()
-
-#                    .filter(generic_number__label__in=self.filter_gns) \
-                structure_gn = Residue.objects.filter(protein_conformation__in=temp.pconfs) \
-                    .exclude(generic_number=None) \
-                    .exclude(generic_number__label__startswith='8x') \
-                    .exclude(generic_number__label__startswith='12x') \
-                    .exclude(generic_number__label__startswith='23x') \
-                    .exclude(generic_number__label__startswith='34x') \
-                    .exclude(generic_number__label__startswith='45x') \
-                    .values_list('generic_number__label',flat=True)
-
-                if self.filtered_gns:
-                    structure_gn = structure_gn.filter(generic_number__label__in=self.filter_gns)
-
-                structure_gn = list(structure_gn)
-
-                # create distance map
-                distance_map = np.full((len(all_gns), len(all_gns)), 0.0)
-
-                for i,res1 in enumerate(all_gns):
-                    for j in range(i+1, len(all_gns)):
-                        # grab average value
-                        res2 = all_gns[j]
-                        if res1+"_"+res2 in temp.data:
-                            distance_map[i][j] = temp.data[res1+"_"+res2][0]
-
-                # store in cache
-                if cache_enabled:
-                    store = {
-                        "map" : distance_map,
-                        "gns" : structure_gn
-                        }
-                    cache.set(cache_key, store, 60*60*24*14)
-
-            pdb_gns[pdb] = structure_gn
-
-            # Filtering indices to map to common_gns
-            gn_indices = np.array([ all_gns.index(residue) for residue in common_gn ])
-            pdb_distance_maps[pdb] = distance_map[gn_indices,:][:, gn_indices]
-
-            if "average" in pdb_distance_maps:
-                pdb_distance_maps["average"] +=  pdb_distance_maps[pdb]/len(self.pdbs)
-            else:
-                pdb_distance_maps["average"] =  pdb_distance_maps[pdb]/len(self.pdbs)
-
-        # store distance map
-        if normalize:
-            for pdb in self.pdbs:
-                pdb_distance_maps[pdb] = np.nan_to_num(pdb_distance_maps[pdb]/pdb_distance_maps["average"])
-
-        # calculate distance matrix
-        distance_matrix = np.full((len(self.pdbs), len(self.pdbs)), 0.0)
-        for i, pdb1 in enumerate(self.pdbs):
-            for j in range(i+1, len(self.pdbs)):
-                pdb2 = self.pdbs[j]
-
-                # Get common GNs between two PDBs
-                common_between_pdbs = sorted(list(set(pdb_gns[pdb1]).intersection(pdb_gns[pdb2])))
-
-                # Get common between above set and the overall common set of GNs
-                common_with_query_gns = sorted(list(set(common_gn).intersection(common_between_pdbs)))
-
-                # Get the indices of positions that are shared between two PDBs
-                gn_indices = np.array([ common_gn.index(residue) for residue in common_with_query_gns ])
-
-                # Get distance between cells that have both GNs.
-                distance = np.sum(np.absolute(pdb_distance_maps[pdb1][gn_indices,:][:, gn_indices] - pdb_distance_maps[pdb2][gn_indices,:][:, gn_indices]))
-                distance_matrix[i, j] = distance_matrix[j, i] = distance * distance/(len(gn_indices)*len(gn_indices))
+        # stack the distances of the common GN pairs of all structures, missing distances are zero
+        distances = np.zeros((len(self.pdbs), len(pair_1)), dtype=np.float32)
+        present = np.zeros((len(self.pdbs), len(common_gn)), dtype=bool)
+        for p, pdb in enumerate(self.pdbs):
+            gns, gn_present, gn_distances = self.get_structure_distances(pdb, cache_enabled)
+            if not gns:
+                continue
+            gn_index = {gn: i for i, gn in enumerate(gns)}
+            indices = np.array([gn_index.get(gn, -1) for gn in common_gn], dtype=np.int64)
+            present[p] = (indices >= 0) & gn_present[indices]
+
+            # both GNs of the pair must have distance data
+            valid = (indices[pair_1] >= 0) & (indices[pair_2] >= 0)
+            values = gn_distances[self.triangle_index(indices[pair_1][valid], indices[pair_2][valid], len(gns))]
+            distances[p, valid] = np.nan_to_num(values)
+
+        # normalize by the average distance map
+        if normalize and len(self.pdbs) > 0:
+            average = distances.sum(axis=0, dtype=np.float64) / len(self.pdbs)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                distances = np.nan_to_num(distances / average).astype(np.float32)
+
+        # pairs without any distance do not contribute
+        informative = distances.any(axis=0)
+        distances = distances[:, informative]
+        pair_present = (present[:, pair_1] & present[:, pair_2])[:, informative]
+
+        # number of GNs shared by each pair of structures
+        shared = present.astype(np.float64) @ present.T.astype(np.float64)
+
+        # calculate distance matrix: sum of absolute differences over the pairs of GNs present in both structures.
+        # With absent pairs set to zero, the L1 distance also counts the pairs only present in one of the structures,
+        # which are subtracted again (distances are never negative).
+        if len(self.pdbs) < 2:
+            return np.full((len(self.pdbs), len(self.pdbs)), 0.0)
+        masked = np.where(pair_present, distances, 0).astype(np.float64)
+        outside = masked @ (~pair_present).T.astype(np.float64)
+        distance = ssd.squareform(ssd.pdist(masked, 'cityblock')) - outside - outside.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance_matrix = np.nan_to_num(distance * distance / (shared * shared))
+        np.fill_diagonal(distance_matrix, 0.0)
 
         return distance_matrix
@@ -117,6 +117,31 @@ class InteractingPair:
             bulk.append(ni)
         Interaction.objects.bulk_create(bulk)
 
+    @staticmethod
+    def save_pairs_into_database(pairs):
+        """Save many InteractingPairs as save_into_database, with one bulk insert for the pairs and one for the interactions."""
+        if not pairs:
+            return
+
+        # Reuse existing pairs as get_or_create, pairs are only bulk created when missing
+        structures = {pair.structure for pair in pairs}
+        db_pairs = {(p.res1_id, p.res2_id, p.referenced_structure_id): p for p in
+                    InteractingResiduePair.objects.filter(referenced_structure__in=structures)}
+        new_pairs = {}
+        for pair in pairs:
+            key = (pair.dbres1.id, pair.dbres2.id, pair.structure.id)
+            if key not in db_pairs and key not in new_pairs:
+                new_pairs[key] = InteractingResiduePair(res1=pair.dbres1, res2=pair.dbres2, referenced_structure=pair.structure)
+        InteractingResiduePair.objects.bulk_create(new_pairs.values(), batch_size=5000)
+        db_pairs.update(new_pairs)
+
+        bulk = []
+        for pair in pairs:
+            db_pair = db_pairs[(pair.dbres1.id, pair.dbres2.id, pair.structure.id)]
+            for i in pair.get_interactions():
+                bulk.append(Interaction(interaction_type=i.get_type(),specific_type=i.get_details(), interacting_pair=db_pair, atomname_residue1=i.atomname_residue1, atomname_residue2=i.atomname_residue2, interaction_level=i.get_level()))
+        Interaction.objects.bulk_create(bulk, batch_size=5000)
+
     def save_peptide_interactions(self, peptide):
         pair, _ = InteractingPeptideResiduePair.objects.get_or_create(peptide_amino_acid_three_letter=self.dbres2.three_letter, peptide_amino_acid=self.dbres2.amino_acid, peptide_sequence_number=self.dbres2.sequence_number,
                                                                             peptide=peptide, receptor_residue=self.dbres1)
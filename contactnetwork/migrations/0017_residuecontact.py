@@ -0,0 +1,41 @@
+# Generated by Django 3.0.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('residue', '0002_auto_20180504_1417'),
+        ('structure', '0049_structuremodel_model_type'),
+        ('contactnetwork', '0016_auto_20230216_0926'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResidueContact',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gn1_label', models.CharField(max_length=12)),
+                ('gn2_label', models.CharField(max_length=12)),
+                ('aa1', models.CharField(max_length=1)),
+                ('aa2', models.CharField(max_length=1)),
+                ('interaction_type', models.CharField(max_length=100)),
+                ('contact_class', models.CharField(max_length=5)),
+                ('intra_segment', models.BooleanField()),
+                ('atompaircount', models.IntegerField()),
+                ('gn1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contact_gn1', to='residue.ResidueGenericNumber')),
+                ('gn2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contact_gn2', to='residue.ResidueGenericNumber')),
+                ('structure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='structure.Structure')),
+            ],
+            options={
+                'db_table': 'residue_contact',
+                'unique_together': {('structure', 'gn1', 'gn2', 'interaction_type', 'contact_class')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='residuecontact',
+            index=models.Index(fields=['gn1', 'gn2', 'structure'], name='residue_contact_gn_pair_idx'),
+        ),
+    ]
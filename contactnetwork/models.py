@@ -46,6 +46,90 @@ class Interaction(models.Model):
         db_table = 'interaction'
 
 
+# Contact classes of atom pairs, by the number of backbone atoms in the pair. As in the contact frequency filters,
+# only C, N and O are backbone atoms here, CA counts with the side chain.
+CONTACT_BACKBONE_ATOMS = ('C', 'O', 'N')
+CONTACT_CLASSES = ('sc-sc', 'sc-bb', 'bb-bb')
+
+class ResidueContact(models.Model):
+    """Interactions between two generic number positions of a structure, summarized per interaction type and contact
+    class. Only contacts within a protein conformation are kept, with gn1 belonging to the residue with the lower pk.
+
+    Built from Interaction by refresh, the contact frequency queries read it without joining the residues.
+    """
+    structure = models.ForeignKey('structure.Structure', on_delete=models.CASCADE)
+    gn1 = models.ForeignKey('residue.ResidueGenericNumber', related_name='contact_gn1', on_delete=models.CASCADE)
+    gn2 = models.ForeignKey('residue.ResidueGenericNumber', related_name='contact_gn2', on_delete=models.CASCADE)
+    gn1_label = models.CharField(max_length=12)
+    gn2_label = models.CharField(max_length=12)
+    aa1 = models.CharField(max_length=1)
+    aa2 = models.CharField(max_length=1)
+    interaction_type = models.CharField(max_length=100)
+    contact_class = models.CharField(max_length=5)
+    # both residues are in the same protein segment
+    intra_segment = models.BooleanField()
+    atompaircount = models.IntegerField()
+
+    @classmethod
+    def truncate(cls):
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute('TRUNCATE TABLE "{0}" RESTART IDENTITY CASCADE'.format(cls._meta.db_table))
+
+    @classmethod
+    def get_source_interactions(cls):
+        """Interactions that are summarized as contacts, each of them adds one to the atompaircount of a contact."""
+        return Interaction.objects.filter(
+            interacting_pair__res1__generic_number__isnull=False,
+            interacting_pair__res2__generic_number__isnull=False,
+            interacting_pair__res1__protein_conformation_id=models.F('interacting_pair__res2__protein_conformation_id'),
+            interacting_pair__res1__pk__lt=models.F('interacting_pair__res2__pk')
+        )
+
+    @classmethod
+    def refresh(cls, structures):
+        """Replace the contacts of the given structures (objects or pks) by those of their current interactions."""
+        from django.db import transaction
+        interactions = cls.get_source_interactions().filter(
+            interacting_pair__referenced_structure__in=structures
+        ).values_list(
+            'interacting_pair__referenced_structure_id',
+            'interacting_pair__res1__generic_number_id',
+            'interacting_pair__res1__generic_number__label',
+            'interacting_pair__res1__amino_acid',
+            'interacting_pair__res1__protein_segment_id',
+            'interacting_pair__res2__generic_number_id',
+            'interacting_pair__res2__generic_number__label',
+            'interacting_pair__res2__amino_acid',
+            'interacting_pair__res2__protein_segment_id',
+            'interaction_type',
+            'atomname_residue1',
+            'atomname_residue2',
+        )
+
+        contacts = {}
+        for structure_id, gn1, gn1_label, aa1, segment1, gn2, gn2_label, aa2, segment2, interaction_type, atom1, atom2 in interactions:
+            contact_class = CONTACT_CLASSES[(atom1 in CONTACT_BACKBONE_ATOMS) + (atom2 in CONTACT_BACKBONE_ATOMS)]
+            key = (structure_id, gn1, gn2, interaction_type, contact_class)
+            if key not in contacts:
+                contacts[key] = cls(structure_id=structure_id, gn1_id=gn1, gn2_id=gn2, gn1_label=gn1_label,
+                    gn2_label=gn2_label, aa1=aa1, aa2=aa2, interaction_type=interaction_type,
+                    contact_class=contact_class, intra_segment=segment1 == segment2, atompaircount=0)
+            contacts[key].atompaircount += 1
+
+        with transaction.atomic():
+            cls.objects.filter(structure__in=structures).delete()
+            cls.objects.bulk_create(contacts.values(), batch_size=5000)
+        return len(contacts)
+
+    class Meta():
+        db_table = 'residue_contact'
+        unique_together = ('structure', 'gn1', 'gn2', 'interaction_type', 'contact_class')
+        indexes = [
+            models.Index(fields=['gn1', 'gn2', 'structure'], name='residue_contact_gn_pair_idx'),
+        ]
+
+
 class InteractingPeptideResiduePair(models.Model):
     peptide_amino_acid_three_letter = models.CharField(max_length=3)
     peptide_amino_acid = models.CharField(max_length=1)
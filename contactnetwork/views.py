@@ -15,6 +15,8 @@ import hashlib
 import copy
 
 from contactnetwork.models import *
+from contactnetwork.clustering import seriation, silhouette_indices, get_newick
+from contactnetwork.conservation import AminoAcidPairConservation
 from contactnetwork.distances import *
 from contactnetwork.functions import *
 from structure.models import Structure, StructureVectors, StructureExtraProteins
@@ -806,41 +808,18 @@ def InteractionBrowserData(request):
                                               protein_conformation__protein__sequence_type__slug='wt',
                                               protein_conformation__protein__species__common_name='Human',
 
-                        ).exclude(display_generic_number=None).values('pk','sequence_number','generic_number__label','amino_acid','protein_conformation__protein__entry_name','display_generic_number__label').all()
-            r_pair_lookup = defaultdict(lambda: defaultdict(lambda: set()))
+                        ).exclude(display_generic_number=None).values('generic_number__label','amino_acid','protein_conformation__protein__entry_name','display_generic_number__label').all()
+            residue_aas = []
             for r in residues:
                 # use the class specific generic number
-                r['display_generic_number__label'] = re.sub(r'\.[\d]+', '', r['display_generic_number__label'])
                 if forced_class_a:
-                    r_pair_lookup[r['generic_number__label']][r['amino_acid']].add(r['protein_conformation__protein__entry_name'])
+                    gn = r['generic_number__label']
                 else:
-                    r_pair_lookup[r['display_generic_number__label']][r['amino_acid']].add(r['protein_conformation__protein__entry_name'])
-            class_pair_lookup = {}
+                    gn = re.sub(r'\.[\d]+', '', r['display_generic_number__label'])
+                residue_aas.append((gn, r['amino_acid'], r['protein_conformation__protein__entry_name']))
 
-            gen_keys = sorted(r_pair_lookup.keys(), key=functools.cmp_to_key(gpcrdb_number_comparator))
-            for i,gen1 in enumerate(gen_keys):
-                v1 = r_pair_lookup[gen1]
-                temp_score_dict = []
-                for aa, protein in v1.items():
-                    temp_score_dict.append([aa,len(protein)/sum_proteins])
-
-                most_freq_aa = sorted(temp_score_dict.copy(), key = lambda x: -x[1])[0]
-                class_pair_lookup[gen1] = most_freq_aa
-                for gen2 in gen_keys[i:]:
-                    if gen1 == gen2:
-                        continue
-                    pairs = {}
-                    v2 = r_pair_lookup[gen2]
-                    coord = '{},{}'.format(gen1,gen2)
-                    for aa1 in v1.keys():
-                        p1 = v1[aa1]
-                        class_pair_lookup[gen1+aa1] = round(100*len(p1)/sum_proteins)
-                        for aa2 in v2.keys():
-                            pair = '{}{}'.format(aa1,aa2)
-                            p2 = v2[aa2]
-                            p = p1.intersection(p2)
-                            if p:
-                                class_pair_lookup[coord+pair] = round(100*len(p)/sum_proteins)
+            gen_keys = sorted({r[0] for r in residue_aas}, key=functools.cmp_to_key(gpcrdb_number_comparator))
+            class_pair_lookup = AminoAcidPairConservation.from_residues(residue_aas, gen_keys, sum_proteins)
             cache.set(cache_key, class_pair_lookup, 3600 * 24 * 7)
 
         ### Fetch class ligand / G-protein interactions for snakeplot colouring
@@ -3001,13 +2980,11 @@ def ClusteringData(request):
 
         # hierarchical clustering
         hclust = sch.linkage(ssd.squareform(distance_matrix), method='average')
-        tree = sch.to_tree(hclust, False)
 
         #inconsistency = sch.inconsistent(hclust)
         #inconsistency = sch.maxinconsts(hclust, inconsistency)
-        silhouette_coefficient = {}
-        getSilhouetteIndex(tree, distance_matrix, silhouette_coefficient)
-        data['tree'] = getNewick(tree, "", tree.dist, pdbs, silhouette_coefficient)
+        silhouette_coefficient = silhouette_indices(hclust, distance_matrix)
+        data['tree'] = get_newick(hclust, pdbs, silhouette_coefficient)
 
         # Order distance_matrix by hclust
         N = len(distance_matrix)
@@ -3023,87 +3000,6 @@ def ClusteringData(request):
     cache.set(cache_key, data, 60*60*24*7)
     return JsonResponse(data)
 
-# For reordering matrix based on h-tree
-# Borrowed from https://gmarti.gitlab.io/ml/2017/09/07/how-to-sort-distance-matrix.html
-def seriation(Z,N,cur_index):
-    '''
-        input:
-            - Z is a hierarchical tree (dendrogram)
-            - N is the number of points given to the clustering process
-            - cur_index is the position in the tree for the recursive traversal
-        output:
-            - order implied by the hierarchical tree Z
-
-        seriation computes the order implied by a hierarchical tree (dendrogram)
-    '''
-    if cur_index < N:
-        return [cur_index]
-    else:
-        left = int(Z[cur_index-N,0])
-        right = int(Z[cur_index-N,1])
-        return (seriation(Z,N,left) + seriation(Z,N,right))
-
-def getNewick(node, newick, parentdist, leaf_names, silhouette_coefficient):
-    if node.is_leaf():
-        return "%s:%.2f%s" % (leaf_names[node.id], parentdist - node.dist, newick)
-    else:
-        si_node = silhouette_coefficient[node.id]
-        if len(newick) > 0:
-            newick = ")%.2f:%.2f%s" % (si_node, parentdist - node.dist, newick)
-        else:
-            newick = ");"
-        newick = getNewick(node.get_left(), newick, node.dist, leaf_names, silhouette_coefficient)
-        newick = getNewick(node.get_right(), ",%s" % (newick), node.dist, leaf_names, silhouette_coefficient)
-        newick = "(%s" % (newick)
-        return newick
-
-def getSilhouetteIndex(node, distance_matrix, results):
-    # set rootnode (DEBUG purposes)
-    if node.id not in results:
-        results[node.id] = 0
-
-    if not node.is_leaf():
-        # get list of indices cluster left (A)
-        a = node.get_left().pre_order(lambda x: x.id)
-
-        # get list of indices cluster right (B)
-        b = node.get_right().pre_order(lambda x: x.id)
-
-        if len(a) > 1:
-            # calculate average Si - cluster A
-            si_a = calculateSilhouetteIndex(distance_matrix, a, b)
-            results[node.get_left().id] = si_a
-
-            getSilhouetteIndex(node.get_left(), distance_matrix, results)
-
-        if len(b) > 1:
-            # calculate average Si - cluster B
-            si_b = calculateSilhouetteIndex(distance_matrix, b, a)
-            results[node.get_right().id] = si_b
-
-            getSilhouetteIndex(node.get_right(), distance_matrix, results)
-
-# Implementation based on Rousseeuw, P.J. J. Comput. Appl. Math. 20 (1987): 53-65
-def calculateSilhouetteIndex(distance_matrix, a, b):
-    si = 0
-    for i in a:
-        # calculate ai - avg distance within cluster
-        ai = 0
-        for j in a:
-            if i != j:
-                ai += distance_matrix[i,j]/(len(a)-1)
-
-        # calculate bi - avg distance to closest cluster
-        bi = 0
-        for j in b:
-            bi += distance_matrix[i,j]/len(b)
-
-        # silhouette index (averaged)
-        si += (bi-ai)/max(ai,bi)/len(a)
-
-    return si
-
-
 def DistanceData(request):
     def gpcrdb_number_comparator(e1, e2):
             t1 = e1.split('x')
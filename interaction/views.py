@@ -21,6 +21,7 @@ from common.views import AbsTargetSelection
 from contactnetwork.models import Interaction
 
 import os
+import errno
 import yaml
 from operator import itemgetter
 from datetime import datetime
@@ -31,19 +32,21 @@ from subprocess import call
 import urllib
 import collections
 from collections import OrderedDict, defaultdict
-from io import BytesIO
+from io import BytesIO, StringIO
 from Bio.PDB import PDBIO, PDBParser, Select, Vector
 import xlsxwriter
 
 #NEW IMPORTS
 import shutil
 import requests
+import uuid
 import numpy as np
+from scipy.spatial import cKDTree
 from math import degrees, atan2, cos, sin, pi
 from rdkit import Chem
 from rdkit import RDConfig
 from rdkit.Chem import AllChem
-from rdkit.Chem import MolFromPDBFile
+from rdkit.Chem import MolFromPDBBlock
 from rdkit.Chem import ChemicalFeatures
 #END NEW IMPORTS
 
@@ -81,28 +84,102 @@ def runcalculation_2022(pdbname, peptide="", file_input=False):
     return output
 
 #RETURN THE DICTIONARY RESULTS
-def runusercalculation_2022(filename, session):
-    output = calculate_interactions(filename, session, None)
+def runusercalculation_2022(filename, session, export=True):
+    output = calculate_interactions(filename, session, None, export=export)
     return output
 
-def calculate_interactions(pdb, session=None, peptide=None, file_input=False):
-    # REMEMBER TO GET THE RETURNS FROM ALL THE BELOW FUNCTIONS
-    hetlist = {}
-    ligand_atoms = {}
-    ligand_charged = {}
-    ligandcenter = {}
-    ligand_rings = {}
-    ligand_donors = {}
-    ligand_acceptors = {}
-    results = {}
-    sortedresults = []
-    summary_results = {}
-    new_results = {}
+#RETURN THE DICTIONARY RESULTS AND THE FILES, NOTHING IS WRITTEN TO DISK
+def runcalculation_in_memory(pdbname, pdb_text, peptide=""):
+    files = InteractionFiles(pdbname, pdb_text)
+    hetlist_display = find_interacting_ligand(pdb_text, pdbname, False)
+    output = run_interaction_pipeline(files, hetlist_display, peptide)
+    return output, files
+
+
+class InteractionFiles:
+    """PDB text of a structure and the ligand, fragment and interaction PDB files made from it by the interaction
+    calculation. The files are kept in memory under the paths they are exported to (projectdir/results/<pdb>/...) and
+    are only written to disk by export()."""
+
+    def __init__(self, pdb, pdb_text, projectdir='/tmp/interactions/'):
+        self.pdb = pdb
+        self.pdb_text = pdb_text
+        self.projectdir = projectdir
+        self.lines = pdb_text.splitlines(True)
+        self.files = OrderedDict()
+        # residue rings and hydrogen bond donors/acceptors by residue number
+        self.residue_rings = {}
+        self.residue_donors = {}
+        self._structure = None
+        self._residue_lines = None
+        self._hetatm_coords = None
+
+    def get_path(self, folder, filename):
+        return self.projectdir + 'results/' + self.pdb + '/' + folder + '/' + filename
+
+    def get_ligand_path(self, ligand):
+        return self.get_path('ligand', ligand + '_' + self.pdb + '.pdb')
+
+    def write(self, path, text):
+        self.files[path] = text
+
+    def read(self, path):
+        return self.files[path]
+
+    def get_structure(self):
+        # the structure is parsed once and shared by all steps
+        if self._structure is None:
+            self._structure = PDBParser(QUIET=True).get_structure(self.pdb, StringIO(self.pdb_text))
+        return self._structure
+
+    def get_residue_lines(self, residuenr, chain):
+        """Returns [(line index, line)] of the ATOM records of a residue, by residue number and chain as written."""
+        if self._residue_lines is None:
+            self._residue_lines = defaultdict(list)
+            for i, line in enumerate(self.lines):
+                if line.startswith('ATOM'):
+                    self._residue_lines[(line[22:26].strip(), line[21].strip())].append((i, line))
+        return self._residue_lines.get((residuenr, chain), [])
+
+    def get_hetatm_lines(self, atomvectors):
+        """Returns [(line index, line)] of the HETATM records closer than 0.1 A to any of the given Vectors."""
+        if self._hetatm_coords is None:
+            indices = [i for i, line in enumerate(self.lines) if line.startswith('HETATM')]
+            coords = [[float(self.lines[i][30:38]), float(self.lines[i][38:46]), float(self.lines[i][46:54])] for i in indices]
+            self._hetatm_coords = (indices, np.array(coords, dtype=np.float64).reshape(-1, 3))
+        indices, coords = self._hetatm_coords
+        close = np.zeros(len(indices), dtype=bool)
+        for targetvector in atomvectors:
+            close |= vector_norms(targetvector.get_array() - coords) < 0.1
+        return [(indices[i], self.lines[indices[i]]) for i in np.flatnonzero(close)]
+
+    def export(self):
+        """Write all files, replacing the results directory of the structure."""
+        directory = self.projectdir + 'results/' + self.pdb
+        tmp_directory = '{}.{}.tmp'.format(directory, uuid.uuid4().hex)
+        for folder in ['interaction', 'ligand', 'output', 'fragments']:
+            os.makedirs(os.sep.join([tmp_directory, folder]))
+        for path, text in self.files.items():
+            with open(tmp_directory + path[len(directory):], 'w') as f:
+                f.write(text)
+        # swap in the new directory, so that it is never seen half written. Between the two renames the directory is
+        # missing, and when a concurrent export of the same structure swaps in its directory first, that one is kept.
+        old_directory = tmp_directory + '.old'
+        try:
+            os.rename(directory, old_directory)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(tmp_directory, directory)
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+
+def calculate_interactions(pdb, session=None, peptide=None, file_input=False, export=True):
     projectdir = '/tmp/interactions/'
-    tempdir = projectdir + 'temp/'
-    if not os.path.exists(tempdir):
-        os.makedirs(tempdir)
-        # os.chmod(tempdir, 0o777)
     if not file_input:
         pdb_location = projectdir + 'pdbs/' + pdb + '.pdb'
     else:
@@ -113,67 +190,64 @@ def calculate_interactions(pdb, session=None, peptide=None, file_input=False):
     if not session:
         # print('Checking PDB')
         check_pdb(projectdir, pdb, file_input)
-        # print('Checking Dirs')
-        checkdirs(projectdir, pdb, file_input)
-        # print('Finding interacting ligand')
-        hetlist_display = find_interacting_ligand(pdb_location, pdb, file_input)
-        # Defining a shared parser
-        parser = PDBParser(QUIET=True)
-        if file_input:
-            pdb = complex_name
-        scroller = parser.get_structure(pdb, pdb_location)
-        # print('Creating ligand and poseview')
-        create_ligands_and_poseview(hetlist_display, scroller, projectdir, pdb, peptide) #ignore_het (should be global), inchikeys, smiles (should not be used)
-        # print('Building ligand info')
-        hetlist, ligand_charged, ligand_donors, ligand_atoms, ligand_acceptors, ligandcenter, ligand_rings = build_ligand_info(
-                                                                                                                scroller, hetlist_display,
-                                                                                                                projectdir, pdb, peptide, hetlist,
-                                                                                                                ligand_atoms, ligand_charged, ligand_donors,
-                                                                                                                ligand_acceptors, ligandcenter, ligand_rings)
-        # print('Finding interactions')
-        summary_results, new_results, results = find_interactions(
-                                                    scroller, projectdir, pdb, peptide,
-                                                    hetlist, ligandcenter, radius, summary_results,
-                                                    new_results, results, hydrophob_radius, ligand_rings, ligand_charged, pdb_location)
-        ### If no interactions found, increase ligand center size (e.g. TMA in 8WC5)
-        if len(summary_results)==0:
-            for l in ligandcenter:
-                ligandcenter[l][1] = ligandcenter[l][1]*1.6
-            summary_results, new_results, results = find_interactions(
-                                                    scroller, projectdir, pdb, peptide,
-                                                    hetlist, ligandcenter, radius, summary_results,
-                                                    new_results, results, hydrophob_radius, ligand_rings, ligand_charged, pdb_location)
-        # print('Analyzing interactions')
-        summary_results, new_results, sortedresults = analyze_interactions(
-                                                        projectdir, pdb, results, ligand_donors,
-                                                        ligand_acceptors, ligand_charged, new_results,
-                                                        summary_results, hetlist_display, sortedresults, pdb_location)
-        # print('Making pretty results')
-        pretty_results(projectdir, pdb, summary_results, pdb_location)
-
     else:
         projectdir = projectdir + session + "/"
-        checkdirs(projectdir, pdb, file_input)
-        hetlist_display = find_interacting_ligand(pdb_location, pdb, file_input)
-        # Defining a shared parser
-        parser = PDBParser(QUIET=True)
-        scroller = parser.get_structure(pdb, pdb_location)
-        create_ligands_and_poseview(hetlist_display, scroller, projectdir, pdb, peptide) #ignore_het (should be global), inchikeys, smiles (should not be used)
-        hetlist, ligand_charged, ligand_donors, ligand_atoms, ligand_acceptors, ligandcenter, ligand_rings = build_ligand_info(
-                                                                                                                scroller, hetlist_display,
-                                                                                                                projectdir, pdb, peptide, hetlist,
-                                                                                                                ligand_atoms, ligand_charged, ligand_donors,
-                                                                                                                ligand_acceptors, ligandcenter, ligand_rings)
+    with open(pdb_location, 'r') as f:
+        pdb_text = f.read()
+    # print('Finding interacting ligand')
+    hetlist_display = find_interacting_ligand(pdb_text, pdb, file_input)
+    if file_input:
+        pdb = complex_name
+    files = InteractionFiles(pdb, pdb_text, projectdir)
+    new_results = run_interaction_pipeline(files, hetlist_display, peptide, retry_ligand_center=not session)
+    if export:
+        files.export()
+    return new_results
+
+def run_interaction_pipeline(files, hetlist_display, peptide=None, retry_ligand_center=True):
+    # REMEMBER TO GET THE RETURNS FROM ALL THE BELOW FUNCTIONS
+    hetlist = {}
+    ligand_atoms = {}
+    ligand_charged = {}
+    ligandcenter = {}
+    ligand_rings = {}
+    ligand_donors = {}
+    ligand_acceptors = {}
+    results = {}
+    sortedresults = []
+    summary_results = {}
+    new_results = {}
+    # Defining a shared parser
+    scroller = files.get_structure()
+    # print('Creating ligand and poseview')
+    create_ligands_and_poseview(hetlist_display, files, peptide) #ignore_het (should be global), inchikeys, smiles (should not be used)
+    # print('Building ligand info')
+    hetlist, ligand_charged, ligand_donors, ligand_atoms, ligand_acceptors, ligandcenter, ligand_rings = build_ligand_info(
+                                                                                                            files, hetlist_display,
+                                                                                                            peptide, hetlist,
+                                                                                                            ligand_atoms, ligand_charged, ligand_donors,
+                                                                                                            ligand_acceptors, ligandcenter, ligand_rings)
+    # print('Finding interactions')
+    contacts = find_ligand_contacts(scroller, peptide, hetlist, max(radius, hydrophob_radius))
+    summary_results, new_results, results = find_interactions(
+                                                files, peptide,
+                                                hetlist, ligandcenter, radius, summary_results,
+                                                new_results, results, hydrophob_radius, ligand_rings, ligand_charged, contacts)
+    ### If no interactions found, increase ligand center size (e.g. TMA in 8WC5)
+    if len(summary_results)==0 and retry_ligand_center:
+        for l in ligandcenter:
+            ligandcenter[l][1] = ligandcenter[l][1]*1.6
         summary_results, new_results, results = find_interactions(
-                                                    scroller, projectdir, pdb,
-                                                    peptide, hetlist, ligandcenter,
-                                                    radius, summary_results, new_results,
-                                                    results, hydrophob_radius, ligand_rings, ligand_charged, pdb_location)
-        summary_results, new_results, sortedresults = analyze_interactions(
-                                                        projectdir, pdb, results, ligand_donors,
-                                                        ligand_acceptors, ligand_charged, new_results,
-                                                        summary_results, hetlist_display, sortedresults, pdb_location)
-        pretty_results(projectdir, pdb, summary_results, pdb_location)
+                                                files, peptide,
+                                                hetlist, ligandcenter, radius, summary_results,
+                                                new_results, results, hydrophob_radius, ligand_rings, ligand_charged, contacts)
+    # print('Analyzing interactions')
+    summary_results, new_results, sortedresults = analyze_interactions(
+                                                    files, results, ligand_donors,
+                                                    ligand_acceptors, ligand_charged, new_results,
+                                                    summary_results, hetlist_display, sortedresults)
+    # print('Making pretty results')
+    pretty_results(files, summary_results)
     return new_results
 
 
@@ -223,50 +297,7 @@ def check_pdb(projectdir, pdb, file_input):  #CAN WE HAVE THE PDB AS A VAR AND N
             f.write(pdbfile)
     # return output_pdb
 
-def checkdirs(projectdir, pdb, file_input): # DO WE NEED TO HAVE THIS DATA STORE IN TMP FILES?
-    # check that dirs are there and have right permissions
-    if not file_input:
-        directory = projectdir + 'results/' + pdb
-        if os.path.exists(directory):
-            shutil.rmtree(directory)
-        directory = projectdir + 'results/' + pdb + '/interaction'
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        directory = projectdir + 'results/' + pdb + '/ligand' #not really necessary
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        directory = projectdir + 'results/' + pdb + '/output'
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        directory = projectdir + 'results/' + pdb + '/fragments' #not really necessary
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        directory = projectdir + 'temp/'
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-    else:
-        complex_name = pdb.split('/')[-1].split('-rank')[0]
-        directory = projectdir + 'results/' + complex_name
-        if os.path.exists(directory):
-            shutil.rmtree(directory)
-        directory = projectdir + 'results/' + complex_name + '/interaction'
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        directory = projectdir + 'results/' + complex_name + '/ligand' #not really necessary
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        directory = projectdir + 'results/' + complex_name + '/output'
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        directory = projectdir + 'results/' + complex_name + '/fragments' #not really necessary
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        directory = projectdir + 'temp/'
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-
-def find_interacting_ligand(pdb_location, pdb, file_input):
+def find_interacting_ligand(pdb_text, pdb, file_input):
     #Compare these names to the ones in the database
     if not file_input:
         db_ligs = list(StructureLigandInteraction.objects.filter(structure_id__pdb_code_id__index=pdb.upper()).values_list('pdb_reference', flat=True))
@@ -275,7 +306,8 @@ def find_interacting_ligand(pdb_location, pdb, file_input):
         # lig_id = pdb.split('/')[-1].split('-')[1]
         code = '_'.join(['AFM', receptor]).upper()
         db_ligs = list(StructureLigandInteraction.objects.filter(structure_id__pdb_code_id__index=code).values_list('pdb_reference', flat=True))
-    f_in = open(pdb_location, 'r')
+    # one pass over the lines for all ligands, as over an open file
+    f_in = iter(pdb_text.splitlines(True))
     d = {}
     for lig in db_ligs:
         if len(lig)==5:
@@ -310,7 +342,7 @@ def accept_residue(residue, hetflag, peptide=None):
     else:
         return 0
 
-def create_ligands_and_poseview(ligand_het, scroller, projectdir, pdb, peptide=None):
+def create_ligands_and_poseview(ligand_het, files, peptide=None):
 
     class HetSelect(Select):
         @staticmethod
@@ -328,6 +360,7 @@ def create_ligands_and_poseview(ligand_het, scroller, projectdir, pdb, peptide=N
             else:
                 return 0
 
+    scroller = files.get_structure()
     for model in scroller:
         for chain in model:
             for residue in chain:
@@ -338,19 +371,19 @@ def create_ligands_and_poseview(ligand_het, scroller, projectdir, pdb, peptide=N
                     hetflag= 'pep'
 
                 if hetflag in ligand_het.keys():
-                    ligand_pdb = projectdir + 'results/' + pdb + '/ligand/' + hetflag + '_' + pdb + '.pdb'
+                    ligand_pdb = files.get_ligand_path(hetflag)
 
                     # if sdf not made, make it #Always make them for now
-                    if not os.path.isfile(ligand_pdb):
+                    if ligand_pdb not in files.files:
                         io = PDBIO()
                         io.set_structure(scroller)
+                        ligand_file = StringIO()
                         if peptide and chain.id==peptide:
-                            io.save(ligand_pdb, ClassSelect())
+                            io.save(ligand_file, ClassSelect())
                         else:
-                            io.save(ligand_pdb, HetSelect())
+                            io.save(ligand_file, HetSelect())
+                        files.write(ligand_pdb, ligand_file.getvalue())
                         # check_unique_ligand_mol(ligand_pdb)
-                        if MolFromPDBFile(ligand_pdb) == 0:
-                            continue
                     else:
                         continue
 
@@ -396,10 +429,10 @@ def isRingAromatic(mol, bondRing):
             return False
     return True
 
-def build_ligand_info(scroller, lig_het, projectdir, pdb, peptide, hetlist, ligand_atoms, ligand_charged, ligand_donors, ligand_acceptors, ligandcenter, ligand_rings):
+def build_ligand_info(files, lig_het, peptide, hetlist, ligand_atoms, ligand_charged, ligand_donors, ligand_acceptors, ligandcenter, ligand_rings):
     count_atom_ligand = {}
 
-    for model in scroller:
+    for model in files.get_structure():
         for chain in model:
             for residue in chain:
                 hetresname = residue.get_resname()
@@ -415,20 +448,15 @@ def build_ligand_info(scroller, lig_het, projectdir, pdb, peptide, hetlist, liga
                 # REMEMBER TO PARSE ONLY THE ACTUAL LIGAND
                 if hetflag in lig_het.keys():
                     if (hetflag not in hetlist) or (chain.id==peptide):
-                        if MolFromPDBFile(projectdir + 'results/' + pdb + '/ligand/' + hetflag + '_' + pdb + '.pdb') == 0:
-                            # This ligand has no molecules
-                            # print('no info for',hetflag)
-                            continue
-
                         if hetflag not in hetlist: #do not recreate for peptides
                             hetlist[hetflag] = []
                             ligand_charged[hetflag] = []
                             ligand_donors[hetflag] = []
                             ligand_acceptors[hetflag] = []
                             count_atom_ligand[hetflag] = 0
-                            mol2 = MolFromPDBFile(projectdir + 'results/' + pdb + '/ligand/' + hetflag + '_' + pdb + ".pdb")
+                            mol2 = MolFromPDBBlock(files.read(files.get_ligand_path(hetflag)))
                             if not mol2:
-                                mol2 = MolFromPDBFile(projectdir + 'results/' + pdb + '/ligand/' + hetflag + '_' + pdb + ".pdb", sanitize=False)
+                                mol2 = MolFromPDBBlock(files.read(files.get_ligand_path(hetflag)), sanitize=False)
                             hetflag_sdf = get_sdf_ligand_from_cache(hetflag)
                             try:
                                 mol2 = AllChem.AssignBondOrdersFromTemplate(refmol=hetflag_sdf, mol=mol2)
@@ -528,174 +556,208 @@ def build_ligand_info(scroller, lig_het, projectdir, pdb, peptide, hetlist, liga
 
     return hetlist, ligand_charged, ligand_donors, ligand_atoms, ligand_acceptors, ligandcenter, ligand_rings
 
+def vector_norms(vectors):
+    # same summation order as Vector.norm()
+    return np.sqrt(vectors[:, 0]*vectors[:, 0] + vectors[:, 1]*vectors[:, 1] + vectors[:, 2]*vectors[:, 2])
+
+# FIND ALL LIGAND-RECEPTOR ATOM PAIRS WITHIN CUTOFF AT ONCE
+def find_ligand_contacts(scroller, peptide, hetlist, cutoff):
+    """Returns the receptor residues as (chain id, residue, atoms), the coordinates of their CA atoms and, per ligand,
+    a dict of residue index: [(ligand atom index, residue atom index, distance)] of the atom pairs closer than cutoff.
+    The pairs of a residue are in the order in which find_interactions checks them."""
+    residues = []
+    atom_coords = []
+    atom_residues = []
+    atom_positions = []
+    for model in scroller:
+        for chain in model:
+            chainid = chain.get_id()
+            if peptide and chainid==peptide:
+                continue
+            for residue in chain:
+                hetflagtest = str(residue.get_full_id()[3][0]).strip()
+                if hetflagtest or 'CA' not in residue:
+                    continue  # residue is a hetnam
+                atoms = list(residue)
+                for position, atom in enumerate(atoms):
+                    atom_coords.append(atom.get_coord())
+                    atom_residues.append(len(residues))
+                    atom_positions.append(position)
+                residues.append((chainid, residue, atoms))
+    ca_coords = np.array([residue['CA'].get_coord() for _, residue, _ in residues], dtype=np.float64).reshape(-1, 3)
+    atom_coords = np.array(atom_coords, dtype=np.float64).reshape(-1, 3)
+    atom_residues = np.array(atom_residues, dtype=np.int64)
+    atom_positions = np.array(atom_positions, dtype=np.int64)
+    tree = cKDTree(atom_coords)
+
+    contacts = {}
+    for hetflag, atomlist in hetlist.items():
+        contacts[hetflag] = {}
+        het_coords = np.array([atom_het[2].get_array() for atom_het in atomlist], dtype=np.float64).reshape(-1, 3)
+        neighbours = tree.query_ball_point(het_coords, cutoff) if len(het_coords) else []
+        het_index = np.repeat(np.arange(len(het_coords)), [len(n) for n in neighbours]).astype(np.int64)
+        atom_index = np.fromiter((i for n in neighbours for i in n), dtype=np.int64, count=len(het_index))
+        distances = vector_norms(het_coords[het_index] - atom_coords[atom_index])
+        close = distances < cutoff
+        het_index, atom_index, distances = het_index[close], atom_index[close], distances[close]
+        # per residue, ligand atoms first and residue atoms second
+        order = np.lexsort((atom_positions[atom_index], het_index, atom_residues[atom_index]))
+        for i in order:
+            contacts[hetflag].setdefault(atom_residues[atom_index[i]], []).append((het_index[i], atom_positions[atom_index[i]], distances[i]))
+    return residues, ca_coords, contacts
+
 # LOOP OVER RECEPTOR AND FIND INTERACTIONS
-def find_interactions(scroller, projectdir, pdb, peptide, hetlist, ligandcenter, radius, summary_results, new_results, results, hydrophob_radius, ligand_rings, ligand_charged, pdb_location):
-    count_atom = 0
-    count_skips = 0
-    count_calcs = 0
+def find_interactions(files, peptide, hetlist, ligandcenter, radius, summary_results, new_results, results, hydrophob_radius, ligand_rings, ligand_charged, contacts=None):
+    if contacts is None:
+        contacts = find_ligand_contacts(files.get_structure(), peptide, hetlist, max(radius, hydrophob_radius))
+    receptor_residues, ca_coords, ligand_contacts = contacts
     # waals = []
     for heteroatom in ligandcenter.keys():
-        for model in scroller:
-            for chain in model:
-                chainid = chain.get_id()
-                if peptide and chainid==peptide:
-                    continue
-                for residue in chain:
-                    aa_resname = residue.get_resname()
-                    aa_seqid = str(residue.get_full_id()[3][1])
-                    aaname = aa_resname + aa_seqid + chainid
-                    hetflagtest = str(residue.get_full_id()[3][0]).strip()
-
-                    if hetflagtest or 'CA' not in residue:
-                        continue  # residue is a hetnam
-
-                    # could probably make a check here to see if this residue was
-                    # anywhere near the ligand, otherwise skip the check per atom
-                    ca = residue['CA'].get_vector()
-                    if (ca - ligandcenter[heteroatom][0]).norm() > ligandcenter[heteroatom][1]:
-                        count_skips += 1
+        # only residues with the CA atom near the ligand center
+        ca_distances = vector_norms(ca_coords - ligandcenter[heteroatom][0].get_array())
+        for residue_index in np.flatnonzero(ca_distances <= ligandcenter[heteroatom][1]):
+            chainid, residue, residue_atoms = receptor_residues[residue_index]
+            aa_resname = residue.get_resname()
+            aa_seqid = str(residue.get_full_id()[3][1])
+            aaname = aa_resname + aa_seqid + chainid
+
+            for hetflag, atomlist in hetlist.items():
+                sum_data = 0
+                hydrophobic_count = 0
+                accesible = False
+                for het_index, atom_index, distance in ligand_contacts[hetflag].get(residue_index, []):
+                    het_atom = atomlist[het_index][1]
+                    het_vector = atomlist[het_index][2]
+                    atom = residue_atoms[atom_index]
+                    aa_atom = atom.name
+                    aa_atom_type = atom.element
+                    # if distance < 6:
+                    #     waals.append([aaname])
+                    if distance < radius:
+                        if hetflag not in results:
+                            results[hetflag] = {}
+                            summary_results[hetflag] = {'score': [], 'hbond': [], 'hbondplus': [], 'pistack': [],
+                                                        'hbond_confirmed': [], 'aromatic': [],'aromaticff': [],
+                                                        'ionaromatic': [], 'aromaticion': [], 'aromaticef': [],
+                                                        'aromaticfe': [], 'hydrophobic': [], 'waals': [], 'accessible':[]}
+                            new_results[hetflag] = {'interactions':[]}
+                        if aaname not in results[hetflag]:
+                            results[hetflag][aaname] = []
+                        if (het_atom[0] != 'H') or (aa_atom[0] != 'H') or (aa_atom_type != 'H'):
+                            tempdistance = round(distance, 2)
+                            results[hetflag][aaname].append([het_atom, aa_atom, tempdistance, het_vector, atom.get_vector(), aa_seqid, chainid])
+                            sum_data += 1
+                    # if both are carbon then we are making a hydrophic interaction
+                    if (het_atom[0] == 'C') and (aa_atom[0] == 'C') and (distance < hydrophob_radius):
+                        hydrophobic_count += 1
+
+                    # If within 5 angstrom and not a backbone atom (name C, O, N), then indicate as a residue in vicinity of the ligand
+                    if (distance < radius) and (aa_atom not in ['C', 'O', 'N']):
+                        accesible = True
+                fragment_file = ''
+                # if hetflag in summary_results.keys():
+                #     summary_results[hetflag]['waals'] = waals
+                #     for amino_acid in waals:
+                #         new_results[hetflag]['interactions'].append([amino_acid[0],fragment_file,'waals','accessible','waals',''])
+                if accesible: #if accessible!)
+                    summary_results[hetflag]['accessible'].append([aaname])
+                    fragment_file = fragment_library(files, hetflag, None, '', aa_seqid, chainid, 'access')
+                    new_results[hetflag]['interactions'].append([aaname,fragment_file,'acc','accessible','hidden',''])
+                if hydrophobic_count > 2 and AA[aaname[0:3]] in HYDROPHOBIC_AA:  # min 3 c-c interactions
+                    summary_results[hetflag]['hydrophobic'].append([aaname, hydrophobic_count])
+                    fragment_file = fragment_library(files, hetflag, None, '', aa_seqid, chainid, 'hydrop')
+                    new_results[hetflag]['interactions'].append([aaname,fragment_file,'hyd','hydrophobic','hydrophobic',''])
+                if sum_data > 1 and aa_resname in AROMATIC:
+                    aarings = get_ring_from_aa(files, aa_seqid, residue)
+                    #aarings.append([atomlist, center, normal, vectorlist])
+                    if not aarings:
                         continue
-                    for hetflag, atomlist in hetlist.items():
-                        sum_data = 0
-                        hydrophobic_count = 0
-                        accesible = False
-                        for atom_het in atomlist:
-                            het_atom = atom_het[1]
-                            het_vector = atom_het[2]
-                            aaatomlist = []
-                            for atom in residue:
-                                count_atom += 1
-                                aa_vector = atom.get_vector()
-                                aa_atom = atom.name
-                                aa_atom_type = atom.element
-                                aaatomlist.append([count_atom, aa_vector, aa_atom])
-                                distance = (het_vector - aa_vector)
-                                count_calcs += 1
-                                # if distance.norm() < 6:
-                                #     waals.append([aaname])
-                                if distance.norm() < radius:
-                                    if hetflag not in results:
-                                        results[hetflag] = {}
-                                        summary_results[hetflag] = {'score': [], 'hbond': [], 'hbondplus': [], 'pistack': [],
-                                                                    'hbond_confirmed': [], 'aromatic': [],'aromaticff': [],
-                                                                    'ionaromatic': [], 'aromaticion': [], 'aromaticef': [],
-                                                                    'aromaticfe': [], 'hydrophobic': [], 'waals': [], 'accessible':[]}
-                                        new_results[hetflag] = {'interactions':[]}
-                                    if aaname not in results[hetflag]:
-                                        results[hetflag][aaname] = []
-                                    if (het_atom[0] != 'H') or (aa_atom[0] != 'H') or (aa_atom_type != 'H'):
-                                        tempdistance = round(distance.norm(), 2)
-                                        results[hetflag][aaname].append([het_atom, aa_atom, tempdistance, het_vector, aa_vector, aa_seqid, chainid])
-                                        sum_data += 1
-                                # if both are carbon then we are making a hydrophic interaction
-                                if (het_atom[0] == 'C') and (aa_atom[0] == 'C') and (distance.norm() < hydrophob_radius):
-                                    hydrophobic_count += 1
-
-                                # If within 5 angstrom and not a backbone atom (name C, O, N), then indicate as a residue in vicinity of the ligand
-                                if (distance.norm() < radius) and (aa_atom not in ['C', 'O', 'N']):
-                                    accesible = True
-                        fragment_file = ''
-                        # if hetflag in summary_results.keys():
-                        #     summary_results[hetflag]['waals'] = waals
-                        #     for amino_acid in waals:
-                        #         new_results[hetflag]['interactions'].append([amino_acid[0],fragment_file,'waals','accessible','waals',''])
-                        if accesible: #if accessible!)
-                            summary_results[hetflag]['accessible'].append([aaname])
-                            fragment_file = fragment_library(projectdir, pdb, hetflag, None, '', aa_seqid, chainid, 'access', pdb_location)
-                            new_results[hetflag]['interactions'].append([aaname,fragment_file,'acc','accessible','hidden',''])
-                        if hydrophobic_count > 2 and AA[aaname[0:3]] in HYDROPHOBIC_AA:  # min 3 c-c interactions
-                            summary_results[hetflag]['hydrophobic'].append([aaname, hydrophobic_count])
-                            fragment_file = fragment_library(projectdir, pdb, hetflag, None, '', aa_seqid, chainid, 'hydrop', pdb_location)
-                            new_results[hetflag]['interactions'].append([aaname,fragment_file,'hyd','hydrophobic','hydrophobic',''])
-                        if sum_data > 1 and aa_resname in AROMATIC:
-                            aarings = get_ring_from_aa(scroller, projectdir, aa_seqid, residue)
-                            #aarings.append([atomlist, center, normal, vectorlist])
-                            if not aarings:
-                                continue
-                            for aaring in aarings:
-                                center = aaring[1]
-                                count = 0
-                                for ring in ligand_rings[hetflag]:
-                                    shortest_center_het_ring_to_res_atom = 10
-                                    shortest_center_aa_ring_to_het_atom = 10
-                                    for a in aaring[3]:
-                                        if (ring[1] - a).norm() < shortest_center_het_ring_to_res_atom:
-                                            shortest_center_het_ring_to_res_atom = (ring[1] - a).norm()
-                                    for a in ring[3]:
-                                        if (center - a).norm() < shortest_center_aa_ring_to_het_atom:
-                                            shortest_center_aa_ring_to_het_atom = (center - a).norm()
-                                    count += 1
-                                    # take vector from two centers, and compare against
-                                    # vector from center to outer point -- this will
-                                    # give the perpendicular angle.
-                                    angle = Vector.angle(center - ring[1], ring[2]) #aacenter to ring center vs ring normal
-                                    # take vector from two centers, and compare against
-                                    # vector from center to outer point -- this will
-                                    # give the perpendicular angle.
-                                    angle2 = Vector.angle(center - ring[1], aaring[2]) #aacenter to ring center vs AA normal
-                                    angle3 = Vector.angle(ring[2], aaring[2]) #two normal vectors against eachother
-                                    angle_degrees = [round(degrees(angle), 1), round(degrees(angle2), 1), round(degrees(angle3), 1)]
-                                    distance = (center - ring[1]).norm()
-                                    if distance < 5 and (angle_degrees[2]<20 or abs(angle_degrees[2]-180)<20):  # poseview uses <5
-                                        summary_results[hetflag]['aromatic'].append([aaname, count, round(distance, 2), angle_degrees])
-                                        fragment_file = fragment_library_aromatic(projectdir, pdb, hetflag, ring[3], aa_seqid, chainid, count, pdb_location)
-                                        if check_other_aromatic(aaname, hetflag, {'Distance':round(distance, 2),'Angles':angle_degrees}, new_results):
-                                            new_results[hetflag]['interactions'].append([aaname,fragment_file,
-                                                                                         'aro_ff','aromatic (face-to-face)','aromatic','none',
-                                                                                         {'Distance':round(distance, 2),'ResAtom to center':round(shortest_center_het_ring_to_res_atom,2),
-                                                                                         'LigAtom to center': round(shortest_center_aa_ring_to_het_atom,2),'Angles':angle_degrees}])
-                                            remove_hyd(aaname, hetflag, new_results)
-                                    # need to be careful for edge-edge
-                                    elif (shortest_center_aa_ring_to_het_atom < 4.5) and abs(angle_degrees[0]-90)<30 and abs(angle_degrees[2]-90)<30:
-                                        summary_results[hetflag]['aromaticfe'].append([aaname, count, round(distance, 2), angle_degrees])
-                                        fragment_file = fragment_library_aromatic(projectdir, pdb, hetflag, ring[3], aa_seqid, chainid, count, pdb_location)
-                                        if check_other_aromatic(aaname, hetflag, {'Distance':round(distance, 2),'Angles':angle_degrees}, new_results):
-                                            new_results[hetflag]['interactions'].append([aaname,fragment_file,
-                                                                                         'aro_fe_protein','aromatic (face-to-edge)','aromatic','protein',
-                                                                                         {'Distance':round(distance, 2),'ResAtom to center':round(shortest_center_het_ring_to_res_atom,2),
-                                                                                         'LigAtom to center': round(shortest_center_aa_ring_to_het_atom,2),'Angles':angle_degrees}])
-                                            remove_hyd(aaname, hetflag, new_results)
-                                    # need to be careful for edge-edge
-                                    elif (shortest_center_het_ring_to_res_atom < 4.5) and abs(angle_degrees[1]-90)<30 and abs(angle_degrees[2]-90)<30:
-                                        summary_results[hetflag]['aromaticef'].append([aaname, count, round(distance, 2), angle_degrees])
-                                        fragment_file = fragment_library_aromatic(projectdir, pdb, hetflag, ring[3], aa_seqid, chainid, count, pdb_location)
-                                        if check_other_aromatic(aaname, hetflag, {'Distance':round(distance, 2),'Angles':angle_degrees}, new_results):
-                                            new_results[hetflag]['interactions'].append([aaname,fragment_file,
-                                                                                         'aro_ef_protein','aromatic (edge-to-face)','aromatic','protein',
-                                                                                         {'Distance':round(distance, 2),'ResAtom to center':round(shortest_center_het_ring_to_res_atom,2),
-                                                                                         'LigAtom to center': round(shortest_center_aa_ring_to_het_atom,2),'Angles':angle_degrees}])
-                                            remove_hyd(aaname, hetflag, new_results)
-                                for charged in ligand_charged[hetflag]:
-                                    distance = (center - charged[0]).norm()
-                                    # needs max 4.2 distance to make aromatic+
-                                    if distance < 4.2 and charged[1] > 0:
-                                        summary_results[hetflag]['aromaticion'].append([aaname, count, round(distance, 2), charged])
-                                        #FIXME fragment file
+                    for aaring in aarings:
+                        center = aaring[1]
+                        count = 0
+                        for ring in ligand_rings[hetflag]:
+                            shortest_center_het_ring_to_res_atom = 10
+                            shortest_center_aa_ring_to_het_atom = 10
+                            for a in aaring[3]:
+                                if (ring[1] - a).norm() < shortest_center_het_ring_to_res_atom:
+                                    shortest_center_het_ring_to_res_atom = (ring[1] - a).norm()
+                            for a in ring[3]:
+                                if (center - a).norm() < shortest_center_aa_ring_to_het_atom:
+                                    shortest_center_aa_ring_to_het_atom = (center - a).norm()
+                            count += 1
+                            # take vector from two centers, and compare against
+                            # vector from center to outer point -- this will
+                            # give the perpendicular angle.
+                            angle = Vector.angle(center - ring[1], ring[2]) #aacenter to ring center vs ring normal
+                            # take vector from two centers, and compare against
+                            # vector from center to outer point -- this will
+                            # give the perpendicular angle.
+                            angle2 = Vector.angle(center - ring[1], aaring[2]) #aacenter to ring center vs AA normal
+                            angle3 = Vector.angle(ring[2], aaring[2]) #two normal vectors against eachother
+                            angle_degrees = [round(degrees(angle), 1), round(degrees(angle2), 1), round(degrees(angle3), 1)]
+                            distance = (center - ring[1]).norm()
+                            if distance < 5 and (angle_degrees[2]<20 or abs(angle_degrees[2]-180)<20):  # poseview uses <5
+                                summary_results[hetflag]['aromatic'].append([aaname, count, round(distance, 2), angle_degrees])
+                                fragment_file = fragment_library_aromatic(files, hetflag, ring[3], aa_seqid, chainid, count)
+                                if check_other_aromatic(aaname, hetflag, {'Distance':round(distance, 2),'Angles':angle_degrees}, new_results):
+                                    new_results[hetflag]['interactions'].append([aaname,fragment_file,
+                                                                                 'aro_ff','aromatic (face-to-face)','aromatic','none',
+                                                                                 {'Distance':round(distance, 2),'ResAtom to center':round(shortest_center_het_ring_to_res_atom,2),
+                                                                                 'LigAtom to center': round(shortest_center_aa_ring_to_het_atom,2),'Angles':angle_degrees}])
+                                    remove_hyd(aaname, hetflag, new_results)
+                            # need to be careful for edge-edge
+                            elif (shortest_center_aa_ring_to_het_atom < 4.5) and abs(angle_degrees[0]-90)<30 and abs(angle_degrees[2]-90)<30:
+                                summary_results[hetflag]['aromaticfe'].append([aaname, count, round(distance, 2), angle_degrees])
+                                fragment_file = fragment_library_aromatic(files, hetflag, ring[3], aa_seqid, chainid, count)
+                                if check_other_aromatic(aaname, hetflag, {'Distance':round(distance, 2),'Angles':angle_degrees}, new_results):
+                                    new_results[hetflag]['interactions'].append([aaname,fragment_file,
+                                                                                 'aro_fe_protein','aromatic (face-to-edge)','aromatic','protein',
+                                                                                 {'Distance':round(distance, 2),'ResAtom to center':round(shortest_center_het_ring_to_res_atom,2),
+                                                                                 'LigAtom to center': round(shortest_center_aa_ring_to_het_atom,2),'Angles':angle_degrees}])
+                                    remove_hyd(aaname, hetflag, new_results)
+                            # need to be careful for edge-edge
+                            elif (shortest_center_het_ring_to_res_atom < 4.5) and abs(angle_degrees[1]-90)<30 and abs(angle_degrees[2]-90)<30:
+                                summary_results[hetflag]['aromaticef'].append([aaname, count, round(distance, 2), angle_degrees])
+                                fragment_file = fragment_library_aromatic(files, hetflag, ring[3], aa_seqid, chainid, count)
+                                if check_other_aromatic(aaname, hetflag, {'Distance':round(distance, 2),'Angles':angle_degrees}, new_results):
+                                    new_results[hetflag]['interactions'].append([aaname,fragment_file,
+                                                                                 'aro_ef_protein','aromatic (edge-to-face)','aromatic','protein',
+                                                                                 {'Distance':round(distance, 2),'ResAtom to center':round(shortest_center_het_ring_to_res_atom,2),
+                                                                                 'LigAtom to center': round(shortest_center_aa_ring_to_het_atom,2),'Angles':angle_degrees}])
+                                    remove_hyd(aaname, hetflag, new_results)
+                        for charged in ligand_charged[hetflag]:
+                            distance = (center - charged[0]).norm()
+                            # needs max 4.2 distance to make aromatic+
+                            if distance < 4.2 and charged[1] > 0:
+                                summary_results[hetflag]['aromaticion'].append([aaname, count, round(distance, 2), charged])
+                                #FIXME fragment file
+                                new_results[hetflag]['interactions'].append([aaname,'','aro_ion_protein','aromatic (pi-cation)','aromatic','protein',{'Distance':round(distance, 2)}])
+                                remove_hyd(aaname, hetflag, new_results)
+                #Calculate PiStack interactions
+                if (aa_resname in ['ARG', 'LYS']) and ligand_rings[hetflag]:
+                    for atom in residue:
+                        aa_vector = atom.get_vector()
+                        aa_atom = atom.name
+                        #First: find the receptor atom that checks
+                        if aa_atom in cation_atoms:
+                            #Second: calculate the center of the aromatic ring (ligand)
+                            for ring in ligand_rings[hetflag]:
+                                ring_center = ring[1]
+                                #Third: calculate the distance of the residue atom to the center of the ring
+                                distance = (ring_center - aa_vector).norm()
+                                #and check distance is less than 6.6
+                                if distance < 6.6:
+                                    #Fourth: calculate the angle between the atom and the perpendicular center
+                                    perp_vector = ring[2]
+                                    angle = degrees(Vector.angle(perp_vector, aa_vector))
+                                    if angle <= 30:
+                                        summary_results[hetflag]['pistack'].append([aaname])
                                         new_results[hetflag]['interactions'].append([aaname,'','aro_ion_protein','aromatic (pi-cation)','aromatic','protein',{'Distance':round(distance, 2)}])
-                                        remove_hyd(aaname, hetflag, new_results)
-                        #Calculate PiStack interactions
-                        if (aa_resname in ['ARG', 'LYS']) and ligand_rings[hetflag]:
-                            for atom in residue:
-                                aa_vector = atom.get_vector()
-                                aa_atom = atom.name
-                                #First: find the receptor atom that checks
-                                if aa_atom in cation_atoms:
-                                    #Second: calculate the center of the aromatic ring (ligand)
-                                    for ring in ligand_rings[hetflag]:
-                                        ring_center = ring[1]
-                                        #Third: calculate the distance of the residue atom to the center of the ring
-                                        distance = (ring_center - aa_vector).norm()
-                                        #and check distance is less than 6.6
-                                        if distance < 6.6:
-                                            #Fourth: calculate the angle between the atom and the perpendicular center
-                                            perp_vector = ring[2]
-                                            angle = degrees(Vector.angle(perp_vector, aa_vector))
-                                            if angle <= 30:
-                                                summary_results[hetflag]['pistack'].append([aaname])
-                                                new_results[hetflag]['interactions'].append([aaname,'','aro_ion_protein','aromatic (pi-cation)','aromatic','protein',{'Distance':round(distance, 2)}])
     return summary_results, new_results, results
 
-def get_ring_from_aa(scroller, projectdir, residueid, residue):
+def get_ring_from_aa(files, residueid, residue):
+    if residueid in files.residue_rings:
+        return files.residue_rings[residueid]
 
     class AAselect(Select):
         def accept_residue(self, residue):
@@ -705,9 +767,10 @@ def get_ring_from_aa(scroller, projectdir, residueid, residue):
                 return 0
 
     io = PDBIO()
-    io.set_structure(scroller)
-    io.save(projectdir + 'temp/' + residueid + '.pdb', AAselect())
-    mol = MolFromPDBFile(projectdir + 'temp/' + residueid + '.pdb')
+    io.set_structure(files.get_structure())
+    residue_file = StringIO()
+    io.save(residue_file, AAselect())
+    mol = MolFromPDBBlock(residue_file.getvalue())
     mol = Chem.AddHs(mol)
     # ANALYZING AROMATIC RINGS
     rings = Chem.rdmolops.GetSSSR(mol)
@@ -734,6 +797,7 @@ def get_ring_from_aa(scroller, projectdir, residueid, residue):
                 normal2 = center - vectorlist[2]
                 normal = Vector(np.cross([normal1[0],normal1[1],normal1[2]],[normal2[0],normal2[1],normal2[2]]))
                 ringlist.append([atomlist, center, normal, vectorlist])
+    files.residue_rings[residueid] = ringlist
     return ringlist
 
 def remove_hyd(aa, ligand, new_results):
@@ -762,7 +826,9 @@ def check_other_aromatic(aa, ligand, info, new_results):
     new_results[ligand]['interactions'] = templist
     return check
 
-def get_hydrogen_from_aa(projectdir, pdb, residueid, pdb_location):
+def get_hydrogen_from_aa(files, residueid):
+    if residueid in files.residue_donors:
+        return files.residue_donors[residueid]
 
     class AAselect(Select):
 
@@ -772,14 +838,13 @@ def get_hydrogen_from_aa(projectdir, pdb, residueid, pdb_location):
                 return 1
             else:
                 return 0
-    ptemp = PDBParser(QUIET=True)
-    stemp = ptemp.get_structure(pdb, pdb_location)
 
     io = PDBIO()
-    io.set_structure(stemp)
-    io.save(projectdir + 'temp/' + residueid + '.pdb', AAselect())
+    io.set_structure(files.get_structure())
+    residue_file = StringIO()
+    io.save(residue_file, AAselect())
 
-    mol = MolFromPDBFile(projectdir + 'temp/' +residueid + '.pdb')
+    mol = MolFromPDBBlock(residue_file.getvalue())
     mol = Chem.AddHs(mol)
 
     fdefName = os.path.join(RDConfig.RDDataDir,'BaseFeatures.fdef')
@@ -811,100 +876,45 @@ def get_hydrogen_from_aa(projectdir, pdb, residueid, pdb_location):
                     positions_hs = mol.GetConformer().GetAtomPosition(j)
                     temphatoms.append(Vector(positions_hs))
         donors.append([chargevector, temphatoms, acceptor])
+    files.residue_donors[residueid] = donors
     return donors
 
-def fragment_library(projectdir, pdb, ligand, atomvector, atomname, residuenr, chain, typeinteraction, pdbfile):
+def fragment_library(files, ligand, atomvector, atomname, residuenr, chain, typeinteraction):
     #if debug:
         #print "Make fragment pdb file for ligand:", ligand, "atom vector", atomvector, "atomname", atomname, "residuenr from protein", residuenr, typeinteraction, 'chain', chain
     residuename = 'unknown'
-    ligand_pdb = projectdir + 'results/' + pdb + '/ligand/' + ligand + '_' + pdb + '.pdb'
-    mol2 = MolFromPDBFile(ligand_pdb, removeHs=True)
-    listofvectors = []
     chain = chain.strip()
-    f_in = open(pdbfile, 'r')
-    tempstr = ''
-    for line in f_in:
-        if line.startswith('HETATM'):
-            atomvector = Vector(line[30:38], line[38:46], line[46:54])
-            residue_number = line[22:26]
-            tempchain = line[21]
-            skip = 1
-            for targetvector in listofvectors:
-                distance = (targetvector - atomvector).norm()
-                if distance < 0.1:
-                    skip = 0
-            if skip == 1:
-                continue
-        elif line.startswith('ATOM'):
-            residue_number = line[22:26].strip()
-            tempchain = line[21].strip()
-            if residue_number != residuenr:
-                continue
-            if tempchain != chain:
-                continue
-            residuenr = residue_number
-            chain = tempchain
-            residuename = line[17:20].strip()
-        else:
-            continue  # ignore all other lines
-
-        tempstr += line
-
-    filename = projectdir + 'results/' + pdb + '/fragments/' + pdb + "_" + ligand + \
-        "_" + residuename + residuenr + chain + "_" + atomname + "_" + typeinteraction + ".pdb"
-    f_in.close()
-    f = open(filename, 'w')
-    f.write(tempstr)
-    f.close()
+    # the fragment holds the ATOM records of the residue, no ligand atoms are selected
+    residue_lines = files.get_residue_lines(residuenr, chain)
+    if residue_lines:
+        residuename = residue_lines[-1][1][17:20].strip()
+    tempstr = ''.join([line for _, line in residue_lines])
+
+    filename = files.get_path('fragments', files.pdb + "_" + ligand + \
+        "_" + residuename + residuenr + chain + "_" + atomname + "_" + typeinteraction + ".pdb")
     try:
-        mol2 = MolFromPDBFile(filename)
-        Chem.MolToPDBFile(mol2, filename)
+        mol2 = MolFromPDBBlock(tempstr)
+        files.write(filename, Chem.MolToPDBBlock(mol2))
     except:
-        mol2 = MolFromPDBFile(filename, sanitize=False)
-        Chem.MolToPDBFile(mol2, filename)
+        mol2 = MolFromPDBBlock(tempstr, sanitize=False)
+        files.write(filename, Chem.MolToPDBBlock(mol2))
 
     return filename
 
-def fragment_library_aromatic(projectdir, pdb, ligand, atomvectors, residuenr, chain, ringnr, pdbfile):
+def fragment_library_aromatic(files, ligand, atomvectors, residuenr, chain, ringnr):
     chain = chain.strip()
-    # pdbfile = projectdir + 'pdbs/' + pdb + '.pdb'
     residuename = ''
-    f_in = open(pdbfile, 'r')
-    tempstr = ''
-    for line in f_in:
-        if line.startswith('HETATM'):
-            atomvector = Vector(line[30:38], line[38:46], line[46:54])
-            skip = 1
-            for targetvector in atomvectors:
-                distance = (targetvector - atomvector).norm()
-                if distance < 0.1:
-                    # print "FOUND!"
-                    skip = 0
-            if skip == 1:
-                continue
-        elif line.startswith('ATOM'):
-            residue_number = line[22:26].strip()
-            tempchain = line[21].strip()
-
-            if residue_number != residuenr:
-                continue
-            if tempchain != chain:
-                continue
-            residuename = line[17:20].strip()
-            chain = tempchain
-        else:
-            continue  # ignore all other lines
-
-        tempstr += line
-    filename = projectdir + 'results/' + pdb + '/fragments/' + pdb + "_" + ligand + \
-        "_" + residuename + str(residuenr) + chain + "_aromatic_" + str(ringnr) + ".pdb"
-    f_in.close()
-    f = open(filename, 'w')
-    f.write(tempstr)
-    f.close()
+    residue_lines = files.get_residue_lines(residuenr, chain)
+    if residue_lines:
+        residuename = residue_lines[-1][1][17:20].strip()
+    # ring atoms of the ligand and the residue, in the order of the PDB file
+    tempstr = ''.join([line for _, line in sorted(files.get_hetatm_lines(atomvectors) + residue_lines)])
+    filename = files.get_path('fragments', files.pdb + "_" + ligand + \
+        "_" + residuename + str(residuenr) + chain + "_aromatic_" + str(ringnr) + ".pdb")
+    files.write(filename, tempstr)
     return filename
 
-def analyze_interactions(projectdir, pdb, results, ligand_donors, ligand_acceptors, ligand_charged, new_results, summary_results, hetlist_display, sortedresults, pdb_location):
+def analyze_interactions(files, results, ligand_donors, ligand_acceptors, ligand_charged, new_results, summary_results, hetlist_display, sortedresults):
     for ligand, result in results.items():
         ligscore = 0
         fragment_file = ''
@@ -919,7 +929,7 @@ def analyze_interactions(projectdir, pdb, results, ligand_donors, ligand_accepto
                 if (entry[2] <= 3.5):
                     if entry[0][0] == 'C' or entry[1][0] == 'C':
                         continue  # If either atom is C then no hydrogen bonding
-                    aa_donors = get_hydrogen_from_aa(projectdir, pdb, entry[5], pdb_location)
+                    aa_donors = get_hydrogen_from_aa(files, entry[5])
                     hydrogenmatch = False
                     res_is_acceptor = False
                     res_is_donor = False
@@ -1006,20 +1016,20 @@ def analyze_interactions(projectdir, pdb, results, ligand_donors, ligand_accepto
                         elif AA[residue[0:3]] in NEGATIVE:
                             res_charge_value = -1
                     if entry[1] == 'N': #backbone connection!
-                        fragment_file = fragment_library(projectdir, pdb, ligand, entry[3], entry[0], entry[5], entry[6], 'HB_backbone', pdb_location)
+                        fragment_file = fragment_library(files, ligand, entry[3], entry[0], entry[5], entry[6], 'HB_backbone')
                         new_results[ligand]['interactions'].append([residue,fragment_file,
                                                                     'polar_backbone','polar (hydrogen bond with backbone)',
                                                                     'polar','protein',entry[0],entry[1],entry[2]])
                         remove_hyd(residue, ligand, new_results)
                     elif entry[1] == 'O': #backbone connection!
-                        fragment_file = fragment_library(projectdir, pdb, ligand, entry[3], entry[0], entry[5], entry[6], 'HB_backbone', pdb_location)
+                        fragment_file = fragment_library(files, ligand, entry[3], entry[0], entry[5], entry[6], 'HB_backbone')
                         new_results[ligand]['interactions'].append([residue,fragment_file,
                                                                     'polar_backbone','polar (hydrogen bond with backbone)',
                                                                     'polar','protein',entry[0],entry[1],entry[2]])
                         remove_hyd(residue, ligand, new_results)
                     elif hydrogenmatch:
                         found = False
-                        fragment_file = fragment_library(projectdir, pdb, ligand, entry[3], entry[0], entry[5], entry[6], 'HB', pdb_location)
+                        fragment_file = fragment_library(files, ligand, entry[3], entry[0], entry[5], entry[6], 'HB')
                         for x in summary_results[ligand]['hbond_confirmed']:
                             if residue == x[0]:
                                 # print "Already key there",residue
@@ -1044,7 +1054,7 @@ def analyze_interactions(projectdir, pdb, results, ligand_donors, ligand_accepto
                     elif chargedcheck:
                         interaction_type = 'hbondplus'
                         hbondplus.append(entry)
-                        fragment_file = fragment_library(projectdir, pdb, ligand, entry[3], entry[0], entry[5], entry[6], 'HBC', pdb_location)
+                        fragment_file = fragment_library(files, ligand, entry[3], entry[0], entry[5], entry[6], 'HBC')
                         remove_hyd(residue, ligand, new_results)
                         if doublechargecheck:
                             if (res_charge_value>0):
@@ -1079,7 +1089,7 @@ def analyze_interactions(projectdir, pdb, results, ligand_donors, ligand_accepto
                     else:
                         interaction_type = 'hbond'
                         hbond.append(entry)
-                        fragment_file = fragment_library(projectdir, pdb, ligand, entry[3], entry[0], entry[5], entry[6], 'HB', pdb_location)
+                        fragment_file = fragment_library(files, ligand, entry[3], entry[0], entry[5], entry[6], 'HB')
                         new_results[ligand]['interactions'].append([residue, fragment_file,
                                                                     'polar_unspecified','polar (hydrogen bond)',
                                                                     'polar','',entry[0],entry[1],entry[2]])
@@ -1119,11 +1129,9 @@ def analyze_interactions(projectdir, pdb, results, ligand_donors, ligand_accepto
 
     return summary_results, new_results, sortedresults
 
-def addresiduestoligand(projectdir, ligand, pdb, residuelist, pdbfile):
-    # temp_path = projectdir + 'pdbs/' + pdb + '.pdb'
-    f_in = open(pdbfile, 'r')
+def addresiduestoligand(files, ligand, residuelist):
     inserstr = ''
-    for line in f_in:
+    for line in files.lines:
         if line.startswith('ATOM'):
             temp = line.split()
             m = re.match("(\w)(\d+)", temp[4])
@@ -1133,13 +1141,10 @@ def addresiduestoligand(projectdir, ligand, pdb, residuelist, pdbfile):
             aaname = temp[3] + temp[5] + temp[4]
             if aaname in residuelist:
                 inserstr += line
-    f_in.close()
 
-    temp_path = projectdir + 'results/' + pdb + '/ligand/' + ligand + '_' + pdb + '.pdb'
-    f_in = open(temp_path, 'r')
     tempstr = ''
     inserted = 0
-    for line in f_in:
+    for line in files.read(files.get_ligand_path(ligand)).splitlines(True):
         if line.startswith('ATOM'):
             temp = line.split()
             if temp[2] == 'H':
@@ -1149,13 +1154,10 @@ def addresiduestoligand(projectdir, ligand, pdb, residuelist, pdbfile):
             tempstr += inserstr
             inserted = 1
         tempstr += line
-    f_in.close()
 
-    f = open(projectdir + 'results/' + pdb + '/interaction/' + pdb + '_' + ligand + '.pdb', 'w')
-    f.write(tempstr)
-    f.close()
+    files.write(files.get_path('interaction', files.pdb + '_' + ligand + '.pdb'), tempstr)
 
-def pretty_results(projectdir, pdb, summary_results, pdbfile):
+def pretty_results(files, summary_results):
     for ligand, result in summary_results.items():
         bindingresidues = []
         for interaction_type, typelist in result.items():
@@ -1167,7 +1169,7 @@ def pretty_results(projectdir, pdb, summary_results, pdbfile):
                 if interaction_type not in ['score', 'prettyname']:
                     bindingresidues.append(entry[0])
         bindingresidues = list(set(bindingresidues))
-        addresiduestoligand(projectdir, ligand, pdb, bindingresidues, pdbfile)
+        addresiduestoligand(files, ligand, bindingresidues)
 
 ####### END IMPLEMENTATION OF LEGACY FUNCTIONS ####
 
@@ -2262,7 +2264,7 @@ def excel(request, slug, **response_kwargs):
         generic_numbering = GenericNumbering(mypath)
         out_struct = generic_numbering.assign_generic_numbers()
         structure_residues = generic_numbering.residues
-        results = runusercalculation_2022(slug, session)
+        results = runusercalculation_2022(slug, session, export=False)
 
         data = []
         ligand = list(results.keys())[0]
@@ -0,0 +1,222 @@
+"""
+In-process fingerprint index for ligand similarity and substructure search, without the RDKit database cartridge.
+
+The index is exported by build_ligand_search into BUILD_CACHE_DIR/ligand_fingerprints and memory-mapped by the web
+processes. It holds, for every ligand with a valid SMILES:
+- Morgan fingerprints (radius 2, as morganbv_fp of the cartridge) packed into rows of uint64 words, with their bit
+  counts, for Tanimoto similarity search
+- RDKit pattern fingerprints, packed in the same way, to screen out molecules that cannot contain a substructure
+- the RDKit molecules as binary pickles, to verify the screened candidates
+"""
+from django.conf import settings
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Pool
+import json
+import os
+import shutil
+
+import numpy as np
+from rdkit import Chem, DataStructs, RDLogger
+from rdkit.Chem import rdFingerprintGenerator
+
+RDLogger.DisableLog('rdApp.*')
+
+MORGAN_RADIUS = 2
+MORGAN_BITS = 512 # rdkit.morgan_fp_size of the cartridge
+PATTERN_BITS = 2048
+# substructure candidates verified in the web process itself, larger sets are split over the process pool
+MIN_PARALLEL_CANDIDATES = 2000
+CHUNK_SIZE = 1000
+MAX_WORKERS = getattr(settings, 'LIGAND_SEARCH_WORKERS', 4)
+
+_morgan_generator = None
+_loaded_index = None
+_executor = None
+
+
+def get_index_dir():
+    return os.sep.join([settings.BUILD_CACHE_DIR, 'ligand_fingerprints'])
+
+
+def get_morgan_generator():
+    global _morgan_generator
+    if _morgan_generator is None:
+        _morgan_generator = rdFingerprintGenerator.GetMorganGenerator(radius=MORGAN_RADIUS, fpSize=MORGAN_BITS)
+    return _morgan_generator
+
+
+def pack_fingerprint(fp):
+    """Pack an RDKit bit vector into uint64 words."""
+    bits = np.zeros(fp.GetNumBits(), dtype=np.uint8)
+    DataStructs.ConvertToNumpyArray(fp, bits)
+    return np.packbits(bits).view(np.uint64)
+
+
+def popcount(words):
+    """Number of set bits per row of a matrix of uint64 words."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+    return np.unpackbits(words.view(np.uint8), axis=-1).sum(axis=-1, dtype=np.int32)
+
+
+def get_morgan_fingerprint(mol):
+    return pack_fingerprint(get_morgan_generator().GetFingerprint(mol))
+
+
+def get_pattern_fingerprint(mol):
+    return pack_fingerprint(Chem.PatternFingerprint(mol, fpSize=PATTERN_BITS))
+
+
+def _fingerprint_job(ligand):
+    ligand_id, smiles = ligand
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return None
+    return ligand_id, get_morgan_fingerprint(mol), get_pattern_fingerprint(mol), mol.ToBinary()
+
+
+def build_index(ligands, processes=1):
+    """Export the fingerprint index of the given (ligand id, SMILES) pairs, replacing the current index.
+
+    Returns the number of ligands in the index.
+    """
+    index_dir = get_index_dir()
+    tmp_dir = index_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    ligand_ids = []
+    morgan = []
+    pattern = []
+    offsets = [0]
+    with open(os.sep.join([tmp_dir, 'molecules.bin']), 'wb') as mol_file:
+        with Pool(processes) as pool:
+            for result in pool.imap(_fingerprint_job, ligands, chunksize=500):
+                if result is None:
+                    continue
+                ligand_ids.append(result[0])
+                morgan.append(result[1])
+                pattern.append(result[2])
+                mol_file.write(result[3])
+                offsets.append(offsets[-1] + len(result[3]))
+
+    morgan = np.array(morgan, dtype=np.uint64).reshape(len(ligand_ids), MORGAN_BITS // 64)
+    np.save(os.sep.join([tmp_dir, 'ligand_ids.npy']), np.array(ligand_ids, dtype=np.int64))
+    np.save(os.sep.join([tmp_dir, 'morgan.npy']), morgan)
+    np.save(os.sep.join([tmp_dir, 'morgan_counts.npy']), popcount(morgan))
+    np.save(os.sep.join([tmp_dir, 'pattern.npy']), np.array(pattern, dtype=np.uint64).reshape(len(ligand_ids), PATTERN_BITS // 64))
+    np.save(os.sep.join([tmp_dir, 'offsets.npy']), np.array(offsets, dtype=np.int64))
+    with open(os.sep.join([tmp_dir, 'index.json']), 'w') as f:
+        json.dump({'size': len(ligand_ids), 'morgan_radius': MORGAN_RADIUS, 'morgan_bits': MORGAN_BITS,
+            'pattern_bits': PATTERN_BITS, 'rdkit_version': Chem.rdBase.rdkitVersion}, f)
+
+    # swap in the new index, processes that already loaded the old one keep their open memory maps
+    old_dir = index_dir + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(index_dir):
+        os.rename(index_dir, old_dir)
+    os.rename(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return len(ligand_ids)
+
+
+class FingerprintIndex:
+    """Memory-mapped fingerprint index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(os.sep.join([path, 'index.json']))
+        with open(os.sep.join([path, 'index.json'])) as f:
+            self.info = json.load(f)
+        self.ligand_ids = self._load('ligand_ids')
+        self.morgan = self._load('morgan')
+        self.morgan_counts = self._load('morgan_counts')
+        self.pattern = self._load('pattern')
+        self.offsets = self._load('offsets')
+        self.molecules = np.memmap(os.sep.join([path, 'molecules.bin']), dtype=np.uint8, mode='r') \
+            if self.offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+    def _load(self, name):
+        return np.load(os.sep.join([self.path, name + '.npy']), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ligand_ids)
+
+    def get_molecule(self, i):
+        return Chem.Mol(self.molecules[self.offsets[i]:self.offsets[i + 1]].tobytes())
+
+    def similarity(self, smiles, threshold, top=None):
+        """Return [(ligand id, Tanimoto similarity)] of the ligands at least as similar as threshold to the SMILES,
+        most similar first."""
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            return []
+        query = get_morgan_fingerprint(mol)
+        query_count = int(popcount(query))
+        common = popcount(self.morgan & query)
+        union = self.morgan_counts + query_count - common
+        similarities = np.divide(common, union, out=np.zeros(len(common)), where=union > 0)
+
+        hits = np.flatnonzero(similarities >= threshold)
+        if top is not None and len(hits) > top:
+            hits = hits[np.argpartition(-similarities[hits], top - 1)[:top]]
+        # most similar first, ties by ligand id
+        hits = hits[np.lexsort((self.ligand_ids[hits], -similarities[hits]))]
+        return [(int(self.ligand_ids[i]), float(similarities[i])) for i in hits]
+
+    def screen(self, query_mol):
+        """Indices of the molecules whose pattern fingerprints contain all bits of the query."""
+        query = get_pattern_fingerprint(query_mol)
+        return np.flatnonzero(np.all((self.pattern & query) == query, axis=1))
+
+    def substructure(self, query, smarts=False, chirality=False):
+        """Return [(ligand id,)] of the ligands that contain the query SMILES or SMARTS, in ligand id order."""
+        query_mol = Chem.MolFromSmarts(query) if smarts else Chem.MolFromSmiles(query)
+        if query_mol is None:
+            return []
+        # SMARTS patterns have no computed valences, which the pattern fingerprint needs
+        query_mol.UpdatePropertyCache(strict=False)
+        candidates = self.screen(query_mol)
+
+        if len(candidates) < MIN_PARALLEL_CANDIDATES:
+            matches = _match_candidates(self.path, candidates, query, smarts, chirality, self)
+        else:
+            chunks = [candidates[i:i + CHUNK_SIZE] for i in range(0, len(candidates), CHUNK_SIZE)]
+            matches = []
+            for chunk_matches in get_executor().map(_match_candidates, [self.path] * len(chunks), chunks,
+                    [query] * len(chunks), [smarts] * len(chunks), [chirality] * len(chunks)):
+                matches.extend(chunk_matches)
+        return [(ligand_id,) for ligand_id in sorted(matches)]
+
+
+def _match_candidates(path, candidates, query, smarts, chirality, index=None):
+    """Verify the screened candidates with an RDKit substructure match, in this process or a pool worker."""
+    if index is None:
+        index = get_index(path)
+    query_mol = Chem.MolFromSmarts(query) if smarts else Chem.MolFromSmiles(query)
+    matches = []
+    for i in candidates:
+        if index.get_molecule(i).HasSubstructMatch(query_mol, useChirality=chirality):
+            matches.append(int(index.ligand_ids[i]))
+    return matches
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+def get_index(path=None):
+    """Return the loaded index, reloading it when it has been rebuilt. Returns None if there is no index."""
+    global _loaded_index
+    path = path or get_index_dir()
+    try:
+        mtime = os.path.getmtime(os.sep.join([path, 'index.json']))
+    except OSError:
+        return None
+    if _loaded_index is None or _loaded_index.path != path or _loaded_index.mtime != mtime:
+        _loaded_index = FingerprintIndex(path)
+    return _loaded_index
@@ -1,13 +1,16 @@
 #mccabe complexity: ["error", 31]
+import hashlib
 import math
+import pickle
+from collections import defaultdict
 
 from django.utils.text import slugify
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 
 #from chembl_webresource_client import new_client
 from common.models import WebResource, Publication
-from ligand.models import Ligand, LigandType, BiasedData, Endogenous_GTP, BalancedLigands
+from ligand.models import Ligand, LigandType, BiasedData, Endogenous_GTP, BalancedLigands, BiasCalculation
 from protein.models import Protein
 
 # def get_or_make_ligand(ligand_id, type_id, name = None, pep_or_prot = None):
@@ -636,14 +639,17 @@ def define_ligand_pathways(master):
         ligands[master[key]['ligand_id']].append(key)
     return ligands
 
-def OnTheFly(receptor_id, rank_method='Default', subtype=False, pathway=False, user=False, balanced=False):
+def OnTheFly(receptor_id, rank_method='Default', subtype=False, pathway=False, user=False, balanced=False, publications=None):
     receptor_name = list(Protein.objects.filter(id=receptor_id).values_list("name", flat=True))[0]
 
     #fetching data given the receptor id
     if user == False:
         test_data = BiasedData.objects.filter(receptor=receptor_id) #37 for AGTR1
-        pub_ids = list(BiasedData.objects.filter(receptor=receptor_id).values_list("publication", flat=True).distinct())
-        lig_ids = list(BiasedData.objects.filter(receptor=receptor_id).values_list("ligand_id", flat=True).distinct())
+        #publications are calculated independently, so the calculation can be limited to some of them
+        if publications is not None:
+            test_data = test_data.filter(publication__in=publications)
+        pub_ids = list(test_data.values_list("publication", flat=True).distinct())
+        lig_ids = list(test_data.values_list("ligand_id", flat=True).distinct())
     else:
         pub_ids = list(BiasedData.objects.filter(receptor=receptor_id, ligand=user).values_list("publication", flat=True).distinct())
         test_data = BiasedData.objects.filter(receptor=receptor_id, publication__in=pub_ids)
@@ -754,6 +760,93 @@ def OnTheFly(receptor_id, rank_method='Default', subtype=False, pathway=False, u
     publications = {pub:value_id for pub,value_id in publications.items() if value_id != {}}
     return publications
 
+################################################################################
+#################### Materialized On The Fly Calculation #######################
+################################################################################
+
+#(subtype, pathway, balanced) settings of the bias browsers and rank order pages
+BIAS_CALCULATION_SETTINGS = [(False, False, False),
+                             (True, False, False),
+                             (False, False, True),
+                             (True, False, True),
+                             (False, True, False)]
+BIAS_RANK_METHODS = ['Default', 'emax', 'tau']
+#columns of BiasedData that are filled with calculated results, they are not input of the calculation
+BIAS_RESULT_FIELDS = ['pathway_preferred', 'subtype_biased', 'physiology_biased', 'pathway_biased', 'pathway_subtype_biased']
+
+def get_publication_checksums(receptor_id):
+    """Checksum of the data of each publication of a receptor, which changes when its BiasedData or BalancedLigands
+    rows change, or the publication, ligand or receptor names that are stored with the results"""
+    checksums = {}
+    ligand_ids = defaultdict(set)
+    bias_fields = [field.attname for field in BiasedData._meta.fields if field.attname not in BIAS_RESULT_FIELDS]
+    balanced_fields = [field.attname for field in BalancedLigands._meta.fields]
+    for model, fields in [(BiasedData, bias_fields), (BalancedLigands, balanced_fields)]:
+        pub_index = fields.index('publication_id')
+        for row in model.objects.filter(receptor=receptor_id).order_by('id').values_list(*fields):
+            if model == BalancedLigands and row[pub_index] not in checksums:
+                continue
+            if row[pub_index] not in checksums:
+                checksums[row[pub_index]] = hashlib.sha256()
+            checksums[row[pub_index]].update(repr(row).encode('utf-8'))
+            if model == BiasedData:
+                ligand_ids[row[pub_index]].add(row[fields.index('ligand_id')])
+
+    #names copied into the results by OnTheFly
+    receptor_name = list(Protein.objects.filter(id=receptor_id).values_list("name", flat=True))
+    pub_names = {pub_obj[0]: pub_obj[1:] for pub_obj in Publication.objects.filter(id__in=list(checksums.keys())).values_list(
+        "id", "web_link_id__index", "year", "journal_id__name", "authors")}
+    lig_names = dict(Ligand.objects.filter(id__in=set().union(*ligand_ids.values())).values_list("id", "name"))
+    for pub, checksum in checksums.items():
+        checksum.update(repr((receptor_name, pub_names.get(pub),
+                              [lig_names.get(lig) for lig in sorted(ligand_ids[pub], key=str)])).encode('utf-8'))
+    return {pub: checksum.hexdigest() for pub, checksum in checksums.items()}
+
+def MaterializeOnTheFly(receptor_id, full=False):
+    """Calculate and store the OnTheFly results of all settings and rank methods for the publications of a receptor
+    whose data changed since they were stored (or all publications when full is set).
+    Returns the number of recalculated publications."""
+    checksums = get_publication_checksums(receptor_id)
+    stored = defaultdict(list)
+    for pub, checksum in BiasCalculation.objects.filter(receptor=receptor_id).values_list('publication_id', 'data_checksum'):
+        stored[pub].append(checksum)
+    num_calculations = len(BIAS_CALCULATION_SETTINGS) * len(BIAS_RANK_METHODS)
+    changed = [pub for pub in checksums if full or stored[pub] != [checksums[pub]] * num_calculations]
+
+    calculations = []
+    if changed:
+        for rank_method in BIAS_RANK_METHODS:
+            for subtype, pathway, balanced in BIAS_CALCULATION_SETTINGS:
+                data = OnTheFly(receptor_id, rank_method, subtype=subtype, pathway=pathway, balanced=balanced, publications=changed)
+                for pub in changed:
+                    calculations.append(BiasCalculation(receptor_id=receptor_id, publication_id=pub, rank_method=rank_method,
+                                                        subtype=subtype, pathway=pathway, balanced=balanced,
+                                                        data=pickle.dumps(data.get(pub, {})), data_checksum=checksums[pub]))
+
+    with transaction.atomic():
+        #publications without data anymore
+        BiasCalculation.objects.filter(receptor=receptor_id).exclude(publication__in=list(checksums.keys())).delete()
+        BiasCalculation.objects.filter(receptor=receptor_id, publication__in=changed).delete()
+        BiasCalculation.objects.bulk_create(calculations, batch_size=1000)
+    return len(changed)
+
+def PrecomputedOnTheFly(receptor_id, rank_method='Default', subtype=False, pathway=False, user=False, balanced=False):
+    """OnTheFly results read from the materialized calculations, calculated on the fly for user selected reference
+    ligands and for receptors or settings that have not been materialized"""
+    if pathway:
+        #balanced references are not used for pathway preferences
+        balanced = False
+    if rank_method not in BIAS_RANK_METHODS:
+        #other rank methods are ranked as the default method
+        rank_method = 'Default'
+    if user == False and (subtype, pathway, balanced) in BIAS_CALCULATION_SETTINGS:
+        rows = BiasCalculation.objects.filter(receptor=receptor_id, rank_method=rank_method, subtype=subtype,
+                                              pathway=pathway, balanced=balanced).order_by('publication_id').values_list('publication_id', 'data')
+        if len(rows) > 0:
+            publications = {pub: pickle.loads(data) for pub, data in rows}
+            return {pub: value for pub, value in publications.items() if value != {}}
+    return OnTheFly(receptor_id, rank_method, subtype=subtype, pathway=pathway, user=user, balanced=balanced)
+
 def AddPathwayData(master, data, rank, pathway=False):
     master[rank+' - Pathway'] = data['primary_effector_family']
     try:
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0006_releasestatistics_database'),
+        ('protein', '0018_auto_20231026_2107'),
+        ('ligand', '0027_auto_20241204_1047'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BiasCalculation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank_method', models.CharField(max_length=20)),
+                ('subtype', models.BooleanField(default=False)),
+                ('pathway', models.BooleanField(default=False)),
+                ('balanced', models.BooleanField(default=False)),
+                ('data', models.BinaryField()),
+                ('data_checksum', models.CharField(max_length=64)),
+                ('publication', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='common.Publication')),
+                ('receptor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='protein.Protein')),
+            ],
+            options={
+                'unique_together': {('receptor', 'publication', 'rank_method', 'subtype', 'pathway', 'balanced')},
+            },
+        ),
+    ]
@@ -475,6 +475,20 @@ class BalancedLigands(models.Model):
     subtype_balanced = models.BooleanField(default=False)
     publication = models.ForeignKey(Publication, on_delete=models.CASCADE) #LINK
 
+class BiasCalculation(models.Model):
+    # OnTheFly results of a publication for a receptor, materialized by build_bias_calculations
+    receptor = models.ForeignKey('protein.Protein', on_delete=models.CASCADE) #LINK
+    publication = models.ForeignKey(Publication, on_delete=models.CASCADE) #LINK
+    rank_method = models.CharField(max_length=20)
+    subtype = models.BooleanField(default=False)
+    pathway = models.BooleanField(default=False)
+    balanced = models.BooleanField(default=False)
+    data = models.BinaryField() # pickled {BiasedData id: calculated values}, empty if the publication was skipped
+    data_checksum = models.CharField(max_length=64) # checksum of the BiasedData and BalancedLigands of the publication
+
+    class Meta():
+        unique_together = ('receptor', 'publication', 'rank_method', 'subtype', 'pathway', 'balanced')
+
 
 # Pathways part - start
 class BiasedPathways(models.Model):
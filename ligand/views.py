@@ -4,6 +4,7 @@ import json
 import re
 import time
 import math
+import numpy as np
 import pandas as pd
 import urllib
 from psycopg2.errors import DataException
@@ -11,6 +12,8 @@ from psycopg2.errors import DataException
 from django.conf import settings
 if settings.PYTHON_SMILES_VALIDATION:
     from rdkit.Chem.rdmolfiles import MolFromSmarts, MolFromSmiles
+if settings.LIGAND_SEARCH_BACKEND == 'fingerprint_index':
+    from ligand import fingerprint_index
 
 from random import SystemRandom
 from copy import deepcopy
@@ -38,7 +41,7 @@ from common.phylogenetic_tree import PhylogeneticTreeGenerator
 from common.selection import Selection, SelectionItem
 from mapper.views import LandingPage
 from ligand.models import Ligand, LigandVendorLink, BiasedPathways, AssayExperiment, BiasedData, Endogenous_GTP, LigandID, LigandPeptideStructure, LigandMol, LigandFingerprint
-from ligand.functions import OnTheFly, AddPathwayData
+from ligand.functions import PrecomputedOnTheFly, AddPathwayData
 from protein.models import Protein, ProteinFamily
 from interaction.models import StructureLigandInteraction
 from mutation.models import MutationExperiment
@@ -712,11 +715,16 @@ class LigandStructuralSearch(TemplateView):
         search_type = param_dict['search_type']
         smiles = param_dict['smiles']
         input_type = param_dict['input_type']
+        search_index = None
+        if settings.LIGAND_SEARCH_BACKEND == 'fingerprint_index':
+            search_index = fingerprint_index.get_index()
         with connection.cursor() as cursor:
             if search_type == 'similarity':
                 similarity_threshold = param_dict['similarity_threshold']
                 cache_key = "ligand_structural_search_" + ",".join([search_type,input_type,smiles,str(similarity_threshold),mode])
-                if not(cache_key != False and cache.has_key(cache_key)):
+                if not(cache_key != False and cache.has_key(cache_key)) and search_index is not None:
+                    cursor_results = search_index.similarity(smiles, similarity_threshold)
+                elif not(cache_key != False and cache.has_key(cache_key)):
                     string_to_replace_by = '^textoreplacebysmiles#'
                     value = MORGANBV_FP(Value(string_to_replace_by))
                     q = LigandFingerprint.objects.filter(mfp2__tanimoto=value)
@@ -734,7 +742,9 @@ class LigandStructuralSearch(TemplateView):
                 else:
                     stereochemistry = 'false'
                 cache_key = "ligand_structural_search_" + ",".join([search_type,smiles,str(stereochemistry),mode])
-                if not(cache_key != False and cache.has_key(cache_key)):
+                if not(cache_key != False and cache.has_key(cache_key)) and search_index is not None:
+                    cursor_results = search_index.substructure(smiles, smarts=input_type == 'smarts', chirality=param_dict['stereochemistry'])
+                elif not(cache_key != False and cache.has_key(cache_key)):
                     sql_string_placeholder = '^textoreplacebysmiles#'
                     v = Value(sql_string_placeholder)
                     if input_type == 'smarts':
@@ -931,6 +941,143 @@ def CachedTargetDetailsCompact(request, **kwargs):
 def CachedTargetDetailsExtended(request, **kwargs):
     return TargetDetails("extended", request, **kwargs)
 
+COMPACT_RECORD_FIELDS = ['ligand_id', 'protein_id', 'protein__species__common_name', 'assay_type', 'value_type',
+    'source', 'p_activity_value', 'p_activity_ranges', 'affinity', 'count_affinity_test', 'potency',
+    'count_potency_test', 'reference_ligand']
+
+def aggregate_compact_records(records, ligand_order, ligand_search=False):
+    """Aggregate the assay records of the compact ligand list into one row per ligand, target (for ligand searches),
+    assay type, value type and source, with the min/mean/max of the p-activity values.
+
+    @param records: DataFrame of the COMPACT_RECORD_FIELDS of the records, in the order of the queryset
+    @param ligand_order: ligand ids in the order in which they are listed
+    Returns a DataFrame with the fields of the last record of each ligand (and target), ordered as listed.
+    """
+    records = records.astype({'ligand_id': np.int64, 'protein_id': np.int64})
+    records['protein_key'] = records['protein_id'] if ligand_search else 0
+    records['row'] = np.arange(len(records))
+    group = ['ligand_id', 'protein_key']
+
+    # the last record of a ligand (and target) provides the shown affinity/potency and record count
+    targets = records.groupby(group, sort=False)['row'].agg(['min', 'max', 'size'])
+    targets.columns = ['first_row', 'last_row', 'record_count']
+
+    # a single source is listed for each assay and value type of a target: the source whose first record comes last
+    records['source_rank'] = records.groupby(group + ['source'], dropna=False)['row'].transform('min')
+    activities = records[records['assay_type'].isin(['B', 'F'])]
+    selected_rank = activities.groupby(group + ['assay_type', 'value_type'], dropna=False)['source_rank'].transform('max')
+    activities = activities[activities['source_rank'] == selected_rank]
+
+    # Guide to Pharmacology records have a range of values
+    gtp = activities['source'] == 'Guide to Pharmacology'
+    values = activities['p_activity_value'].where(~gtp, activities['p_activity_ranges'].str.split('|'))
+    activities = activities[['ligand_id', 'protein_key', 'assay_type', 'value_type', 'source']].assign(value=values).explode('value')
+    activities['value'] = pd.to_numeric(activities['value'], errors='coerce')
+
+    keys = group + ['assay_type', 'value_type', 'source']
+    stats = activities.groupby(keys, dropna=False, sort=False)['value']
+    activities = activities.assign(low_value=stats.transform('min'), value_sum=stats.transform('sum'),
+        value_count=stats.transform('count'), high_value=stats.transform('max'))
+    rows = activities.drop_duplicates(keys).drop(columns='value')
+
+    rows = rows.join(targets, on=group)
+    last_records = records.set_index('row').drop(columns=['ligand_id', 'protein_key', 'assay_type', 'value_type', 'source'])
+    rows = rows.join(last_records, on='last_row')
+    ligand_rank = pd.Series(np.arange(len(ligand_order)), index=pd.Index(ligand_order))
+    rows['ligand_rank'] = rows['ligand_id'].map(ligand_rank)
+    return rows.sort_values(['ligand_rank', 'first_row', 'assay_type', 'value_type'], kind='stable')
+
+def LigandListCompact(ps, ligand_search=False, ligand_similarities=None):
+    """Compact ligand list rows of the assay records in ps, as the rows of LigandListDetails compact mode.
+
+    The records are read with values_list and aggregated in a DataFrame rather than as AssayExperiment objects.
+    """
+    ps = ps.prefetch_related(None)
+    records = pd.DataFrame(list(ps.values_list(*COMPACT_RECORD_FIELDS)), columns=COMPACT_RECORD_FIELDS, dtype=object)
+    if records.empty:
+        return [], []
+    ligand_order = list(records['ligand_id'].drop_duplicates())
+    if ligand_similarities is not None:
+        ligand_order = sorted(ligand_order, key=lambda x:ligand_similarities[x], reverse = True)
+    rows = aggregate_compact_records(records, ligand_order, ligand_search)
+
+    img_setup_smiles = "https://cactus.nci.nih.gov/chemical/structure/{}/image"
+    ligands = {}
+    for lig in Ligand.objects.filter(pk__in=ligand_order).values('id', 'name', 'smiles', 'mw', 'rotatable_bonds', 'hdon', 'hacc', 'logp', 'ligand_type__name'):
+        if lig['smiles'] is not None and (lig['mw'] is None or lig['mw'] < 800):
+            lig['picture'] = img_setup_smiles.format(urllib.parse.quote(lig['smiles']))
+        else:
+            # "No image available" SVG (source: https://commons.wikimedia.org/wiki/File:No_image_available.svg)
+            lig['picture'] = "https://upload.wikimedia.org/wikipedia/commons/thumb/a/ac/No_image_available.svg/600px-No_image_available.svg.png?20190827162820"
+        lig['ligand_type'] = lig['ligand_type__name'].replace('-',' ').capitalize()
+        ligands[lig['id']] = lig
+
+    vendor_output = list(LigandVendorLink.objects.filter(ligand_id__in=ligand_order).values_list("ligand_id").annotate(Count('vendor_id', distinct=True)))
+    vendors_dict = {entry[0]:entry[1] for entry in vendor_output}
+
+    # class and family names are looked up once per target
+    targets = {}
+    if ligand_search:
+        for protein in Protein.objects.filter(pk__in=set(rows['protein_id'].tolist())).select_related('family'):
+            targets[protein.id] = {
+                'name': Protein(name=protein.name).short(),
+                'entry_name': protein.entry_name,
+                'class': protein.get_protein_class_from_slug(short=True),
+                'family': protein.get_protein_family_from_slug(short=True),
+            }
+
+    ligand_data_affinity = []
+    ligand_data_potency = []
+    for row in rows.itertuples(index=False):
+        lig = ligands[row.ligand_id]
+        low_value, average_value, high_value = '-','-','-'
+        if row.value_count > 0:
+            low_value = float(row.low_value)
+            average_value = round(row.value_sum / row.value_count,1)
+            high_value = float(row.high_value)
+        row_dict = {
+            'lig_id': lig['id'],
+            'ligand_name': lig['name'],
+            'picture': lig['picture'],
+        }
+        if row.assay_type == 'B':
+            row_dict['affinity'] = row.affinity
+            row_dict['affinity_tested'] = row.count_affinity_test
+        else:
+            row_dict['potency'] = row.potency
+            row_dict['potency_tested'] = row.count_potency_test
+        row_dict.update({
+            'species': row.protein__species__common_name,
+            'record_count': int(row.record_count),
+            'assay_type': 'Binding' if row.assay_type == 'B' else 'Functional',
+            'purchasability': vendors_dict.get(lig['id'], 0),
+            'low_value': low_value,
+            'average_value': average_value,
+            'high_value': high_value,
+            'value_type': row.value_type,
+            'ligand_type': lig['ligand_type'],
+            'source': row.source,
+            'smiles': lig['smiles'],
+            'mw': lig['mw'],
+            'rotatable_bonds': lig['rotatable_bonds'],
+            'hdon': lig['hdon'],
+            'hacc': lig['hacc'],
+            'logp': lig['logp'],
+            'reference': row.reference_ligand,
+        })
+        if ligand_search:
+            row_dict.update(targets[row.protein_id])
+        if row.assay_type == 'B':
+            if ligand_similarities is not None:
+                row_dict['ligand_similarity'] = ligand_similarities[lig['id']]
+            ligand_data_affinity.append(row_dict)
+        else:
+            if ligand_search and ligand_similarities is not None:
+                row_dict['ligand_similarity'] = ligand_similarities[lig['id']]
+            ligand_data_potency.append(row_dict)
+
+    return ligand_data_affinity, ligand_data_potency
+
 def LigandListDetails(mode, ps,ligand_search=False,ligand_similarities=None):
     if mode == 'extended':
         ligand_data_affinity = []
@@ -979,162 +1126,7 @@ def LigandListDetails(mode, ps,ligand_search=False,ligand_similarities=None):
                 ligand_data_potency.append(record)
 
     elif mode == 'compact':
-
-        result = {}
-        img_setup_smiles = "https://cactus.nci.nih.gov/chemical/structure/{}/image"
-        d = OrderedDict()
-
-        ligs = []
-        lig_ids_list = []
-
-        for p in ps:
-            if p.ligand not in d:
-                d[p.ligand] = []
-                ligs.append(p.ligand)
-                lig_ids_list.append(p.ligand_id)
-            d[p.ligand].append(p)
-        if ligand_similarities is not None:
-            ligs = sorted(ligs, key=lambda x:ligand_similarities[x.id], reverse = True)
-
-        lig_ids = set(lig_ids_list)
-        vendor_output = list(LigandVendorLink.objects.filter(ligand_id__in=lig_ids).values_list("ligand_id").annotate(Count('vendor_id', distinct=True)))
-        vendors_dict = {entry[0]:entry[1] for entry in vendor_output}
-
-        ligand_data_affinity = []
-        ligand_data_potency = []
-        assay_conversion = {'A': 'ADMET', 'B': 'Binding', 'F': 'Functional', 'U': 'N/A', 'T': 'Toxicity'}
-
-        for lig in ligs:
-            records = d[lig]
-            if lig.smiles is not None and (lig.mw is None or lig.mw < 800):
-                picture = img_setup_smiles.format(urllib.parse.quote(lig.smiles))
-            else:
-                # "No image available" SVG (source: https://commons.wikimedia.org/wiki/File:No_image_available.svg)
-                picture = "https://upload.wikimedia.org/wikipedia/commons/thumb/a/ac/No_image_available.svg/600px-No_image_available.svg.png?20190827162820"
-
-            purchasability = vendors_dict[lig.id] if lig.id in vendors_dict.keys() else 0
-
-            data_parsed = OrderedDict()
-            protein_records_dict = {}
-            for record in records:
-                protein = ''
-                if ligand_search:
-                    protein = record.protein
-                if protein not in protein_records_dict:
-                    protein_records_dict[protein] = []
-                protein_records_dict[protein].append(record)
-                assay = assay_conversion[record.assay_type]
-                if protein not in data_parsed.keys():
-                    data_parsed[protein] = {}
-                if record.source not in data_parsed[protein].keys():
-                    data_parsed[protein][record.source] = {}
-                if assay not in data_parsed[protein][record.source].keys():
-                    data_parsed[protein][record.source][assay] = {}
-                if record.value_type not in data_parsed[protein][record.source][assay].keys():
-                    if record.source == 'Guide to Pharmacology':
-                        data_parsed[protein][record.source][assay][record.value_type] = [x for x in record.p_activity_ranges.split('|')]
-                    else:
-                        data_parsed[protein][record.source][assay][record.value_type] = [record.p_activity_value]
-                else:
-                    if record.source == 'Guide to Pharmacology':
-                        data = [x for x in record.p_activity_ranges.split('|')]
-                        data_parsed[protein][record.source][assay][record.value_type] += data
-                    else:
-                        data_parsed[protein][record.source][assay][record.value_type].append(record.p_activity_value)
-            for protein in data_parsed.keys():
-                records = protein_records_dict[protein]
-                record = records[-1]
-
-                data_parsed2 = {}
-                for source in data_parsed[protein].keys():
-                    for assay_type in data_parsed[protein][source].keys():
-                        if assay_type not in data_parsed2:
-                            data_parsed2[assay_type] = {}
-                        for value_type in data_parsed[protein][source][assay_type].keys():
-                            if value_type not in data_parsed2:
-                                data_parsed2[assay_type][value_type] = {}
-                            data_parsed2[assay_type][value_type][source] = data_parsed[protein][source][assay_type][value_type]
-
-                data_parsed[protein] = data_parsed2
-
-
-                for assay_type in sorted(data_parsed[protein].keys()):
-                    for value_type in sorted(data_parsed[protein][assay_type].keys()):
-                        for source in sorted(data_parsed[protein][assay_type][value_type].keys()):
-                            values = [float(x) for x in data_parsed[protein][assay_type][value_type][source] if x != 'None']
-                            low_value, average_value, high_value = '-','-','-'
-                            if len(values) > 0:
-                                low_value = min(values)
-                                average_value = round(sum(values) / len(values),1)
-                                high_value = max(values)
-                            if assay_type == 'Binding': #Affinity
-                                binding_dict = {
-                                    'lig_id': lig.id,
-                                    'ligand_name': lig.name,
-                                    'picture': picture,
-                                    'affinity': record.affinity,
-                                    'affinity_tested': record.count_affinity_test,
-                                    'species': record.protein.species.common_name,
-                                    'record_count': len(records),
-                                    'assay_type': assay_type,
-                                    'purchasability': purchasability,
-                                    'low_value': low_value,
-                                    'average_value': average_value,
-                                    'high_value': high_value,
-                                    'value_type': value_type,
-                                    'ligand_type': lig.ligand_type.name.replace('-',' ').capitalize(),
-                                    'source': source,
-                                    'smiles': lig.smiles,
-                                    'mw': lig.mw,
-                                    'rotatable_bonds': lig.rotatable_bonds,
-                                    'hdon': lig.hdon,
-                                    'hacc': lig.hacc,
-                                    'logp': lig.logp,
-                                    'reference': record.reference_ligand,
-                                }
-                                if ligand_search:
-                                    binding_dict['name'] = Protein(name=protein.name).short()
-                                    binding_dict['entry_name'] = protein.entry_name
-                                    binding_dict['class'] = protein.get_protein_class_from_slug(short=True)
-                                    binding_dict['family'] = protein.get_protein_family_from_slug(short=True)
-                                if ligand_similarities is not None:
-                                    binding_dict['ligand_similarity'] = ligand_similarities[lig.id]
-                                ligand_data_affinity.append(binding_dict)
-                            elif assay_type == 'Functional': #Potency
-                                functional_dict = {
-                                    'lig_id': lig.id,
-                                    'ligand_name': lig.name,
-                                    'picture': picture,
-                                    'potency': record.potency,
-                                    'potency_tested': record.count_potency_test,
-                                    'species': record.protein.species.common_name,
-                                    'record_count': len(records),
-                                    'assay_type': assay_type,
-                                    'purchasability': purchasability,
-                                    'low_value': low_value,
-                                    'average_value': average_value,
-                                    'high_value': high_value,
-                                    'value_type': value_type,
-                                    'ligand_type': lig.ligand_type.name.replace('-',' ').capitalize(),
-                                    'source': source,
-                                    'smiles': lig.smiles,
-                                    'mw': lig.mw,
-                                    'rotatable_bonds': lig.rotatable_bonds,
-                                    'hdon': lig.hdon,
-                                    'hacc': lig.hacc,
-                                    'logp': lig.logp,
-                                    'reference': record.reference_ligand,
-                                }
-                                if ligand_search:
-                                    functional_dict['name'] = Protein(name=protein.name).short()
-                                    functional_dict['entry_name'] = protein.entry_name
-                                    functional_dict['class'] = protein.get_protein_class_from_slug(short=True)
-                                    functional_dict['family'] = protein.get_protein_family_from_slug(short=True)
-                                    if ligand_similarities is not None:
-                                        functional_dict['ligand_similarity'] = ligand_similarities[lig.id]
-                                ligand_data_potency.append(functional_dict)
-
-
+        ligand_data_affinity,ligand_data_potency = LigandListCompact(ps,ligand_search=ligand_search,ligand_similarities=ligand_similarities)
 
     return(ligand_data_affinity,ligand_data_potency)
 
@@ -1713,7 +1705,7 @@ class BiasedSignallingOnTheFlyCalculation(TemplateView):
         else:
             prefix = 'Δ'
 
-        data = OnTheFly(int(receptor), self.label, subtype=self.subtype, pathway=self.pathway, user=self.user, balanced=self.balanced)
+        data = PrecomputedOnTheFly(int(receptor), self.label, subtype=self.subtype, pathway=self.pathway, user=self.user, balanced=self.balanced)
         #### added code
         flat_data = {}
         reference_data = {}
@@ -3148,7 +3140,7 @@ class OTFBiasBrowser(TemplateView):
         if self.user:
             self.user = int(self.user)
 
-        data = OnTheFly(int(self.protein_id), rank_method=self.rank_method, subtype=self.subtype, pathway=self.pathway, user=self.user, balanced=self.balanced)
+        data = PrecomputedOnTheFly(int(self.protein_id), rank_method=self.rank_method, subtype=self.subtype, pathway=self.pathway, user=self.user, balanced=self.balanced)
         browser_columns = ['Class', 'Receptor family', 'UniProt', 'IUPHAR', 'Species',
                            'Reference ligand', 'Tested ligand', '#Vendors', '#Articles', '#Labs',
                            'P1 - Pathway', 'P2 - Pathway', 'P3 - Pathway', 'P4 - Pathway', 'P5 - Pathway',
@@ -19,13 +19,13 @@ from common.diagrams_gpcr import DrawHelixBox, DrawSnakePlot
 from common import definitions
 
 from construct.views import ConstructMutation
-from contactnetwork.models import Interaction, InteractingResiduePair
+from contactnetwork.models import Interaction, InteractingResiduePair, ResidueContact
 
 from interaction.models import ResidueFragmentInteraction, StructureLigandInteraction
 from interaction.views import calculate
 from interaction.forms import PDBform
 
-from residue.models import Residue,ResidueNumberingScheme, ResidueGenericNumberEquivalent
+from residue.models import Residue,ResidueNumberingScheme, ResidueGenericNumber, ResidueGenericNumberEquivalent
 from residue.views import ResidueTablesDisplay
 from protein.models import Protein, ProteinSegment, ProteinFamily, ProteinConformation, ProteinCouplings
 from structure.models import Structure
@@ -2681,73 +2681,41 @@ def calculateResidueContactFrequency(pdbs, allowed_gns, detail_gn = None):
             else:
                 i_types_filter = i_types_filter | Q(interaction_type=int_type)
 
-        # intrasegment (only S-S interactions) intersegments(S-S + S-B interactions)
-        i_options_filter = Q()
+        # intrasegment (only SC-SC interactions) intersegments (SC-SC + SC-BB interactions)
+        i_options_filter = Q(contact_class='sc-sc') | (Q(contact_class='sc-bb') & Q(intra_segment=False))
 
-        # Filters for inter- and intrasegment contacts + BB/SC filters
-        backbone_atoms = ["C", "O", "N", "CA"]
-        pure_backbone_atoms = ["C", "O", "N"]
-
-        # INTERsegment interactions
-        inter_segments = ~Q(interacting_pair__res1__protein_segment=F('interacting_pair__res2__protein_segment'))
-
-        # SC-BB
-        scbb = ((Q(atomname_residue1__in=backbone_atoms) & ~Q(atomname_residue2__in=pure_backbone_atoms)) | (~Q(atomname_residue1__in=pure_backbone_atoms) & Q(atomname_residue2__in=backbone_atoms))) & inter_segments
-        inter_options_filter = scbb
-
-        # SC-SC
-        scsc = ~Q(atomname_residue1__in=pure_backbone_atoms) & ~Q(atomname_residue2__in=pure_backbone_atoms) & inter_segments
-        inter_options_filter = inter_options_filter | scsc
-
-        # INTRAsegment interactions
-        intra_segments = Q(interacting_pair__res1__protein_segment=F('interacting_pair__res2__protein_segment'))
-
-        # SC-SC
-        scsc = ~Q(atomname_residue1__in=pure_backbone_atoms) & ~Q(atomname_residue2__in=pure_backbone_atoms) & intra_segments
-        intra_options_filter = scsc
-
-        i_options_filter = inter_options_filter | intra_options_filter
-
-        pairs = Interaction.objects.filter(
-            interacting_pair__referenced_structure__pdb_code__index__in=pdbs
-        ).filter(interacting_pair__res1__generic_number__label__in = allowed_gns,
-                 interacting_pair__res2__generic_number__label__in = allowed_gns
+        structure_slugs = dict(Structure.objects.filter(pdb_code__index__in=pdbs).values_list('pk', 'protein_conformation__protein__family__slug'))
+        gn_ids = ResidueGenericNumber.objects.filter(label__in=allowed_gns).values('pk')
+        pairs = ResidueContact.objects.filter(
+            structure_id__in=structure_slugs.keys(),
+            gn1_id__in=gn_ids,
+            gn2_id__in=gn_ids,
         ).filter(
-            interacting_pair__res1__protein_conformation_id=F('interacting_pair__res2__protein_conformation_id') # Filter interactions with other proteins
-        ).filter(
-            interacting_pair__res1__pk__lt=F('interacting_pair__res2__pk')
+            i_options_filter
         ).values(
             'interaction_type',
-            'interacting_pair__referenced_structure__pk',
-            'interacting_pair__referenced_structure__protein_conformation__protein__family__slug',
-            'interacting_pair__res1__generic_number__label',
-            'interacting_pair__res2__generic_number__label',
-        ).distinct(
+            'structure_id',
+            'gn1_label',
+            'gn2_label',
         ).annotate(
-             atompaircount=Count('interaction_type')
+             atompaircount=Sum('atompaircount')
         ).filter(
             i_types_filter
-        ).filter(
-            i_options_filter
-        ).values(
-            'interacting_pair__referenced_structure__pk',
-            'interacting_pair__referenced_structure__protein_conformation__protein__family__slug',
-            'interacting_pair__res1__generic_number__label',
-            'interacting_pair__res2__generic_number__label',
+        ).values_list(
+            'structure_id',
+            'gn1_label',
+            'gn2_label',
         ).order_by(
-            'interacting_pair__referenced_structure__pk',
-            'interacting_pair__referenced_structure__protein_conformation__protein__family__slug',
-            'interacting_pair__res1__generic_number__label',
-            'interacting_pair__res2__generic_number__label',
+            'structure_id',
+            'gn1_label',
+            'gn2_label',
         ).distinct(
         )
 
         # Count and normalize by receptor slug
         result_pairs = {}
-        for pair in pairs:
-            gn1 = pair["interacting_pair__res1__generic_number__label"]
-            gn2 = pair["interacting_pair__res2__generic_number__label"]
-            slug = pair["interacting_pair__referenced_structure__protein_conformation__protein__family__slug"]
+        for structure_id, gn1, gn2 in pairs:
+            slug = structure_slugs[structure_id]
 
             pair_id = "{}_{}".format(gn1, gn2)
             if pair_id not in result_pairs:
@@ -2803,16 +2771,15 @@ def collectResiduePairs(pdbs, allowed_gns):
     pairs = cache.get(cache_name)
     #results = None
     if pairs == None:
-        pairs = list(Interaction.objects.filter(interacting_pair__res1__generic_number__label__in = allowed_gns,
-                        interacting_pair__res2__generic_number__label__in = allowed_gns,
-                        interacting_pair__referenced_structure__pdb_code__index__in=pdbs,
-                        interacting_pair__res1__protein_conformation_id=F('interacting_pair__res2__protein_conformation_id'),
-                        interacting_pair__res1__pk__lt=F('interacting_pair__res2__pk')
+        gn_ids = ResidueGenericNumber.objects.filter(label__in=allowed_gns).values('pk')
+        pairs = list(ResidueContact.objects.filter(gn1_id__in = gn_ids,
+                        gn2_id__in = gn_ids,
+                        structure__pdb_code__index__in=pdbs,
                     ).values_list(
-                            'interacting_pair__res1__generic_number__label',
-                            'interacting_pair__res1__amino_acid',
-                            'interacting_pair__res2__generic_number__label',
-                            'interacting_pair__res2__amino_acid',
+                            'gn1_label',
+                            'aa1',
+                            'gn2_label',
+                            'aa2',
                     ).distinct())
 
         # Store in cache
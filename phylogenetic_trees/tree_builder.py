@@ -0,0 +1,230 @@
+"""
+Distance-based phylogenetic trees calculated in-process from an encoded alignment.
+
+Replaces the PHYLIP seqboot/protdist/neighbor/consense pipeline. Distances are Kimura protein distances, trees are
+built with neighbor-joining or UPGMA and bootstrap replicates are combined into an extended majority-rule consensus
+tree. Trees are returned as Newick strings in the format written by PHYLIP, i.e. consensus trees have the number of
+supporting replicates as branch lengths.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# residues that are not compared, as unknown residues in protdist
+UNKNOWN_RESIDUES = ('-', '_', 'X', '?', '*')
+
+# distance used when two sequences have no compared positions or are too divergent for the Kimura formula
+MAX_DISTANCE = 10.0
+
+# number of processes used to calculate bootstrap replicates, small runs are not worth the overhead
+BOOTSTRAP_PROCESSES = min(4, os.cpu_count() or 1)
+MIN_PARALLEL_REPLICATES = 50
+
+
+def kimura_distances(encoded):
+    """Return the (proteins x proteins) Kimura protein distances of a uint8 encoded alignment.
+
+    d = -ln(1 - p - 0.2p^2), where p is the fraction of different residues over positions where neither residue is
+    unknown.
+    """
+    letters, codes = np.unique(encoded, return_inverse=True)
+    codes = codes.reshape(encoded.shape)
+    known = ~np.isin(letters, [ord(r) for r in UNKNOWN_RESIDUES])
+
+    # one-hot encoding of the known residues, unknown residues have no set bit
+    onehot = np.eye(len(letters), dtype=np.float32)[:, known][codes].reshape(encoded.shape[0], -1)
+    compared = (known[codes]).astype(np.float32)
+    identities = onehot @ onehot.T
+    totals = compared @ compared.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = 1 - identities / totals
+        distances = -np.log(1 - p - 0.2 * p ** 2)
+    distances[~np.isfinite(distances) | (distances > MAX_DISTANCE)] = MAX_DISTANCE
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+def _join(left, right, left_length, right_length):
+    return "({}:{:.5f},{}:{:.5f})".format(left, left_length, right, right_length)
+
+
+def neighbor_joining(distances, names):
+    """Build an unrooted neighbor-joining tree, the last three nodes are joined at the base as in PHYLIP neighbor.
+
+    Returns the Newick string and the leaf masks (bit per input row) of all internal nodes.
+    """
+    d = np.array(distances, dtype=np.float64)
+    nodes = list(names)
+    masks = [1 << i for i in range(len(names))]
+    clusters = []
+    while len(nodes) > 3:
+        n = len(nodes)
+        r = d.sum(axis=1)
+        q = (n - 2) * d - r[:, None] - r[None, :]
+        np.fill_diagonal(q, np.inf)
+        i, j = np.unravel_index(np.argmin(q), q.shape)
+        if i > j:
+            i, j = j, i
+
+        length_i = 0.5 * d[i, j] + (r[i] - r[j]) / (2 * (n - 2))
+        length_j = d[i, j] - length_i
+        new_distances = 0.5 * (d[i] + d[j] - d[i, j])
+
+        nodes[i] = _join(nodes[i], nodes[j], length_i, length_j)
+        masks[i] = masks[i] | masks[j]
+        clusters.append(masks[i])
+        d[i, :] = new_distances
+        d[:, i] = new_distances
+        d[i, i] = 0
+        d = np.delete(np.delete(d, j, axis=0), j, axis=1)
+        del nodes[j]
+        del masks[j]
+
+    if len(nodes) == 3:
+        lengths = [(d[0, 1] + d[0, 2] - d[1, 2]) / 2, (d[0, 1] + d[1, 2] - d[0, 2]) / 2,
+                   (d[0, 2] + d[1, 2] - d[0, 1]) / 2]
+        newick = "({});".format(",".join(["{}:{:.5f}".format(node, length) for node, length in zip(nodes, lengths)]))
+    else:
+        newick = _join(nodes[0], nodes[1], d[0, 1] / 2, d[0, 1] / 2) + ";"
+    return newick, clusters
+
+
+def upgma(distances, names):
+    """Build a rooted UPGMA (average linkage) tree.
+
+    Returns the Newick string and the leaf masks (bit per input row) of all internal nodes.
+    """
+    d = np.array(distances, dtype=np.float64)
+    np.fill_diagonal(d, np.inf)
+    nodes = list(names)
+    masks = [1 << i for i in range(len(names))]
+    sizes = np.ones(len(names))
+    heights = np.zeros(len(names))
+    clusters = []
+    while len(nodes) > 1:
+        i, j = np.unravel_index(np.argmin(d), d.shape)
+        if i > j:
+            i, j = j, i
+
+        height = d[i, j] / 2
+        new_distances = (sizes[i] * d[i] + sizes[j] * d[j]) / (sizes[i] + sizes[j])
+
+        nodes[i] = _join(nodes[i], nodes[j], height - heights[i], height - heights[j])
+        masks[i] = masks[i] | masks[j]
+        clusters.append(masks[i])
+        sizes[i] += sizes[j]
+        heights[i] = height
+        d[i, :] = new_distances
+        d[:, i] = new_distances
+        d[i, i] = np.inf
+        d = np.delete(np.delete(d, j, axis=0), j, axis=1)
+        sizes = np.delete(sizes, j)
+        heights = np.delete(heights, j)
+        del nodes[j]
+        del masks[j]
+
+    return nodes[0] + ";", clusters[:-1]
+
+
+def _canonical_splits(clusters, num_leaves):
+    """Convert clusters to unrooted splits, represented by the side that does not contain the first leaf."""
+    all_leaves = (1 << num_leaves) - 1
+    splits = set()
+    for mask in clusters:
+        if mask & 1:
+            mask = all_leaves ^ mask
+        size = bin(mask).count("1")
+        if 1 < size < num_leaves - 1:
+            splits.add(mask)
+    return splits
+
+
+def _replicate_splits(encoded, replicates, use_upgma):
+    """Return the splits of the trees of the given bootstrap replicates (lists of sampled columns)."""
+    num_leaves = encoded.shape[0]
+    names = [str(i) for i in range(num_leaves)]
+    tree_function = upgma if use_upgma else neighbor_joining
+    replicate_splits = []
+    for columns in replicates:
+        clusters = tree_function(kimura_distances(encoded[:, columns]), names)[1]
+        replicate_splits.append(_canonical_splits(clusters, num_leaves))
+    return replicate_splits
+
+
+def majority_rule_consensus(replicate_splits, names):
+    """Build the extended majority-rule consensus tree, as PHYLIP consense.
+
+    Splits are added from the most to the least frequent as long as they are compatible with the tree, branch lengths
+    are the number of replicates containing the split.
+    """
+    counts = {}
+    for splits in replicate_splits:
+        for split in splits:
+            counts[split] = counts.get(split, 0) + 1
+
+    accepted = []
+    for split in sorted(counts, key=lambda s: (-counts[s], s)):
+        if all(split & other == 0 or split & other == split or split & other == other for other in accepted):
+            accepted.append(split)
+
+    # nest the splits, smallest first so children are written before their parents
+    all_leaves = (1 << len(names)) - 1
+    num_replicates = len(replicate_splits)
+    accepted.sort(key=lambda s: bin(s).count("1"))
+    newick = {}
+    parents = {}
+    for i, split in enumerate(accepted + [all_leaves]):
+        children = [child for child in accepted[:i] if parents.get(child) is None and child & split == child]
+        covered = 0
+        for child in children:
+            parents[child] = split
+            covered |= child
+        members = [newick[child] + ":{:.1f}".format(counts[child]) for child in children]
+        members += ["{}:{:.1f}".format(names[leaf], num_replicates) for leaf in range(len(names))
+                    if split & ~covered & (1 << leaf)]
+        newick[split] = "({})".format(",".join(members))
+    return newick[all_leaves] + ";"
+
+
+def bootstrap_replicates(num_positions, num_replicates, seed=77):
+    """Return the sampled columns of each bootstrap replicate, as PHYLIP seqboot (resampling with replacement)."""
+    random_state = np.random.RandomState(seed)
+    return [np.sort(random_state.randint(0, num_positions, num_positions)) for _ in range(num_replicates)]
+
+
+def build_tree(encoded, names, use_upgma=False, bootstrap=0, processes=BOOTSTRAP_PROCESSES):
+    """Build a tree of an encoded alignment and return the Newick string and the PHYLIP formatted distance matrix.
+
+    @param encoded: uint8 (proteins x positions) matrix as returned by common.alignment_matrix.encode_alignment
+    @param names: names of the proteins used in the Newick string
+    @param use_upgma: build a UPGMA tree instead of a neighbor-joining tree
+    @param bootstrap: number of bootstrap replicates, the consensus tree of all replicates is returned when set
+    @param processes: number of processes used to calculate the bootstrap replicates, web requests use a single one
+    """
+    distances = kimura_distances(encoded)
+    if not bootstrap:
+        tree_function = upgma if use_upgma else neighbor_joining
+        newick = tree_function(distances, names)[0]
+    else:
+        replicates = bootstrap_replicates(encoded.shape[1], bootstrap)
+        if processes > 1 and bootstrap >= MIN_PARALLEL_REPLICATES:
+            chunks = [replicates[i::processes] for i in range(processes)]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = executor.map(_replicate_splits, [encoded] * processes, chunks, [use_upgma] * processes)
+                replicate_splits = [splits for result in results for splits in result]
+        else:
+            replicate_splits = _replicate_splits(encoded, replicates, use_upgma)
+        newick = majority_rule_consensus(replicate_splits, names)
+
+    return newick, format_distance_matrix(distances, names)
+
+
+def format_distance_matrix(distances, names):
+    """Format a distance matrix as a PHYLIP (protdist) square distance matrix."""
+    lines = ["{:5d}".format(len(names))]
+    for name, row in zip(names, distances):
+        lines.append("{:<10s}".format(name) + "".join(["{:10.6f}".format(d) for d in row]))
+    return "\n".join(lines) + "\n"
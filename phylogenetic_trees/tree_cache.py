@@ -0,0 +1,112 @@
+"""
+Cache of calculated phylogenetic trees, keyed by the alignment hash, the tree settings and the data version.
+
+Entries are stored in the 'phylogenetic_trees' cache (or the default cache). The data version is renewed by
+build_tree_cache after the data has been (re)built, so trees calculated from older data are no longer served. An index
+of the cached keys and their sizes is kept in the same cache, so that the least recently used trees are evicted when
+the total size exceeds TreeCache.max_size.
+
+The index is only changed when a tree is added, under a lock taken with an atomic cache add, so concurrent web
+processes do not lose each other's updates. Reads only store the time the tree was used under a key of its own.
+"""
+from django.core.cache import cache
+from django.core.cache import caches
+
+try:
+    cache_trees = caches['phylogenetic_trees']
+except:
+    cache_trees = cache
+
+import hashlib
+import pickle
+import time
+
+
+class TreeCache:
+    """LRU cache of the Newick tree, phyloXML and legend of calculated trees."""
+    prefix = 'phylogenetic_tree_'
+    used_prefix = 'phylogenetic_tree_used_'
+    index_key = 'phylogenetic_tree_index'
+    lock_key = 'phylogenetic_tree_index_lock'
+    lock_timeout = 30 # seconds after which a lock of a stopped process expires
+    lock_attempts = 100 # attempts to take the lock, 0.05 seconds apart
+    version_key = 'phylogenetic_tree_version'
+    max_size = 250 * 1024 * 1024 # total size of the cached trees in bytes
+    timeout = 60*60*24*7 # one week, as the alignment cache
+
+    def get_key(self, alignment_hash, tree_settings):
+        """Return the cache key of a tree of the current data version.
+
+        @param alignment_hash: hash of the aligned proteins and segments, as returned by Alignment.get_hash
+        @param tree_settings: bootstrap, UPGMA, branches and ttype settings of the tree
+        """
+        settings_key = "-".join([str(setting) for setting in tree_settings])
+        return hashlib.md5("|".join([alignment_hash, settings_key, self.get_version()]).encode('utf-8')).hexdigest()
+
+    def get_version(self):
+        return cache_trees.get(self.version_key) or '0'
+
+    def new_version(self):
+        """Start a new data version, trees cached for previous versions are no longer used and expire."""
+        cache_trees.set(self.version_key, str(time.time()), None)
+
+    def get_index(self):
+        index = cache_trees.get(self.index_key)
+        if index is None:
+            index = {}
+        return index
+
+    def get(self, key):
+        """Return a cached tree entry, or None. The entry is marked as most recently used."""
+        entry = cache_trees.get(self.prefix + key)
+        if entry is not None:
+            cache_trees.set(self.used_prefix + key, time.time(), self.timeout)
+        return entry
+
+    def acquire_lock(self):
+        """Take the index lock, returns False when it is held by another process for too long."""
+        for attempt in range(self.lock_attempts):
+            if cache_trees.add(self.lock_key, 1, self.lock_timeout):
+                return True
+            time.sleep(0.05)
+        return False
+
+    def set(self, key, entry):
+        """Cache a tree entry and evict the least recently used trees when the cache is too large. The entry is not
+        cached when the index lock cannot be taken."""
+        size = len(pickle.dumps(entry))
+        if size > self.max_size or not self.acquire_lock():
+            return
+
+        try:
+            index = self.get_index()
+            index.pop(key, None)
+            total_size = sum(index.values())
+            if total_size + size > self.max_size:
+                # trees that expired or were evicted by the cache backend have no use time and go first
+                used = cache_trees.get_many([self.used_prefix + k for k in index])
+                for evicted in sorted(index, key=lambda k: used.get(self.used_prefix + k, 0)):
+                    if total_size + size <= self.max_size:
+                        break
+                    cache_trees.delete_many([self.prefix + evicted, self.used_prefix + evicted])
+                    total_size -= index.pop(evicted)
+
+            index[key] = size
+            cache_trees.set(self.prefix + key, entry, self.timeout)
+            cache_trees.set(self.used_prefix + key, time.time(), self.timeout)
+            cache_trees.set(self.index_key, index, None)
+        finally:
+            cache_trees.delete(self.lock_key)
+
+    def get_size(self):
+        """Return the number of cached trees and their total size in bytes."""
+        index = self.get_index()
+        return len(index), sum(index.values())
+
+    def clear(self):
+        for key in self.get_index():
+            cache_trees.delete_many([self.prefix + key, self.used_prefix + key])
+        cache_trees.delete(self.index_key)
+
+
+tree_cache = TreeCache()
@@ -8,29 +8,24 @@ from django.views.decorators.csrf import csrf_exempt
 from common.views import AbsTargetSelectionTable
 from common.views import AbsSegmentSelection
 from common.views import AbsMiscSelection
+from common.alignment_matrix import encode_alignment
 from common.selection import Selection, SelectionItem
 from mutation.models import *
 from phylogenetic_trees.PrepareTree import *
+from phylogenetic_trees.tree_builder import build_tree
+from phylogenetic_trees.tree_cache import tree_cache
 from protein.models import ProteinFamily, ProteinSet, Protein, ProteinSegment, ProteinCouplings
 
 from copy import deepcopy
 import json
 import math
-import os, shutil, subprocess, signal
-import uuid
+import os, shutil
+import tempfile
 
 from collections import OrderedDict
 
 Alignment = getattr(__import__('common.alignment_' + settings.SITE_NAME, fromlist=['Alignment']), 'Alignment')
 
-def kill_phylo(): #FIXME, needs better way of handling this!
-    p = subprocess.Popen(['ps', '-A'], stdout=subprocess.PIPE)
-    out, err = p.communicate()
-    for line in out.splitlines():
-        if 'protdist' in str(line):
-            pid = int(line.split(None, 1)[0])
-            os.kill(pid, signal.SIGKILL)
-
 class TargetSelection(AbsTargetSelectionTable):
     step = 1
     number_of_steps = 3
@@ -127,8 +122,10 @@ class Treeclass:
         self.phylip = None
         self.outtree = None
         self.dir = ''
+        # bootstrap replicates are calculated in the web process, the builds calculate them in parallel
+        self.processes = 1
 
-    def Prepare_file(self, request,build=False):
+    def Prepare_file(self, request,build=False, simple_selection=None):
         self.Tree = PrepareTree(build)
         a=Alignment()
 
@@ -165,33 +162,52 @@ class Treeclass:
             self.bootstrap,self.UPGMA,self.branches,self.ttype=[0,1,1,0]
         ##################################################################
         else:
-            simple_selection=request.session.get('selection', False)
+            if simple_selection is None:
+                simple_selection=request.session.get('selection', False)
             a.load_proteins_from_selection(simple_selection, True)
             a.load_segments_from_selection(simple_selection)
             self.bootstrap,self.UPGMA,self.branches,self.ttype = map(int,simple_selection.tree_settings)
 
         if self.bootstrap!=0:
             self.bootstrap=pow(10,self.bootstrap)
+
+        #### Serve trees of previously calculated selections and settings from the cache
+        #### statistics trees of the build are always calculated from the current data
+        if build != False:
+            tree_key = None
+            cached_tree = None
+        else:
+            tree_key = tree_cache.get_key(a.get_hash(), [self.bootstrap, self.UPGMA, self.branches, self.ttype])
+            cached_tree = tree_cache.get(tree_key)
+        if cached_tree is not None:
+            phylogeny_input = self.load_cached_tree(cached_tree)
+        else:
+            phylogeny_input = self.calculate_tree(a, crysts)
+            if phylogeny_input in ('More_prots', 'No_alignment'):
+                return phylogeny_input,None, None, None, None,None,None,None,None
+            if tree_key is not None:
+                tree_cache.set(tree_key, self.get_cache_entry(phylogeny_input))
+
+        if build != False:
+            open('static/home/images/'+build+'_legend.svg','w').write(str(self.Tree.legend))
+            open('static/home/images/'+build+'_tree.xml','w').write(phylogeny_input)
+        else:
+            return phylogeny_input, self.branches, self.ttype, self.total, str(self.Tree.legend), self.Tree.box, self.Additional_info, self.buttons, a.proteins
+
+    def calculate_tree(self, a, crysts):
         #### Create an alignment object
         a.build_alignment()
         a.calculate_statistics()
         a.calculate_similarity()
         self.total = len(a.proteins)
-        total_length = 0
-        for chain in a.proteins[0].alignment:
-            total_length += len(a.proteins[0].alignment[chain])
         families = ProteinFamily.objects.all()
         self.famdict = {}
         for n in families:
             self.famdict[self.Tree.trans_0_2_A(n.slug)]=n.name
-        dirname = uuid.uuid4()
-        os.mkdir('/tmp/%s' %dirname)
-        infile = open('/tmp/%s/infile' %dirname,'w')
-        infile.write('    '+str(self.total)+'    '+str(total_length)+'\n')
         if len(a.proteins) < 3:
-            return 'More_prots',None, None, None, None,None,None,None,None
+            return 'More_prots'
         ####Get additional protein information
-        accesions = {}
+        names = []
         for n in a.proteins:
             fam = self.Tree.trans_0_2_A(n.protein.family.slug)
             if n.protein.sequence_type.slug == 'consensus':
@@ -215,89 +231,34 @@ class Treeclass:
             if len(name)>25:
                 name=name[:25]+'...'
             self.family[entry_name] = {'name':name,'family':fam,'description':desc,'species':spec,'class':'','accession':acc,'ligand':'','type':'','link': entry_name}
-            accesions[acc]=entry_name
-            ####Write PHYLIP input
-            sequence = ''
-            for chain in n.alignment:
-                for residue in n.alignment[chain]:
-                    sequence += residue[2].replace('_','-')
-            infile.write(acc+' '*9+sequence+'\n')
-        infile.close()
-
-        ####Run bootstrap
-        if self.bootstrap:
-        ### Write phylip input options
-            inp = open('/tmp/%s/temp' %dirname,'w')
-            inp.write('\n'.join(['r',str(self.bootstrap),'y','77','y'])+'\n')
-            inp.close()
-        ###
-            try:
-                subprocess.check_output(['phylip seqboot<temp'], shell=True, cwd = '/tmp/%s' %dirname, timeout=300)
-                os.rename('/tmp/%s/outfile' %dirname, '/tmp/%s/infile' %dirname)
-            except:
-                kill_phylo() #FIXME, needs better way of handling this!
-                return "too big","too big","too big","too big","too big","too big","too big","too big","too big"
+            names.append(entry_name)
 
-        ### Write phylip input options
-        inp = open('/tmp/%s/temp' %dirname,'w')
-        if self.bootstrap:
-            inp.write('\n'.join(['m','d',str(self.bootstrap),'y'])+'\n')
-        else:
-            inp.write('y\n')
-        inp.close()
-        ###
+        ####Calculate the distances and (bootstrapped) tree
         try:
-            subprocess.check_output(['phylip protdist<temp>>log'], shell=True, cwd = '/tmp/%s' %dirname, timeout=300)
-        except:
-            kill_phylo() #FIXME, needs better way of handling this!
-            return "too big","too big","too big","too big","too big","too big","too big","too big","too big"
-        os.rename('/tmp/%s/infile' %dirname, '/tmp/%s/dupa' %dirname)
-        os.rename('/tmp/%s/outfile' %dirname, '/tmp/%s/infile' %dirname)
-        inp = open('/tmp/%s/temp' %dirname,'w')
-        if self.bootstrap:
-        ### Write phylip input options
-            if self.UPGMA:
-                inp.write('\n'.join(['N','m',str(self.bootstrap),'111','y'])+'\n')
-            else:
-                inp.write('\n'.join(['m',str(self.bootstrap),'111','y'])+'\n')
-        else:
-            if self.UPGMA:
-                inp.write('N\ny\n')
-            else:
-                inp.write('y\n')
-        inp.close()
-        ###
-        try:
-            subprocess.check_output(['phylip neighbor<temp'], shell=True, cwd = '/tmp/%s' %dirname, timeout=300)
-        except:
-            kill_phylo() #FIXME, needs better way of handling this!
-            return "too big","too big","too big","too big","too big","too big","too big","too big"
-        if self.bootstrap:
-            os.rename('/tmp/%s/outfile' %dirname, '/tmp/%s/infile' %dirname)
-            os.rename('/tmp/%s/outtree' %dirname, '/tmp/%s/intree' %dirname)
-           ### Write phylip input options
-            inp = open('/tmp/%s/temp' %dirname,'w')
-            inp.write('y\n')
-            inp.close()
-        ###
-            try:
-                subprocess.check_output(['phylip consense<temp'], shell=True, cwd = '/tmp/%s' %dirname, timeout=300)
-            except:
-                kill_phylo() #FIXME, needs better way of handling this!
-                return "too big","too big","too big","too big","too big","too big","too big","too big"
-        self.phylip = open('/tmp/%s/outtree' %dirname).read()
-        for acc in accesions.keys():
-            self.phylip=self.phylip.replace(acc,accesions[acc])
-#        self.phylogeny_output = self.phylip
-        self.outtree = open('/tmp/%s/outfile' %dirname).read().lstrip()
-        phylogeny_input = self.get_phylogeny('/tmp/%s/' %dirname)
-        shutil.rmtree('/tmp/%s' %dirname)
+            self.phylip, self.outtree = build_tree(encode_alignment(a.proteins), names, self.UPGMA, self.bootstrap,
+                self.processes)
+        except ValueError:
+            return 'No_alignment'
+        dirname = tempfile.mkdtemp()
+        phylogeny_input = self.get_phylogeny(dirname)
+        shutil.rmtree(dirname)
+        return phylogeny_input
 
-        if build != False:
-            open('static/home/images/'+build+'_legend.svg','w').write(str(self.Tree.legend))
-            open('static/home/images/'+build+'_tree.xml','w').write(phylogeny_input)
-        else:
-            return phylogeny_input, self.branches, self.ttype, self.total, str(self.Tree.legend), self.Tree.box, self.Additional_info, self.buttons, a.proteins
+    def get_cache_entry(self, phylogeny_input):
+        return {'newick': self.phylip, 'phyloxml': phylogeny_input, 'legend': str(self.Tree.legend),
+            'outtree': self.outtree, 'total': self.total, 'family': self.family, 'famdict': self.famdict,
+            'crystal_proteins': self.Additional_info['crystal']['proteins']}
+
+    def load_cached_tree(self, cached_tree):
+        self.phylip = cached_tree['newick']
+        self.outtree = cached_tree['outtree']
+        self.total = cached_tree['total']
+        self.family = cached_tree['family']
+        self.famdict = cached_tree['famdict']
+        self.Additional_info['crystal']['proteins'] = cached_tree['crystal_proteins']
+        self.Tree.legend = cached_tree['legend']
+        self.Tree.box = self.Tree.drawColorPanel()
+        return cached_tree['phyloxml']
 
     def get_phylogeny(self, dirname):
 
@@ -348,6 +309,9 @@ def render_tree(request):
     if phylogeny_input == 'More_prots':
         return render(request, 'phylogenetic_trees/warning.html')
 
+    if phylogeny_input == 'No_alignment':
+        return render(request, 'phylogenetic_trees/no_alignment.html')
+
     if ttype == '1':
         float(total)/4*100
     else:
@@ -366,6 +330,9 @@ def render_tree_v2(request):
     if phylogeny_input == 'More_prots':
         return render(request, 'phylogenetic_trees/warning.html')
 
+    if phylogeny_input == 'No_alignment':
+        return render(request, 'phylogenetic_trees/no_alignment.html')
+
     protein_data = []
 
     #FIXME remove
@@ -442,6 +409,9 @@ def render_tree_v3(request):
     if phylogeny_input == 'More_prots':
         return render(request, 'phylogenetic_trees/warning.html')
 
+    if phylogeny_input == 'No_alignment':
+        return render(request, 'phylogenetic_trees/no_alignment.html')
+
     request.session['Tree'] = Tree_class
 
     # output dictionary
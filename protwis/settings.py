@@ -140,6 +140,9 @@ if DEBUG:
 
 SMILES_MAX_LENGTH = 200
 PYTHON_SMILES_VALIDATION = True
+# 'cartridge' searches ligand structures with the RDKit PostgreSQL cartridge, 'fingerprint_index' with the index
+# exported by build_ligand_search (for databases without the cartridge)
+LIGAND_SEARCH_BACKEND = 'cartridge'
 
 # Logging
 if DEBUG:
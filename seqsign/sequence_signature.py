@@ -1182,6 +1182,7 @@ class SignatureMatch():
                     self.residue_to_feat['-'].add(fidx)
 
         self._find_norm()
+        self._prepare_scoring()
         if protein_set_pos:
             self.scores_pos, self.signatures_pos, self.scored_proteins_pos = self.score_protein_set(self.protein_set_pos, signprot)
         if protein_set_neg:
@@ -1271,11 +1272,113 @@ class SignatureMatch():
         self.signature_consensus = signature
 
 
-    def score_protein_class(self, pclass_slug='001', signprot=False):
+    def _prepare_scoring(self):
+        """
+        Precompute the signature feature of each relevant position and the score and color of every residue type at
+        that position, so that proteins are scored with a single lookup per position.
+        """
+        feature_abbreviations = list(AMINO_ACID_GROUPS.keys())
+        feature_names = list(AMINO_ACID_GROUP_NAMES.values())
+
+        # residue codes: one per amino acid, followed by unknown residues and missing residues (no residue at the GN)
+        self.residue_codes = dict([(aa, code) for code, aa in enumerate(AMINO_ACIDS.keys())])
+        self.unknown_code = len(self.residue_codes)
+        self.missing_code = self.unknown_code + 1
+
+        self.scoring_positions = []
+        scores = []
+        colors = []
+        for segment in self.relevant_segments:
+            signature_map = np.absolute(self.signature_matrix_filtered[segment]).argmax(axis=0)
+            signature_map = self._assign_preferred_features(signature_map, segment, self.signature_matrix_filtered)
+            for idx, pos in enumerate(self.relevant_gn[self.schemes[0][0]][segment].keys()):
+                feat = signature_map[idx]
+                val = self.signature_matrix_filtered[segment][feat][idx]
+                self.scoring_positions.append((segment, feature_abbreviations[feat], feature_names[feat], val, pos))
+
+                position_scores = []
+                position_colors = []
+                for aa in list(self.residue_codes.keys()) + [None]:
+                    if aa is not None and feat in self.residue_to_feat[aa]:
+                        position_scores.append(val if val > 0 else 0)
+                        position_colors.append("#808080" if val > 0 else "white")
+                    else:
+                        #David doesn't want the negative values in the score
+                        #if a receptor does NOT have the negative property, add the score
+                        position_scores.append(-val if val < 0 else 0)
+                        position_colors.append("white" if val > 0 else "#808080")
+                # missing residue, only matching a gap feature
+                if feature_names[feat] == 'Gap':
+                    position_scores.append(val)
+                    position_colors.append("#808080" if val > 0 else "white")
+                else:
+                    position_scores.append(0)
+                    position_colors.append("white")
+                scores.append(position_scores)
+                colors.append(position_colors)
+
+        self.relevant_gns_total = [x[4] for x in self.scoring_positions]
+        self.position_index = dict([(pos, col) for col, pos in enumerate(self.relevant_gns_total)])
+        self.score_table = np.array(scores, dtype=float).reshape(len(self.scoring_positions), self.missing_code + 1)
+        self.color_table = colors
+
+    def _encode_residues(self, pcf_ids, residues):
+        """
+        Encode the residues at the relevant GNs as a (proteins x positions) matrix of residue codes.
+
+        @param residues: (protein conformation id, generic number label, amino acid) tuples
+        """
+        rows = dict([(pcf_id, row) for row, pcf_id in enumerate(pcf_ids)])
+        codes = np.full((len(rows), len(self.scoring_positions)), self.missing_code, dtype=np.int32)
+        amino_acids = {}
+        for pcf_id, label, amino_acid in residues:
+            if pcf_id in rows and label in self.position_index:
+                codes[rows[pcf_id], self.position_index[label]] = self.residue_codes.get(amino_acid, self.unknown_code)
+                amino_acids[(pcf_id, label)] = amino_acid
+        return codes, amino_acids
+
+    def _score_residue_codes(self, codes):
+        """
+        Return the score of each row of a residue code matrix.
+        """
+        return self.score_table[np.arange(codes.shape[1]), codes].sum(axis=1)
+
+    def _signature_match(self, pcf_id, codes, amino_acids):
+        consensus_match = OrderedDict([(x, []) for x in self.relevant_segments])
+        for col, (segment, feat_abr, feat_name, val, pos) in enumerate(self.scoring_positions):
+            consensus_match[segment].append([
+                feat_abr,
+                feat_name,
+                val,
+                self.color_table[col][codes[col]],
+                amino_acids.get((pcf_id, pos), '-'),
+                pos
+                ])
+        return consensus_match
+
+    def _score_conformations(self, pcfs):
+        """
+        Score all protein conformations at once, returns the (score, normalized score) and signature match of each.
+        """
+        pcfs = list(pcfs)
+        pcf_ids = [pcf.pk for pcf in pcfs]
+        residues = Residue.objects.filter(
+            protein_conformation__in=pcf_ids,
+            generic_number__label__in=self.relevant_gns_total
+            ).values_list('protein_conformation_id', 'generic_number__label', 'amino_acid')
+        codes, amino_acids = self._encode_residues(pcf_ids, residues)
+        scores = self._score_residue_codes(codes)
 
-        start = time.time()
         protein_scores = {}
         protein_signature_match = {}
+        for row, pcf in enumerate(pcfs):
+            protein_scores[pcf] = (scores[row]/100, scores[row]/self.norm*100)
+            protein_signature_match[pcf] = self._signature_match(pcf.pk, codes[row], amino_acids)
+        return protein_scores, protein_signature_match
+
+    def score_protein_class(self, pclass_slug='001', signprot=False):
+
+        start = time.time()
         class_proteins = Protein.objects.filter(
             species__common_name='Human',
             family__slug__startswith=pclass_slug
@@ -1295,30 +1398,7 @@ class SignatureMatch():
                 protein__sequence_type__slug='wt'
             ).exclude(protein__entry_name__endswith='-consensus').prefetch_related('protein','protein__family__parent','protein__species')
 
-        relevant_gns_total = []
-        for segment in  self.relevant_segments:
-            for idx, pos in enumerate(self.relevant_gn[self.schemes[0][0]][segment].keys()):
-                relevant_gns_total.append(pos)
-
-        resi = Residue.objects.filter(
-            protein_conformation__in=class_a_pcf,
-            generic_number__label__in=relevant_gns_total
-            ).prefetch_related('generic_number','protein_conformation')
-        resi_dict_all = {}
-        for r in resi:
-            if r.generic_number:
-                pcf = r.protein_conformation.pk
-                if pcf not in resi_dict_all:
-                    resi_dict_all[pcf] = {}
-                resi_dict_all[pcf][r.generic_number.label] = r
-
-        for pcf in class_a_pcf:
-            # p_start = time.time()
-            score, nscore, signature_match = self.score_protein(pcf, resi_dict_all)
-            protein_scores[pcf] = (score, nscore)
-            protein_signature_match[pcf] = signature_match
-            # p_end = time.time()
-            # print("Time elapsed for {}: ".format(pcf.protein.entry_name), p_end - p_start)
+        protein_scores, protein_signature_match = self._score_conformations(class_a_pcf)
         end = time.time()
         self.protein_report = OrderedDict(sorted(protein_scores.items(), key=lambda x: x[1][0], reverse=True))
         for prot in self.protein_report.items():
@@ -1330,8 +1410,6 @@ class SignatureMatch():
     def score_protein_set(self, protein_set, signprot=False):
 
         start = time.time()
-        protein_scores = {}
-        protein_signature_match = {}
 
         seq_type_slug=['wt']
         if signprot:
@@ -1345,30 +1423,7 @@ class SignatureMatch():
                 protein__sequence_type__slug__in=seq_type_slug
                 ).exclude(protein__entry_name__endswith='-consensus').prefetch_related('protein')
 
-        relevant_gns_total = []
-        for segment in  self.relevant_segments:
-            for idx, pos in enumerate(self.relevant_gn[self.schemes[0][0]][segment].keys()):
-                relevant_gns_total.append(pos)
-
-        resi = Residue.objects.filter(
-            protein_conformation__in=pcfs,
-            generic_number__label__in=relevant_gns_total
-            ).prefetch_related('generic_number','protein_conformation')
-        resi_dict_all = {}
-        for r in resi:
-            if r.generic_number:
-                pcf = r.protein_conformation.pk
-                if pcf not in resi_dict_all:
-                    resi_dict_all[pcf] = {}
-                resi_dict_all[pcf][r.generic_number.label] = r
-
-        for pcf in pcfs:
-            # p_start = time.time()
-            score, nscore, signature_match = self.score_protein(pcf,resi_dict_all)
-            protein_scores[pcf] = (score, nscore)
-            protein_signature_match[pcf] = signature_match
-            # p_end = time.time()
-            # print("Time elapsed for {}: ".format(pcf.protein.entry_name), p_end - p_start)
+        protein_scores, protein_signature_match = self._score_conformations(pcfs)
         end = time.time()
         protein_report = OrderedDict(sorted(protein_scores.items(), key=lambda x: x[1][0], reverse=True))
         protein_signatures = OrderedDict()
@@ -1380,120 +1435,17 @@ class SignatureMatch():
         return (protein_report, protein_signatures, scored_proteins)
 
     def score_protein(self, pcf,resi_dict_all):
-        prot_score = 0.0
-        #norm = 0.0
-        consensus_match = OrderedDict([(x, []) for x in self.relevant_segments])
 
         if resi_dict_all == None or pcf.pk not in resi_dict_all:
-            relevant_gns_total = []
-            for segment in  self.relevant_segments:
-                for idx, pos in enumerate(self.relevant_gn[self.schemes[0][0]][segment].keys()):
-                    relevant_gns_total.append(pos)
-            resi = Residue.objects.filter(
+            residues = Residue.objects.filter(
                 protein_conformation=pcf,
-                generic_number__label__in=relevant_gns_total
-                ).prefetch_related('generic_number')
-            resi_dict = {}
-            for r in resi:
-                if r.generic_number:
-                    resi_dict[r.generic_number.label] = r
+                generic_number__label__in=self.relevant_gns_total
+                ).values_list('protein_conformation_id', 'generic_number__label', 'amino_acid')
         else:
-            resi_dict = resi_dict_all[pcf.pk]
-        for segment in self.relevant_segments:
-            tmp = []
-            # signature_map = self.signature_matrix_filtered[segment].argmax(axis=0)
-            signature_map = np.absolute(self.signature_matrix_filtered[segment]).argmax(axis=0)
-            signature_map = self._assign_preferred_features(signature_map, segment, self.signature_matrix_filtered)
-
-            #norm += np.sum(np.amax(self.signature_matrix_filtered[segment], axis=0))
-
-            for idx, pos in enumerate(self.relevant_gn[self.schemes[0][0]][segment].keys()):
-                feat = signature_map[idx]
-                feat_abr = list(AMINO_ACID_GROUPS.keys())[feat]
-                feat_name = list(AMINO_ACID_GROUP_NAMES.values())[feat]
-                val = self.signature_matrix_filtered[segment][feat][idx]
-                if pos in resi_dict:
-                    res = resi_dict[pos]
-                    if feat in self.residue_to_feat[res.amino_acid]:
-                        if val > 0:
-                            prot_score += val
-                        tmp.append([
-                            feat_abr,
-                            feat_name,
-                            val,
-                            #"green",
-                            "#808080",
-                            res.amino_acid, pos
-                            ]) if val > 0 else tmp.append([
-                                feat_abr,
-                                feat_name,
-                                val,
-                                "white",
-                                res.amino_acid,
-                                pos
-                                ])
-                    else:
-                        #David doesn't want the negative values in the score
-                        # prot_score -= val
-                        if val < 0:
-                            prot_score -= val #if a receptor does NOT have the negative property, add the score
-                        tmp.append([
-                            feat_abr,
-                            feat_name,
-                            val,
-                            # "red",
-                            "white",
-                            res.amino_acid,
-                            pos
-                            ]) if val > 0 else tmp.append([
-                                feat_abr,
-                                feat_name,
-                                val,
-                                # "green",
-                                "#808080",
-                                res.amino_acid,
-                                pos
-                                ])
-                else:
-                    if feat_name == 'Gap':
-                        tmp.append([
-                            feat_abr,
-                            feat_name,
-                            val,
-                            # "green",
-                            "#808080",
-                            '-',
-                            pos
-                            ]) if val > 0 else tmp.append([
-                                feat_abr,
-                                feat_name,
-                                val,
-                                "white",
-                                '-',
-                                pos
-                                ])
-                        prot_score += val
-                    else:
-                        #David doesn't want the negative values in the score
-                        #prot_score -= val
-                        tmp.append([
-                            feat_abr,
-                            feat_name,
-                            val,
-                            # "red",
-                            "white",
-                            '-',
-                            pos
-                            ]) if val > 0 else tmp.append([
-                                feat_abr,
-                                feat_name,
-                                val,
-                                "white",
-                                '-',
-                                pos
-                                ])
-            consensus_match[segment] = tmp
-        return (prot_score/100, prot_score/self.norm*100, consensus_match)
+            residues = [(pcf.pk, label, r.amino_acid) for label, r in resi_dict_all[pcf.pk].items()]
+        codes, amino_acids = self._encode_residues([pcf.pk], residues)
+        prot_score = self._score_residue_codes(codes)[0]
+        return (prot_score/100, prot_score/self.norm*100, self._signature_match(pcf.pk, codes[0], amino_acids))
 
 def signature_score_excel(workbook, scores, protein_signatures, signature_filtered, relevant_gn, relevant_segments, numbering_schemes, scores_positive=None, scores_negative=None, signatures_positive=None, signatures_negative=None):
 
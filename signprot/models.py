@@ -1,6 +1,7 @@
 from django.db import models
 from protein.models import Protein, ProteinConformation
 from structure.models import StructureStabilizingAgent, PdbData
+from structure.coordinates import get_cleaned_pdb
 from common.models import WebLink, Publication
 
 
@@ -19,31 +20,7 @@ class SignprotStructure(models.Model):
 
     def get_cleaned_pdb(self, pref_chain=True, remove_waters=True, ligands_to_keep=None, remove_aux=False, aux_range=5.0):
 
-        tmp = []
-        for line in self.pdb_data.pdb.split('\n'):
-            save_line = False
-            if pref_chain:
-                if (line.startswith('ATOM') or line.startswith('HET')) and line[21] == self.preferred_chain[0]:
-                    save_line = True
-            else:
-                save_line = True
-            if remove_waters and line.startswith('HET') and line[17:20] == 'HOH':
-                save_line = False
-            if ligands_to_keep and line.startswith('HET'):
-                if pref_chain:
-                    if line[17:20] != 'HOH' and line[17:20] in ligands_to_keep and line[21] == self.preferred_chain[0]:
-                        save_line = True
-                    elif line[17:20] != 'HOH':
-                        save_line=False
-                else:
-                    if line[17:20] != 'HOH' and line[17:20] in ligands_to_keep:
-                        save_line = True
-                    elif line[17:20] != 'HOH':
-                        save_line=False
-            if save_line:
-                tmp.append(line)
-
-        return '\n'.join(tmp)
+        return get_cleaned_pdb(self.pdb_data.pdb, self.preferred_chain[0], pref_chain, remove_waters, ligands_to_keep)
 
     class Meta():
         db_table = 'signprot_structure'
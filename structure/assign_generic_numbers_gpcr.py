@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.db.models import F
 
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
@@ -36,6 +37,8 @@ class GenericNumbering(object):
 
         # dictionary of 'MappedResidue' object storing information about alignments and bw numbers
         self.residues = {}
+        # residue number of each position in the chain sequence, per chain
+        self.position_index = {}
         self.pdb_seq = {} #Seq('')
         # list of uniprot ids returned from blast
         self.prot_id_list = []
@@ -90,47 +93,52 @@ class GenericNumbering(object):
 
             self.pdb_seq[chain.id] = ''.join([self.residues[chain.id][x].name for x in sorted(self.residues[chain.id].keys())])
 
+            self.position_index[chain.id] = {}
             for pos, res in enumerate(sorted(self.residues[chain.id].keys()), start=1):
                 self.residues[chain.id][res].pos_in_aln = pos
+                self.position_index[chain.id][pos] = res
 
 
     def locate_res_by_pos (self, chain, pos):
 
-        for res in self.residues[chain].keys():
-            if self.residues[chain][res].pos_in_aln == pos:
-                return res
-        return 0
+        return self.position_index[chain].get(pos, 0)
 
 
-    def map_blast_seq (self, prot_id, hsps, chain):
+    def get_protein_residues (self, prot_ids):
+        """
+        Fetch the residues of all hit proteins with one query, returns {protein id: {sequence number: residue}}
+        """
+        residues = dict([(str(prot_id), {}) for prot_id in prot_ids])
+        rs = Residue.objects.prefetch_related('display_generic_number', 'protein_segment').filter(
+            protein_conformation__protein__in=list(residues.keys())).annotate(
+            protein_id=F('protein_conformation__protein_id'))
+        for r in rs:
+            residues[str(r.protein_id)][r.sequence_number] = r
+        return residues
+
+
+    def map_blast_seq (self, prot_id, hsps, chain, residues=None):
         #find uniprot residue numbers corresponding to those in pdb file
-        q_seq = list(hsps.query)
-        tmp_seq = list(hsps.sbjct)
+        q_seq = hsps.query
+        tmp_seq = hsps.sbjct
         subj_counter = hsps.sbjct_start
         q_counter = hsps.query_start
 
         logger.info("{}\n{}".format(hsps.query, hsps.sbjct))
         logger.info("{:d}\t{:d}".format(hsps.query_start, hsps.sbjct_start))
 
-        rs = Residue.objects.prefetch_related('display_generic_number', 'protein_segment').filter(
-            protein_conformation__protein=prot_id)
-        residues = {}
-        for r in rs:
-            residues[r.sequence_number] = r
+        if residues is None:
+            residues = self.get_protein_residues([prot_id])[str(prot_id)]
 
-        while tmp_seq:
+        for q_res, subj_res in zip(q_seq, tmp_seq):
             #skipping position if there is a gap in either of sequences
-            if q_seq[0] == '-' or q_seq[0] == 'X' or q_seq[0] == ' ':
+            if q_res == '-' or q_res == 'X' or q_res == ' ':
                 subj_counter += 1
-                tmp_seq.pop(0)
-                q_seq.pop(0)
                 continue
-            if tmp_seq[0] == '-' or tmp_seq[0] == 'X' or tmp_seq[0] == ' ':
+            if subj_res == '-' or subj_res == 'X' or subj_res == ' ':
                 q_counter += 1
-                tmp_seq.pop(0)
-                q_seq.pop(0)
                 continue
-            if tmp_seq[0] == q_seq[0]:
+            if subj_res == q_res:
                 resn = self.locate_res_by_pos(chain, q_counter)
                 if resn != 0:
                     if subj_counter in residues:
@@ -161,8 +169,6 @@ class GenericNumbering(object):
                         self.prot_id_list.append(prot_id)
             q_counter += 1
             subj_counter += 1
-            tmp_seq.pop(0)
-            q_seq.pop(0)
 
 
     def get_substructure_mapping_dict(self):
@@ -213,19 +219,24 @@ class GenericNumbering(object):
 
     def assign_generic_numbers(self):
 
-        alignments = {}
-        #blast search goes first, looping through all the chains
-        for chain in self.pdb_seq.keys():
-            alignments[chain] = self.blast.run(self.pdb_seq[chain])
+        #blast search goes first, all chains are searched at once
+        chains = list(self.pdb_seq.keys())
+        alignments = dict(zip(chains, self.blast.run_batch([self.pdb_seq[chain] for chain in chains])))
+
+        #only receptor hits are mapped, residues of all hits are fetched at once
+        hit_ids = set([alignment[0] for chain in chains for alignment in alignments[chain] if alignment != []])
+        receptor_ids = set([str(x) for x in Protein.objects.filter(id__in=hit_ids, family__slug__startswith='00').values_list('id', flat=True)])
+        residues = self.get_protein_residues(receptor_ids)
 
         #map the results onto pdb sequence for every sequence pair from blast
-        for chain in self.pdb_seq.keys():
+        for chain in chains:
             for alignment in alignments[chain]:
                 if alignment == []:
                     continue
+                if str(alignment[0]) not in receptor_ids:
+                    continue
                 for hsps in alignment[1].hsps:
-                    if Protein.objects.get(id=alignment[0]).family.slug.startswith('00'):
-                        self.map_blast_seq(alignment[0], hsps, chain)
+                    self.map_blast_seq(alignment[0], hsps, chain, residues[str(alignment[0])])
 
         return self.get_annotated_structure()
 
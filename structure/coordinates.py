@@ -0,0 +1,307 @@
+"""
+Cache of the atom records of PDB data as compact NumPy record arrays.
+
+The ATOM and HETATM records of a PDB file are parsed once into a record array (ATOM_DTYPE) with float32
+coordinates, which is saved as a binary sidecar in BUILD_CACHE_DIR/structure_coordinates, keyed by the checksum of
+the PDB text, and memory-mapped when loaded. Atoms can be filtered by chain, ligand and water without parsing the
+text again, and subsets are materialised as PDB text or Biopython structures on demand. The least recently used
+sidecars are removed when they exceed COORDINATE_CACHE_SIZE bytes.
+"""
+import hashlib
+import os
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+from Bio.PDB.PDBExceptions import PDBConstructionWarning
+from Bio.PDB.StructureBuilder import StructureBuilder
+
+from django.conf import settings
+
+from common.tools import prune_cache_dir
+
+
+ATOM_DTYPE = np.dtype([
+    ('line', np.int32), # line number of the record in the PDB text
+    ('hetatm', np.bool_),
+    ('name', 'S4'), # atom name as written, including padding
+    ('altloc', 'S1'),
+    ('resname', 'S3'),
+    ('chain', 'S1'),
+    ('resseq', np.int32),
+    ('icode', 'S1'),
+    ('xyz', np.float32, (3,)),
+    ('occupancy', np.float32),
+    ('bfactor', np.float32),
+    ('element', 'S2'),
+])
+
+ATOM_FORMAT_STRING = "{:<6s}{:5d} {:4s}{:1s}{:3s} {:1s}{:4d}{:1s}   {:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}          {:>2s}"
+
+# coordinates loaded in this process, by checksum of the PDB text
+_loaded_coordinates = OrderedDict()
+MAX_LOADED_COORDINATES = 256
+COORDINATE_CACHE_SIZE = getattr(settings, 'COORDINATE_CACHE_SIZE', 2 * 1024**3)
+
+
+def get_coordinates_dir():
+    return os.sep.join([settings.BUILD_CACHE_DIR, 'structure_coordinates'])
+
+
+def pdb_checksum(pdb_text):
+    return hashlib.sha1(pdb_text.encode('utf-8')).hexdigest()
+
+
+def _is_atom_line(line):
+    return line.startswith('ATOM') or line.startswith('HETATM')
+
+
+def _columns(chars, start, end):
+    return np.ascontiguousarray(chars[:, start:end]).view('S{}'.format(end - start)).ravel()
+
+
+def _numbers(column, dtype):
+    column = np.char.strip(column)
+    column[column == b''] = b'0'
+    return column.astype(dtype)
+
+
+def parse_atoms(pdb_text):
+    """Parse the ATOM and HETATM records of PDB text into a record array, the columns are sliced for all atoms at once.
+
+    Raises a ValueError when a numeric column of an atom record can not be parsed.
+    """
+    lines = pdb_text.split('\n')
+    line_numbers = [i for i, line in enumerate(lines) if _is_atom_line(line)]
+    atoms = np.zeros(len(line_numbers), dtype=ATOM_DTYPE)
+    if not line_numbers:
+        return atoms
+
+    records = np.array([lines[i][:80].ljust(80).encode('latin1', 'replace') for i in line_numbers], dtype='S80')
+    chars = records.view('S1').reshape(len(records), 80)
+    atoms['line'] = line_numbers
+    atoms['hetatm'] = chars[:, 0] == b'H'
+    atoms['name'] = _columns(chars, 12, 16)
+    atoms['altloc'] = _columns(chars, 16, 17)
+    atoms['resname'] = _columns(chars, 17, 20)
+    atoms['chain'] = _columns(chars, 21, 22)
+    atoms['resseq'] = _numbers(_columns(chars, 22, 26), np.int32)
+    atoms['icode'] = _columns(chars, 26, 27)
+    atoms['xyz'][:, 0] = _numbers(_columns(chars, 30, 38), np.float32)
+    atoms['xyz'][:, 1] = _numbers(_columns(chars, 38, 46), np.float32)
+    atoms['xyz'][:, 2] = _numbers(_columns(chars, 46, 54), np.float32)
+    atoms['occupancy'] = _numbers(_columns(chars, 54, 60), np.float32)
+    atoms['bfactor'] = _numbers(_columns(chars, 60, 66), np.float32)
+    atoms['element'] = np.char.strip(_columns(chars, 76, 78))
+    return atoms
+
+
+class CoordinateCache:
+    """Atom records of a PDB file, backed by the coordinate cache."""
+
+    def __init__(self, atoms, pdb_text=None):
+        self.atoms = atoms
+        self.pdb_text = pdb_text
+
+    @classmethod
+    def load(cls, pdb_text):
+        """Return the coordinates of PDB text, from this process, the sidecar file or by parsing it.
+
+        Raises a ValueError when the atom records of the PDB text can not be parsed.
+        """
+        checksum = pdb_checksum(pdb_text)
+        if checksum in _loaded_coordinates:
+            _loaded_coordinates.move_to_end(checksum)
+            return cls(_loaded_coordinates[checksum], pdb_text)
+
+        path = os.sep.join([get_coordinates_dir(), checksum + '.npy'])
+        atoms = None
+        if os.path.isfile(path):
+            try:
+                atoms = np.load(path, mmap_mode='r')
+                if atoms.dtype != ATOM_DTYPE:
+                    atoms = None
+            except (OSError, ValueError):
+                atoms = None
+            else:
+                try:
+                    # the modification time orders the sidecars for pruning
+                    os.utime(path)
+                except OSError:
+                    pass
+
+        if atoms is None:
+            atoms = parse_atoms(pdb_text)
+            try:
+                os.makedirs(get_coordinates_dir(), exist_ok=True)
+                # write to a temporary file first, other processes may be reading or writing the same sidecar
+                tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, atoms)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+            else:
+                prune_cache_dir(get_coordinates_dir(), COORDINATE_CACHE_SIZE, '.npy')
+
+        _loaded_coordinates[checksum] = atoms
+        while len(_loaded_coordinates) > MAX_LOADED_COORDINATES:
+            _loaded_coordinates.popitem(last=False)
+        return cls(atoms, pdb_text)
+
+    @property
+    def coords(self):
+        return self.atoms['xyz']
+
+    def chain_mask(self, chains):
+        """Mask of the atoms in the given chain(s)."""
+        if isinstance(chains, str):
+            chains = chains.split(',')
+        return np.isin(self.atoms['chain'], [c.encode('latin1') for c in chains])
+
+    def water_mask(self):
+        return self.atoms['hetatm'] & (self.atoms['resname'] == b'HOH')
+
+    def ligand_mask(self, resnames=None):
+        """Mask of the HETATM records that are not waters, optionally only those of the given residue names."""
+        mask = self.atoms['hetatm'] & (self.atoms['resname'] != b'HOH')
+        if resnames is not None:
+            mask &= self.resname_mask(lambda resname: resname in resnames)
+        return mask
+
+    def resname_mask(self, predicate):
+        """Mask of the atoms whose residue name (as written in columns 18-20) matches the predicate."""
+        resnames, inverse = np.unique(self.atoms['resname'], return_inverse=True)
+        matches = np.array([bool(predicate(r.decode('latin1').ljust(3))) for r in resnames], dtype=bool)
+        return matches[inverse] if len(resnames) else np.zeros(0, dtype=bool)
+
+    def subset(self, mask):
+        return CoordinateCache(self.atoms[mask], self.pdb_text)
+
+    def get_lines(self, mask):
+        """Return the original PDB text lines of the selected atoms."""
+        lines = self.pdb_text.split('\n')
+        return [lines[i] for i in self.atoms['line'][mask]]
+
+    def get_cleaned_pdb(self, preferred_chain, pref_chain=True, remove_waters=True, ligands_to_keep=None):
+        """Filter the PDB text as Structure.get_cleaned_pdb, using the cached atom records for the atom lines.
+
+        @param preferred_chain: chain kept when pref_chain is set
+        @param ligands_to_keep: residue names of the ligands that are kept, all other HETATM records are removed
+        """
+        atoms = self.atoms
+        is_water = atoms['resname'] == b'HOH'
+        in_chain = atoms['chain'] == preferred_chain.encode('latin1')
+        if pref_chain:
+            save = in_chain.copy()
+        else:
+            save = np.ones(len(atoms), dtype=bool)
+        if remove_waters:
+            save[atoms['hetatm'] & is_water] = False
+        if ligands_to_keep:
+            ligands = atoms['hetatm'] & ~is_water
+            keep = self.resname_mask(lambda resname: resname in ligands_to_keep)
+            if pref_chain:
+                keep &= in_chain
+            save[ligands] = keep[ligands]
+
+        # lines other than atom records (headers, HET records, TER, ...) are filtered line by line
+        lines = self.pdb_text.split('\n')
+        is_atom = np.zeros(len(lines), dtype=bool)
+        is_atom[atoms['line']] = True
+        save_lines = np.zeros(len(lines), dtype=bool)
+        save_lines[atoms['line'][save]] = True
+        for i in np.flatnonzero(~is_atom):
+            save_lines[i] = _save_line(lines[i], preferred_chain, pref_chain, remove_waters, ligands_to_keep)
+
+        return '\n'.join([lines[i] for i in np.flatnonzero(save_lines)])
+
+    def to_pdb(self, mask=None):
+        """Write the (selected) atoms as PDB ATOM/HETATM records."""
+        atoms = self.atoms if mask is None else self.atoms[mask]
+        lines = []
+        for serial, atom in enumerate(atoms, start=1):
+            x, y, z = atom['xyz']
+            lines.append(ATOM_FORMAT_STRING.format('HETATM' if atom['hetatm'] else 'ATOM', serial % 100000,
+                atom['name'].decode('latin1').ljust(4), atom['altloc'].decode('latin1'),
+                atom['resname'].decode('latin1'), atom['chain'].decode('latin1'), atom['resseq'],
+                atom['icode'].decode('latin1'), x, y, z, atom['occupancy'], atom['bfactor'],
+                atom['element'].decode('latin1')))
+        return '\n'.join(lines)
+
+    def to_structure(self, structure_id='ref', mask=None):
+        """Build a Biopython structure of the (selected) atoms, as returned by PDBParser(QUIET=True).get_structure."""
+        atoms = self.atoms if mask is None else self.atoms[mask]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', PDBConstructionWarning)
+            return self._build_structure(structure_id, atoms)
+
+    def _build_structure(self, structure_id, atoms):
+        builder = StructureBuilder()
+        builder.init_structure(structure_id)
+        builder.init_model(0)
+        current_chain = None
+        current_residue = None
+        for serial, atom in enumerate(atoms, start=1):
+            chain = atom['chain'].decode('latin1')
+            resname = atom['resname'].decode('latin1')
+            if chain != current_chain:
+                builder.init_chain(chain)
+                builder.init_seg('    ')
+                current_chain = chain
+                current_residue = None
+
+            residue = (resname, atom['hetatm'], int(atom['resseq']), atom['icode'].decode('latin1'))
+            if residue != current_residue:
+                if atom['hetatm']:
+                    hetfield = 'W' if resname in ('HOH', 'WAT') else 'H_' + resname
+                else:
+                    hetfield = ' '
+                builder.init_residue(resname, hetfield, int(atom['resseq']), atom['icode'].decode('latin1') or ' ')
+                current_residue = residue
+
+            fullname = atom['name'].decode('latin1')
+            # occupancy and B-factor have two decimals in PDB files
+            builder.init_atom(fullname.strip(), np.array(atom['xyz'], dtype=np.float32), round(float(atom['bfactor']), 2),
+                round(float(atom['occupancy']), 2), atom['altloc'].decode('latin1') or ' ', fullname, serial,
+                atom['element'].decode('latin1').strip().upper() or None)
+        return builder.get_structure()
+
+
+def _save_line(line, preferred_chain, pref_chain, remove_waters, ligands_to_keep):
+    save_line = False
+    if pref_chain:
+        if (line.startswith('ATOM') or line.startswith('HET')) and line[21:22] == preferred_chain:
+            save_line = True
+    else:
+        save_line = True
+    if remove_waters and line.startswith('HET') and line[17:20] == 'HOH':
+        save_line = False
+    if ligands_to_keep and line.startswith('HET'):
+        if pref_chain:
+            if line[17:20] != 'HOH' and line[17:20] in ligands_to_keep and line[21:22] == preferred_chain:
+                save_line = True
+            elif line[17:20] != 'HOH':
+                save_line = False
+        else:
+            if line[17:20] != 'HOH' and line[17:20] in ligands_to_keep:
+                save_line = True
+            elif line[17:20] != 'HOH':
+                save_line = False
+    return save_line
+
+
+def get_structure_coordinates(structure):
+    """Return the CoordinateCache of a Structure (or any object with pdb_data)."""
+    return CoordinateCache.load(structure.pdb_data.pdb)
+
+
+def get_cleaned_pdb(pdb_text, preferred_chain, pref_chain=True, remove_waters=True, ligands_to_keep=None):
+    """Filter PDB text as Structure.get_cleaned_pdb, with the cached atom records or line by line when the atom records
+    can not be parsed."""
+    try:
+        coordinates = CoordinateCache.load(pdb_text)
+    except ValueError:
+        return '\n'.join([line for line in pdb_text.split('\n') if
+            _save_line(line, preferred_chain, pref_chain, remove_waters, ligands_to_keep)])
+    return coordinates.get_cleaned_pdb(preferred_chain, pref_chain, remove_waters, ligands_to_keep)
@@ -0,0 +1,351 @@
+"""
+Job queue for Foldseek structure similarity searches.
+
+Every search is a job directory in JOB_DIR, named by the hash of the uploaded file and the search settings, so
+identical uploads are searched only once. Job directories are prepared under a temporary name and renamed into place
+with their status, so concurrent submitters of the same search start it only once. The job status is kept in the job
+directory, so any web process can poll it.
+
+Web processes only submit jobs, the searches are run by the long-lived workers of the run_foldseek_workers command.
+A queued job has a marker file in QUEUE_DIR, which a worker claims by moving it to RUNNING_DIR. Workers refresh the
+markers of their running jobs, so jobs of a stopped worker are queued again after HEARTBEAT_TIMEOUT. Searches run in a
+foldseek Docker container that is kept running by each worker, or as a plain subprocess when
+settings.FOLDSEEK_EXECUTABLE is set.
+"""
+from django.conf import settings
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+
+
+JOB_DIR = getattr(settings, 'FOLDSEEK_JOB_DIR', os.sep.join([tempfile.gettempdir(), 'foldseek_jobs']))
+QUEUE_DIR = os.sep.join([JOB_DIR, 'queue'])
+RUNNING_DIR = os.sep.join([JOB_DIR, 'running'])
+# number of searches run at the same time by the workers
+MAX_WORKERS = getattr(settings, 'FOLDSEEK_WORKERS', 4)
+# number of queued jobs of the whole site before new searches are refused
+MAX_PENDING_JOBS = 100
+# searches that have not finished after this many seconds are stopped
+JOB_TIMEOUT = 60*60
+# running jobs whose marker has not been refreshed for this many seconds are queued again
+HEARTBEAT_TIMEOUT = 60
+# finished jobs are removed after a day
+JOB_LIFETIME = 60*60*24
+
+OUTPUT_FORMAT = "query,target,ttmscore,lddt,evalue"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class FoldseekJob:
+    """A search job, stored as a directory with the input file, the status and the result."""
+
+    def __init__(self, job_id):
+        # job ids are hex digests, anything else cannot refer to a job directory
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            raise ValueError('Invalid job id')
+        self.job_id = job_id
+        self.path = os.sep.join([JOB_DIR, job_id])
+        self.status_path = os.sep.join([self.path, 'status.json'])
+        self.result_path = os.sep.join([self.path, 'result.txt'])
+        self.queue_path = os.sep.join([QUEUE_DIR, job_id])
+        self.running_path = os.sep.join([RUNNING_DIR, job_id])
+
+    def exists(self):
+        return os.path.isfile(self.status_path)
+
+    def get_status(self):
+        try:
+            with open(self.status_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set_status(self, status, **kwargs):
+        job_status = self.get_status() or {}
+        job_status.update(kwargs)
+        job_status['status'] = status
+        job_status['updated'] = time.time()
+        tmp_path = '{}.{}.tmp'.format(self.status_path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            json.dump(job_status, f)
+        os.replace(tmp_path, self.status_path)
+
+    def get_input_path(self):
+        return os.sep.join([self.path, 'input', self.get_status()['input_file']])
+
+    def is_pending(self):
+        """Return True if the job is queued or claimed by a worker."""
+        return os.path.exists(self.queue_path) or os.path.exists(self.running_path)
+
+    def is_stale(self, job_status):
+        """Return True if the job failed or was lost, i.e. it is unfinished but neither queued nor running."""
+        if job_status is None or job_status['status'] == 'failed':
+            return True
+        if job_status['status'] in ('queued', 'running'):
+            return not self.is_pending()
+        return False
+
+
+def get_job_id(file_content, file_extension, databases, alignment_type):
+    key = hashlib.sha256(file_content)
+    key.update("|".join([file_extension] + sorted(databases) + [str(alignment_type)]).encode('utf-8'))
+    return key.hexdigest()
+
+
+def submit(file_content, file_extension, databases, alignment_type):
+    """Queue a search and return its job id, an identical search that is queued, running or done is reused.
+
+    @param file_content: bytes of the uploaded structure file
+    @param databases: {database name: database directory} of the selected databases
+    @param alignment_type: Foldseek alignment type (0: 3Di, 1: TM-align, 2: 3Di+AA)
+    """
+    job_id = get_job_id(file_content, file_extension, databases, alignment_type)
+    job = FoldseekJob(job_id)
+    os.makedirs(QUEUE_DIR, exist_ok=True)
+    os.makedirs(RUNNING_DIR, exist_ok=True)
+
+    if os.path.isdir(job.path):
+        if not job.is_stale(job.get_status()):
+            return job_id
+        remove_stale_job(job)
+
+    # the queue directory only holds the markers of waiting jobs, so it is cheap to count
+    if len(os.listdir(QUEUE_DIR)) >= MAX_PENDING_JOBS:
+        raise QueueFull()
+
+    # the job is prepared in a temporary directory that is renamed to the job directory, so other processes never see
+    # a job directory without a status
+    tmp_job = FoldseekJob(job_id)
+    tmp_job.path = tempfile.mkdtemp(prefix='.{}.'.format(job_id), dir=JOB_DIR)
+    tmp_job.status_path = os.sep.join([tmp_job.path, 'status.json'])
+    input_file = 'input_chain' + file_extension
+    os.makedirs(os.sep.join([tmp_job.path, 'input']))
+    with open(os.sep.join([tmp_job.path, 'input', input_file]), 'wb') as f:
+        f.write(file_content)
+    tmp_job.set_status('queued', input_file=input_file, databases=databases, alignment_type=alignment_type,
+        created=time.time(), error=None)
+    try:
+        os.rename(tmp_job.path, job.path)
+    except OSError:
+        # the same search was submitted at the same time by another request
+        shutil.rmtree(tmp_job.path, ignore_errors=True)
+        return job_id
+
+    open(job.queue_path, 'w').close()
+    return job_id
+
+
+def claim_job():
+    """Claim the oldest queued job for a worker and return its job id, or None when no job is queued."""
+    try:
+        queued = [(os.path.getmtime(os.sep.join([QUEUE_DIR, job_id])), job_id) for job_id in os.listdir(QUEUE_DIR)]
+    except OSError:
+        return None
+    for _, job_id in sorted(queued):
+        job = FoldseekJob(job_id)
+        try:
+            # the marker is refreshed before it is moved, so the claimed job is not taken for an orphan
+            os.utime(job.queue_path)
+            os.rename(job.queue_path, job.running_path)
+        except OSError:
+            # claimed by another worker
+            continue
+        return job_id
+    return None
+
+
+def refresh_jobs(job_ids):
+    """Refresh the running markers of the jobs of a worker."""
+    for job_id in job_ids:
+        try:
+            os.utime(FoldseekJob(job_id).running_path)
+        except OSError:
+            pass
+
+
+def requeue_orphaned_jobs():
+    """Queue the running jobs of stopped workers again, their markers are no longer refreshed."""
+    try:
+        job_ids = os.listdir(RUNNING_DIR)
+    except OSError:
+        return
+    now = time.time()
+    for job_id in job_ids:
+        job = FoldseekJob(job_id)
+        try:
+            if now - os.path.getmtime(job.running_path) > HEARTBEAT_TIMEOUT:
+                os.rename(job.running_path, job.queue_path)
+                job.set_status('queued')
+        except OSError:
+            continue
+
+
+def run_job(job_id, runner):
+    """Run a claimed job with the runner of a worker and release its marker."""
+    job = FoldseekJob(job_id)
+    try:
+        job.set_status('running')
+        job_status = job.get_status()
+        error = runner.run(job, job_status['databases'], job_status['alignment_type'])
+
+        if error is None:
+            if not os.path.exists(job.result_path):
+                error = "Foldseek did not produce any results"
+            elif os.path.getsize(job.result_path) == 0:
+                error = "No structures found in the input file"
+
+        if error:
+            job.set_status('failed', error=error)
+        else:
+            job.set_status('done')
+    except Exception as e:
+        job.set_status('failed', error="An error occurred during Foldseek execution: {}".format(e))
+    finally:
+        try:
+            os.remove(job.running_path)
+        except OSError:
+            pass
+
+
+def get_runner():
+    if getattr(settings, 'FOLDSEEK_EXECUTABLE', None):
+        return FoldseekSubprocessRunner()
+    return FoldseekDockerRunner()
+
+
+class FoldseekSubprocessRunner:
+    """Runs foldseek easy-search locally, the selected databases are combined in a directory of links."""
+
+    def get_command(self, job, db_dir, tmp_dir, alignment_type):
+        return [settings.FOLDSEEK_EXECUTABLE, 'easy-search', job.get_input_path(), db_dir, job.result_path, tmp_dir,
+            '--alignment-type', str(alignment_type), '--format-output', OUTPUT_FORMAT]
+
+    def run(self, job, databases, alignment_type):
+        # the work directory is inside the job directory, which is also mounted into the Docker container
+        work_dir = tempfile.mkdtemp(prefix='work_', dir=job.path)
+        try:
+            db_dir = os.sep.join([work_dir, 'db'])
+            os.makedirs(db_dir)
+            for db_path in databases.values():
+                for name in os.listdir(db_path):
+                    link = os.sep.join([db_dir, name])
+                    if not os.path.lexists(link):
+                        os.symlink(os.sep.join([os.path.abspath(db_path), name]), link)
+
+            returncode, output = self.execute(self.get_command(job, db_dir, os.sep.join([work_dir, 'tmp']),
+                alignment_type))
+            if returncode != 0:
+                return "Foldseek execution failed: {}".format(output)
+            return None
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def execute(self, command):
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+            timeout=JOB_TIMEOUT)
+        return result.returncode, result.stdout
+
+    def close(self):
+        pass
+
+
+class FoldseekDockerRunner(FoldseekSubprocessRunner):
+    """Runs foldseek easy-search in a foldseek Docker container that is started once and reused for every search of a
+    worker. The job directory and the data directory are mounted at the same paths, so the paths of the jobs and the
+    database links are valid inside the container."""
+
+    def __init__(self):
+        self.client = None
+        self.container = None
+
+    def get_command(self, job, db_dir, tmp_dir, alignment_type):
+        return ['foldseek', 'easy-search', job.get_input_path(), db_dir, job.result_path, tmp_dir,
+            '--alignment-type', str(alignment_type), '--format-output', OUTPUT_FORMAT]
+
+    def get_container(self):
+        if self.container is not None:
+            try:
+                self.container.reload()
+                if self.container.status == 'running':
+                    return self.container
+            except Exception:
+                pass
+            self.close()
+
+        import docker
+        if self.client is None:
+            self.client = docker.from_env()
+        volumes = {
+            os.path.abspath(JOB_DIR): {'bind': os.path.abspath(JOB_DIR), 'mode': 'rw'},
+            os.path.abspath(settings.DATA_DIR): {'bind': os.path.abspath(settings.DATA_DIR), 'mode': 'ro'},
+        }
+        self.container = self.client.containers.run('foldseek:latest', command=['sleep', 'infinity'],
+            name='foldseek_worker_{}'.format(uuid.uuid4()), volumes=volumes, detach=True, remove=True)
+        return self.container
+
+    def execute(self, command):
+        result = self.get_container().exec_run(['timeout', str(JOB_TIMEOUT)] + command)
+        return result.exit_code, result.output.decode('utf-8')
+
+    def close(self):
+        if self.container is not None:
+            try:
+                self.container.remove(force=True)
+            except Exception:
+                pass
+            self.container = None
+
+
+def remove_stale_job(job):
+    """Remove the directory of a stale job. It is renamed first, so that only one of concurrent submitters removes it,
+    and put back when it was replaced by a new job in the meantime."""
+    trash_job = FoldseekJob(job.job_id)
+    trash_job.path = tempfile.mkdtemp(prefix='.{}.'.format(job.job_id), dir=JOB_DIR)
+    trash_job.status_path = os.sep.join([trash_job.path, 'status.json'])
+    try:
+        os.replace(job.path, trash_job.path)
+    except OSError:
+        shutil.rmtree(trash_job.path, ignore_errors=True)
+        return
+    if not trash_job.is_stale(trash_job.get_status()):
+        try:
+            os.rename(trash_job.path, job.path)
+            return
+        except OSError:
+            pass
+    shutil.rmtree(trash_job.path, ignore_errors=True)
+
+
+def remove_expired_jobs():
+    """Remove finished jobs and left-over temporary directories after JOB_LIFETIME, run periodically by the workers."""
+    try:
+        names = os.listdir(JOB_DIR)
+    except OSError:
+        return
+    now = time.time()
+    for name in names:
+        if name.startswith('.'):
+            path = os.sep.join([JOB_DIR, name])
+        else:
+            try:
+                job = FoldseekJob(name)
+            except ValueError:
+                # the queue and running directories
+                continue
+            if job.is_pending():
+                continue
+            path = job.path
+        try:
+            if now - os.path.getmtime(path) > JOB_LIFETIME:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            continue
@@ -11,6 +11,12 @@ except:
 from Bio.Align import PairwiseAligner
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.cache import caches
+try:
+    cache_blast = caches['blast']
+except:
+    cache_blast = cache
 from common.alignment import Alignment
 from common.tools import urlopen_with_retry
 from common.models import WebResource, WebLink, Publication
@@ -18,11 +24,14 @@ from protein.models import Protein, ProteinSegment, ProteinConformation, Protein
 from residue.functions import dgn
 from residue.models import Residue, ResidueGenericNumberEquivalent
 from structure.models import Structure, Rotamer, PdbData, StructureStabilizingAgent, StructureType
+from structure.coordinates import CoordinateCache
 from signprot.models import SignprotStructure
 from ligand.models import Endogenous_GTP
 
 from subprocess import Popen, PIPE
 from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import pandas as pd
 import os
 import sys
@@ -49,6 +58,14 @@ ATOM_FORMAT_STRING="%s%5i %-4s%c%3s %c%4i%c   %8.3f%8.3f%8.3f%s%6.2f      %4s%2s
 # I have put it into separate class for the sake of future uses
 class BlastSearch(object):
 
+    # shared by all searches of a process, so that concurrent requests and builds do not start unbounded numbers of
+    # blastp processes
+    max_workers = min(4, os.cpu_count() or 1)
+    # number of query sequences submitted to a single blastp process, the database is only loaded once per batch
+    batch_size = 50
+    # cached results expire after a week, rebuilding the database invalidates them as well
+    cache_timeout = 60*60*24*7
+    executor = None
 
     def __init__ (self, blast_path='blastp',
         blastdb=os.sep.join([settings.STATICFILES_DIRS[0], 'blast', 'protwis_blastdb']), top_results=1):
@@ -64,12 +81,63 @@ class BlastSearch(object):
     #alignments
     def run (self, input_seq):
 
-        output = []
+        return self.run_batch([input_seq])[0]
+
+    def run_batch(self, input_seqs):
+        """Search a list of sequences and return the list of (hit id, alignment) tuples of each sequence.
+
+        Results are cached by the sequence, database and number of results. Sequences that are not cached are
+        searched in batches of multiple queries, distributed over a bounded pool of workers. Only the results of
+        successful searches are cached, a failed search raises a RuntimeError.
+        """
+        sequences = [str(seq).strip() for seq in input_seqs]
+        results = {}
+        missing = []
+        for seq in set(sequences):
+            output = cache_blast.get(self.get_cache_key(seq))
+            if output is None:
+                missing.append(seq)
+            else:
+                results[seq] = output
+
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            if len(batches) == 1:
+                batch_results = [self._search(batches[0])]
+            else:
+                batch_results = self.get_executor().map(self._search, batches)
+            # the results of the batches before a failed one are still cached
+            for batch, outputs in zip(batches, batch_results):
+                for seq, output in zip(batch, outputs):
+                    results[seq] = output
+                    cache_blast.set(self.get_cache_key(seq), output, self.cache_timeout)
+
+        return [results[seq] for seq in sequences]
+
+    @classmethod
+    def get_executor(cls):
+        if BlastSearch.executor is None:
+            BlastSearch.executor = ThreadPoolExecutor(max_workers=cls.max_workers)
+        return BlastSearch.executor
+
+    def get_cache_key(self, seq):
+        # the database files change when it is rebuilt
+        db_version = ''
+        for extension in ['.pin', '.00.pin', '.pal']:
+            if os.path.isfile(self.blastdb + extension):
+                db_version = str(os.path.getmtime(self.blastdb + extension))
+                break
+        key = "|".join([seq, self.blastdb, db_version, str(self.top_results)])
+        return 'blast_' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _search(self, sequences):
+        """Run blastp once for a batch of sequences, returns the alignments of each sequence in input order."""
+        fasta = "".join([">query_{}\n{}\n".format(i, seq) for i, seq in enumerate(sequences)])
         #Windows has problems with Popen and PIPE
         if sys.platform == 'win32':
             tmp = tempfile.NamedTemporaryFile()
-            logger.debug("Running Blast with sequence: {}".format(input_seq))
-            tmp.write(bytes(str(input_seq) + '\n', 'latin1'))
+            logger.debug("Running Blast with {} sequences".format(len(sequences)))
+            tmp.write(bytes(fasta, 'latin1'))
             tmp.seek(0)
             blast = Popen('%s -db %s -outfmt 5' % (self.blast_path, self.blastdb), universal_newlines=True, stdin=tmp,
                 stdout=PIPE, stderr=PIPE)
@@ -78,16 +146,32 @@ class BlastSearch(object):
             #Rest of the world:
             blast = Popen('%s -db %s -outfmt 5' % (self.blast_path, self.blastdb), universal_newlines=True, shell=True,
                 stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            (blast_out, blast_err) = blast.communicate(input=str(input_seq))
+            (blast_out, blast_err) = blast.communicate(input=fasta)
 
+        if blast.returncode != 0:
+            logger.error("Blast failed with exit code {}: {}".format(blast.returncode, blast_err))
+            raise RuntimeError("Blast failed with exit code {}: {}".format(blast.returncode, blast_err.strip()))
         if len(blast_err) != 0:
             logger.debug(blast_err)
-        if blast_out!='\n':
-            result = NCBIXML.read(StringIO(blast_out))
+
+        # one record per query in input order, also for queries without hits
+        try:
+            records = list(NCBIXML.parse(StringIO(blast_out)))
+        except Exception as msg:
+            logger.error("Could not parse the Blast output: {}".format(msg))
+            raise RuntimeError("Could not parse the Blast output: {}".format(msg))
+        if len(records) != len(sequences):
+            logger.error("Blast returned {} results for {} sequences".format(len(records), len(sequences)))
+            raise RuntimeError("Blast returned {} results for {} sequences".format(len(records), len(sequences)))
+
+        outputs = []
+        for result in records:
+            output = []
             for aln in result.alignments[:self.top_results]:
                 logger.debug("Looping over alignments, current hit: {}".format(aln.hit_id))
                 output.append((aln.hit_id, aln))
-        return output
+            outputs.append(output)
+        return outputs
 #==============================================================================
 
 class BlastSearchOnline(object):
@@ -1078,8 +1162,8 @@ class PdbStateIdentifier():
                     pdb_data = self.structure.pdb_data.pdb
                 elif self.structure_type=='hommod':
                     pdb_data = self.structure.pdb_data.pdb
-                io = StringIO(pdb_data)
-                struct = PDB.PDBParser(QUIET=True).get_structure('structure', io)[0]
+                # built from the cached atom records instead of parsing the PDB text
+                struct = CoordinateCache.load(pdb_data).to_structure('structure')[0]
                 for chain in struct:
                     r1 = chain[res1.sequence_number]
                     r2 = chain[res2.sequence_number]
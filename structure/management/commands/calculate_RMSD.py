@@ -243,9 +243,8 @@ class Validation():
             print('Num atoms used for RMSD: ', len(base_target_atom_list), len(superposed2))
             print('{} all RMSD:'.format(base_type), rmsd)
 
-            # ### 7TM only backbone (N, CA, C) calculation
-            superposed, atoms_used_sp = self.superpose(sorted(base_target_atom_list), sorted(TM_model_atom_list), list(base_nums))
-            superposed3 = self.fetch_atoms_with_seqnum(superposed, list(base_nums), True)
+            # ### 7TM only backbone (N, CA, C) calculation, on the same superposition as above
+            superposed3 = self.fetch_atoms_with_seqnum(superposed2, list(base_nums), True)
             rmsd = self.calc_RMSD(sorted(base_target_backbone_atom_list), sorted(superposed3))
             print('Num atoms sent for superposition: ', len(base_target_atom_list), len(TM_model_atom_list))
             print('Num atoms used for superposition: ', atoms_used_sp)
@@ -273,11 +272,8 @@ class Validation():
 
     def calc_RMSD(self, list1, list2):
         """Calculates RMSD between two atoms lists. The two lists have to have the same length."""
-        array1, array2 = np.array([0,0,0]), np.array([0,0,0])
-        for a1, a2 in zip(list1, list2):
-            array1 = np.vstack((array1, list(a1.get_coord())))
-            array2 = np.vstack((array2, list(a2.get_coord())))
-        rmsd = round(np.sqrt(sum(sum((array1[1:]-array2[1:])**2))/array1[1:].shape[0]),3)
+        array1, array2 = sp.atom_coordinates(list1, list2)
+        rmsd = round(np.sqrt(((array1-array2)**2).sum()/array1.shape[0]),3)
         return rmsd
 
     ### Deprecated
@@ -69,48 +69,41 @@ class Command(BaseBuild):
             else:
                 self.uniprots = self.get_all_GPCR_uniprots()
             self.pdbs = ParseStructureCSV().pdb_ids
+            self.prepare_blast_structures()
             self.prepare_input(options['proc'], self.uniprots)
+            if self.verbose:
+                print('Missing from csv: ', self.blast_csv_list)
 
-    def main_func(self, positions, iteration, count, lock):
-        if not positions[1]:
-            uniprot_list = self.uniprots[positions[0]:]
-        else:
-            uniprot_list = self.uniprots[positions[0]:positions[1]]
+    def prepare_blast_structures(self):
+        """Assign the recent PDB entries found by BLAST to their receptors, entries without a receptor are missing from
+        the csv."""
         q = QueryPDB(self.uniprots, self.pdbs)
-
         brp = BlastRecentPDB()
         blast_pdbs = brp.run()
         self.blast_uniprot_dict = {}
+        self.blast_csv_list = []
         for b in blast_pdbs:
             blast_uniprots = q.pdb_request_by_pdb(b, 'polymer_entity')
             if not blast_uniprots:
-                q.csv_list.append(b)
+                self.blast_csv_list.append(b)
                 continue
             for bu in blast_uniprots:
                 if bu not in self.blast_uniprot_dict:
                     self.blast_uniprot_dict[bu] = [b]
                 else:
                     self.blast_uniprot_dict[bu].append(b)
+        print('{} number of receptors to check'.format(len(self.uniprots)))
 
-        consider_list, error_list = [], []
-        print('{} number of receptors to check'.format(len(uniprot_list)))
-
-        # uniprot_list = ['P28223']
-
-        for uni in uniprot_list:
-            # print(uni)
-            q.new_xtals(uni, self.blast_uniprot_dict)
-            for i in q.consider_list:
-                if i not in consider_list and i not in structs_with_missing_x50:
-                    consider_list.append(i)
-            for i in q.error_list:
-                if i not in error_list:
-                    error_list.append(i)
-        if self.verbose:
-            print('Missing from db: ', q.db_list)
-            print('Missing from csv: ', q.csv_list)
-            print('Structures with missing x50s: {} structures {}'.format(len(consider_list), consider_list))
-            print('Structures with an error: {} structures {}'.format(len(error_list), error_list))
+    def process_item(self, uni, iteration):
+        q = QueryPDB(self.uniprots, self.pdbs)
+        q.new_xtals(uni, self.blast_uniprot_dict)
+        consider_list = [i for i in dict.fromkeys(q.consider_list) if i not in structs_with_missing_x50]
+        error_list = list(dict.fromkeys(q.error_list))
+        if self.verbose and (q.db_list or q.csv_list or consider_list or error_list):
+            print('{} missing from db: {}'.format(uni, q.db_list))
+            print('{} missing from csv: {}'.format(uni, q.csv_list))
+            print('{} structures with missing x50s: {} structures {}'.format(uni, len(consider_list), consider_list))
+            print('{} structures with an error: {} structures {}'.format(uni, len(error_list), error_list))
 
     def fetch_accession_from_entryname(self, listof_entrynames):
         return [i.accession for i in Protein.objects.filter(entry_name__in=listof_entrynames)]
@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand
+
+from structure import foldseek_queue
+
+import logging
+import signal
+import threading
+import time
+
+
+class Command(BaseCommand):
+    help = 'Runs the workers of the Foldseek search queue until it is stopped. The workers poll the job directory for ' \
+        + 'searches submitted by the web processes, requeue the jobs of stopped workers and remove expired jobs'
+
+    logger = logging.getLogger(__name__)
+    # seconds between the removal of expired jobs
+    prune_interval = 10*60
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+            type=int,
+            action='store',
+            dest='workers',
+            default=foldseek_queue.MAX_WORKERS,
+            help='Number of searches run at the same time')
+        parser.add_argument('--poll-interval',
+            type=float,
+            action='store',
+            dest='poll_interval',
+            default=2,
+            help='Seconds between checks of the job queue')
+
+    def work(self, poll_interval):
+        """Worker loop, the runner keeps its foldseek container for all searches of the worker."""
+        runner = foldseek_queue.get_runner()
+        try:
+            while not self.stopping.is_set():
+                job_id = foldseek_queue.claim_job()
+                if job_id is None:
+                    self.stopping.wait(poll_interval)
+                    continue
+                with self.lock:
+                    self.running_jobs.add(job_id)
+                self.logger.info('Running Foldseek job {}'.format(job_id))
+                try:
+                    foldseek_queue.run_job(job_id, runner)
+                finally:
+                    with self.lock:
+                        self.running_jobs.discard(job_id)
+        finally:
+            runner.close()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.running_jobs = set()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        workers = [threading.Thread(target=self.work, args=(options['poll_interval'],))
+            for _ in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        self.logger.info('Started {} Foldseek workers'.format(len(workers)))
+
+        last_prune = 0
+        while not self.stopping.is_set():
+            with self.lock:
+                running_jobs = list(self.running_jobs)
+            foldseek_queue.refresh_jobs(running_jobs)
+            foldseek_queue.requeue_orphaned_jobs()
+            if time.time() - last_prune > self.prune_interval:
+                foldseek_queue.remove_expired_jobs()
+                last_prune = time.time()
+            self.stopping.wait(options['poll_interval'])
+
+        # running searches are finished before the workers stop, their markers are refreshed until then
+        for worker in workers:
+            while worker.is_alive():
+                with self.lock:
+                    running_jobs = list(self.running_jobs)
+                foldseek_queue.refresh_jobs(running_jobs)
+                worker.join(options['poll_interval'])
+        self.logger.info('Stopped Foldseek workers')
@@ -5,6 +5,7 @@ from io import StringIO
 from Bio.PDB import PDBIO
 import re
 from protein.models import ProteinCouplings
+from structure.coordinates import get_structure_coordinates, get_cleaned_pdb
 
 class Structure(models.Model):
     # linked onto the Xtal ProteinConformation, which is linked to the Xtal protein
@@ -59,53 +60,33 @@ class Structure(models.Model):
 
         return str(self.signprot_complex.protein)
 
+    def get_coordinates(self):
+        # atom records of the PDB data, parsed once and kept in the coordinate cache
+        return get_structure_coordinates(self)
+
     def get_cleaned_pdb(self, pref_chain=True, remove_waters=True, ligands_to_keep=None, remove_aux=False, aux_range=5.0):
 
-        tmp = []
-        for line in self.pdb_data.pdb.split('\n'):
-            save_line = False
-            if pref_chain:
-                # or 'refined' bit needs rework, it fucks up the extraction
-                if (line.startswith('ATOM') or line.startswith('HET')) and line[21] == self.preferred_chain[0]:
-                # if (line.startswith('ATOM') or line.startswith('HET')) and (line[21] == self.preferred_chain[0]):
-                    save_line = True
-            else:
-                save_line = True
-            if remove_waters and line.startswith('HET') and line[17:20] == 'HOH':
-                save_line = False
-            if ligands_to_keep and line.startswith('HET'):
-                if pref_chain:
-                    if line[17:20] != 'HOH' and line[17:20] in ligands_to_keep and line[21] == self.preferred_chain[0]:
-                        save_line = True
-                    elif line[17:20] != 'HOH':
-                        save_line=False
-                else:
-                    if line[17:20] != 'HOH' and line[17:20] in ligands_to_keep:
-                        save_line = True
-                    elif line[17:20] != 'HOH':
-                        save_line=False
-            if save_line:
-                tmp.append(line)
-
-        return '\n'.join(tmp)
+        return get_cleaned_pdb(self.pdb_data.pdb, self.preferred_chain[0], pref_chain, remove_waters, ligands_to_keep)
 
     def get_ligand_pdb(self, ligand):
 
-        tmp = []
-        for line in self.pdb_data.pdb.split('\n'):
-            if line.startswith('HET') and line[21] == self.preferred_chain[0]:
-                if line[17:20] != 'HOH' and line[17:20] == ligand:
-                    tmp.append(line)
-        return '\n'.join(tmp)
+        try:
+            coordinates = self.get_coordinates()
+        except ValueError:
+            # atom records that can not be parsed are filtered as text
+            tmp = []
+            for line in self.pdb_data.pdb.split('\n'):
+                if line.startswith('HET') and line[21] == self.preferred_chain[0]:
+                    if line[17:20] != 'HOH' and line[17:20] == ligand:
+                        tmp.append(line)
+            return '\n'.join(tmp)
+        mask = coordinates.chain_mask(self.preferred_chain[0]) & coordinates.ligand_mask([ligand])
+        return '\n'.join(coordinates.get_lines(mask))
 
     def get_preferred_chain_pdb(self):
 
-        tmp = []
-        for line in self.pdb_data.pdb.split('\n'):
-            # http://www.wwpdb.org/documentation/file-format-content/format33/sect9.html#ATOM
-            if (line.startswith('ATOM') or line.startswith('HET')) and line[21] == self.preferred_chain[0]:
-                tmp.append(line)
-        return '\n'.join(tmp)
+        # http://www.wwpdb.org/documentation/file-format-content/format33/sect9.html#ATOM
+        return get_cleaned_pdb(self.pdb_data.pdb, self.preferred_chain[0], pref_chain=True, remove_waters=False)
 
     class Meta():
         db_table = 'structure'
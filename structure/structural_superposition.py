@@ -11,11 +11,148 @@ from structure.functions import *
 from structure.sequence_parser import *
 from structure.assign_generic_numbers_gpcr import GenericNumbering
 from protein.models import Protein
+from residue.models import Residue
 from structure.models import Structure
 from interaction.models import ResidueFragmentInteraction
 
 logger = logging.getLogger("protwis")
 
+#==============================================================================
+def kabsch_batch(ref_coords, alt_coords, mask=None):
+    ''' Least-squares superposition of many coordinate sets on a reference at once (Kabsch algorithm).
+
+        @param ref_coords: (n, 3) array of reference coordinates, or (k, n, 3) with a reference per target \n
+        @param alt_coords: (k, n, 3) array of the coordinates of k targets, paired by index with the reference \n
+        @param mask: optional (k, n) boolean array of the pairs present for each target \n
+        @return: rotations (k, 3, 3), translations (k, 3) and RMSDs (k,). As with Superimposer, the superposed
+        coordinates are dot(coords, rotation) + translation. Targets without any pairs get the identity and a NaN RMSD.
+    '''
+    alt_coords = np.asarray(alt_coords, dtype=np.float64)
+    ref_coords = np.broadcast_to(np.asarray(ref_coords, dtype=np.float64), alt_coords.shape)
+    if mask is None:
+        weights = np.ones(alt_coords.shape[:2])
+    else:
+        weights = np.asarray(mask, dtype=np.float64)
+    counts = weights.sum(axis=1)
+    present = counts > 0
+    divisor = np.where(present, counts, 1.0)[:, None]
+
+    alt_centroids = np.einsum('kn,kni->ki', weights, alt_coords) / divisor
+    ref_centroids = np.einsum('kn,kni->ki', weights, ref_coords) / divisor
+    alt_centered = (alt_coords - alt_centroids[:, None, :]) * weights[:, :, None]
+    ref_centered = ref_coords - ref_centroids[:, None, :]
+
+    u, d, vt = np.linalg.svd(np.einsum('kni,knj->kij', alt_centered, ref_centered))
+    # turn reflections into proper rotations
+    vt[np.linalg.det(np.matmul(u, vt)) < 0, 2] *= -1
+    rotations = np.matmul(u, vt)
+    rotations[~present] = np.eye(3)
+    translations = ref_centroids - np.einsum('ki,kij->kj', alt_centroids, rotations)
+
+    superposed = np.matmul(alt_coords, rotations) + translations[:, None, :]
+    squared_deviations = np.einsum('kn,kn->k', weights, ((superposed - ref_coords)**2).sum(axis=2))
+    rms = np.full(len(alt_coords), np.nan)
+    rms[present] = np.sqrt(squared_deviations[present] / counts[present])
+    return rotations, translations, rms
+
+
+def bfactor_to_generic_number(bfactor):
+    ''' Generic number encoded in a B-factor by GenericNumbering, negative B-factors encode three digit numbers.
+    '''
+    if bfactor < 0:
+        return "{:.3f}".format(-bfactor + 0.001)
+    return "{:.2f}".format(bfactor)
+
+
+def is_selected_generic_number(generic_number, parsed_selection):
+    ''' Check a generic number (e.g. 3.50) against the generic numbers and helices of a SelectionParser.
+    '''
+    if generic_number in parsed_selection.generic_numbers:
+        return True
+    try:
+        return int(generic_number.split('.')[0]) in parsed_selection.helices
+    except ValueError:
+        return False
+
+
+def get_ca_coordinates(atoms):
+    ''' Return an OrderedDict of generic number: coordinate of CA atoms annotated by GenericNumbering, e.g. the
+        atoms selected by CASelector.
+    '''
+    coordinates = OrderedDict()
+    for atom in atoms:
+        generic_number = bfactor_to_generic_number(atom.get_bfactor())
+        if generic_number not in coordinates:
+            coordinates[generic_number] = np.asarray(atom.get_coord(), dtype=np.float64)
+    return coordinates
+
+
+def get_db_ca_coordinates(structure, parsed_selection):
+    ''' Return an OrderedDict of generic number: CA coordinate of the selected residues of a Structure in the DB.
+
+        The generic numbers are those of the residues in the DB and the coordinates come from the coordinate cache,
+        so the structure is neither parsed nor annotated with BLAST.
+    '''
+    residues = Residue.objects.filter(protein_conformation=structure.protein_conformation,
+        display_generic_number__isnull=False).values_list('sequence_number', 'display_generic_number__label')
+    generic_numbers = {}
+    for sequence_number, label in residues:
+        bw, gpcrdb = label.split('x')
+        generic_number = "{}.{}".format(bw.split('.')[0], gpcrdb)
+        if is_selected_generic_number(generic_number, parsed_selection):
+            generic_numbers[sequence_number] = generic_number
+
+    structure_coordinates = structure.get_coordinates()
+    atoms = structure_coordinates.atoms
+    ca_mask = structure_coordinates.chain_mask(structure.preferred_chain[0]) & ~atoms['hetatm'] & (np.char.strip(atoms['name']) == b'CA')
+    coordinates = OrderedDict()
+    for sequence_number, xyz in zip(atoms['resseq'][ca_mask], atoms['xyz'][ca_mask]):
+        generic_number = generic_numbers.get(int(sequence_number))
+        if generic_number is not None and generic_number not in coordinates:
+            coordinates[generic_number] = np.asarray(xyz, dtype=np.float64)
+    return coordinates
+
+#==============================================================================
+class BatchSuperpose(object):
+    ''' Superpose any number of structures on a reference at once, on the CA atoms of the generic numbers they share
+        with the reference.
+
+        @param ref_coordinates: dict of generic number: CA coordinate of the reference \n
+        @param alt_coordinates: list of dicts of generic number: CA coordinate of the structures to superpose
+    '''
+    def __init__(self, ref_coordinates, alt_coordinates):
+        self.generic_numbers = list(ref_coordinates.keys())
+        gn_index = {gn: i for i, gn in enumerate(self.generic_numbers)}
+        self.ref_coords = np.zeros((len(self.generic_numbers), 3))
+        for gn, i in gn_index.items():
+            self.ref_coords[i] = ref_coordinates[gn]
+
+        self.alt_coords = np.zeros((len(alt_coordinates), len(self.generic_numbers), 3))
+        self.mask = np.zeros((len(alt_coordinates), len(self.generic_numbers)), dtype=bool)
+        for k, coordinates in enumerate(alt_coordinates):
+            for gn, coord in coordinates.items():
+                if gn in gn_index:
+                    self.alt_coords[k, gn_index[gn]] = coord
+                    self.mask[k, gn_index[gn]] = True
+        self.rotations, self.translations, self.rms = None, None, None
+
+    def run(self):
+        ''' Superpose all structures, returns the RMSD of each structure (NaN if it has no generic numbers in common
+            with the reference).
+        '''
+        self.rotations, self.translations, self.rms = kabsch_batch(self.ref_coords, self.alt_coords, self.mask)
+        return self.rms
+
+    def apply(self, index, atoms):
+        ''' Move the Biopython atoms of structure index onto the reference.
+        '''
+        atoms = list(atoms)
+        if not atoms:
+            return
+        coords = np.dot(np.array([atom.get_coord() for atom in atoms]), self.rotations[index]) + self.translations[index]
+        for atom, coord in zip(atoms, coords):
+            atom.set_coord(coord)
+
 #==============================================================================
 class ConvertSuperpose(object):
 
@@ -104,32 +241,49 @@ class ConvertSuperpose(object):
 
 #==============================================================================
 class ProteinSuperpose(object):
+    ''' Superpose structures on a reference on the CA atoms of the selected generic numbers, all at once.
 
-    def __init__ (self, ref_file, alt_files, simple_selection):
+        @param ref_structure: optional Structure in the DB that ref_file was written from \n
+        @param alt_structures: optional list of Structures in the DB (or None) that alt_files were written from. The
+        generic numbers and CA coordinates of these are taken from the DB instead of annotating them with BLAST.
+    '''
+    def __init__ (self, ref_file, alt_files, simple_selection, ref_structure=None, alt_structures=None):
 
         self.selection = SelectionParser(simple_selection)
         self.ref_struct = PDBParser(PERMISSIVE=True).get_structure('ref', ref_file)[0]
         assert self.ref_struct, self.logger.error("Can't parse the ref file %s".format(ref_file))
+        self.ref_coordinates = OrderedDict()
         if self.selection.generic_numbers != [] or self.selection.helices != []:
-            if not check_gn(self.ref_struct):
-                gn_assigner = GenericNumbering(structure=self.ref_struct)
-                self.ref_struct = gn_assigner.assign_generic_numbers()
+            self.ref_struct, self.ref_coordinates = self.get_coordinates(self.ref_struct, ref_structure)
 
+        if alt_structures is None:
+            alt_structures = [None] * len(alt_files)
         self.alt_structs = []
-        for alt_id, alt_file in enumerate(alt_files):
+        self.alt_coordinates = []
+        for alt_id, (alt_file, alt_structure) in enumerate(zip(alt_files, alt_structures)):
             try:
                 tmp_struct = PDBParser(PERMISSIVE=True).get_structure(alt_id, alt_file)[0]
                 if self.selection.generic_numbers != [] or self.selection.helices != []:
-                    if not check_gn(tmp_struct):
-                        gn_assigner = GenericNumbering(structure=tmp_struct)
-                        self.alt_structs.append(gn_assigner.assign_generic_numbers())
-                        self.alt_structs[-1].id = alt_id
-                    else:
-                        self.alt_structs.append(tmp_struct)
-                        self.alt_structs[-1].id = alt_id
+                    tmp_struct, coordinates = self.get_coordinates(tmp_struct, alt_structure)
+                    self.alt_structs.append(tmp_struct)
+                    self.alt_structs[-1].id = alt_id
+                    self.alt_coordinates.append(coordinates)
             except Exception as e:
                 logger.warning("Can't parse the file {!s}\n{!s}".format(alt_id, e))
-        self.selector = CASelector(self.selection, self.ref_struct, self.alt_structs)
+
+    def get_coordinates (self, pdb_struct, structure=None):
+        ''' Return the (annotated) structure and the CA coordinates of its selected generic numbers.
+        '''
+        if structure is not None:
+            try:
+                return pdb_struct, get_db_ca_coordinates(structure, self.selection)
+            except Exception as msg:
+                logger.warning("Can't get the generic numbers of {!s} from the DB\n{!s}".format(structure, msg))
+        if not check_gn(pdb_struct):
+            gn_assigner = GenericNumbering(structure=pdb_struct)
+            pdb_struct = gn_assigner.assign_generic_numbers()
+        selector = CASelector(self.selection, pdb_struct, [])
+        return pdb_struct, get_ca_coordinates(selector.ref_atoms)
 
     def run (self):
 
@@ -137,15 +291,14 @@ class ProteinSuperpose(object):
             logger.error("No structures to align!")
             return []
 
-        super_imposer = Superimposer()
-        for alt_struct in self.alt_structs:
-            try:
-                ref, alt = self.selector.get_consensus_atom_sets(alt_struct.id)
-                super_imposer.set_atoms(ref, alt)
-                super_imposer.apply(alt_struct.get_atoms())
-                logger.info("RMS(reference, model {!s}) = {:f}".format(alt_struct.id, super_imposer.rms))
-            except Exception as msg:
-                logger.error("Failed to superpose structures {} and {}\n{}".format(self.ref_struct.id, alt_struct.id, msg))
+        super_imposer = BatchSuperpose(self.ref_coordinates, self.alt_coordinates)
+        rms = super_imposer.run()
+        for index, alt_struct in enumerate(self.alt_structs):
+            if np.isnan(rms[index]):
+                logger.error("Failed to superpose structures {} and {}\nNo selected generic numbers in common".format(self.ref_struct.id, alt_struct.id))
+                continue
+            super_imposer.apply(index, alt_struct.get_atoms())
+            logger.info("RMS(reference, model {!s}) = {:f}".format(alt_struct.id, rms[index]))
 
         return self.alt_structs
 
@@ -241,6 +394,16 @@ class FragmentSuperpose(object):
 
         return list(ResidueFragmentInteraction.objects.exclude(structure_ligand_pair__structure__protein_conformation__protein__parent=self.target).exclude(interaction_type__slug__in=['acc', 'hyd']).prefetch_related('rotamer__residue__display_generic_number', 'rotamer__residue', 'interaction_type'))
 
+#==============================================================================
+def atom_coordinates(atoms1, atoms2):
+    ''' Coordinates of two lists of atoms as two (n, 3) arrays, paired as zip() pairs them.
+    '''
+    atoms1, atoms2 = list(atoms1), list(atoms2)
+    n = min(len(atoms1), len(atoms2))
+    array1 = np.array([atom.get_coord() for atom in atoms1[:n]], dtype=np.float64).reshape(n, 3)
+    array2 = np.array([atom.get_coord() for atom in atoms2[:n]], dtype=np.float64).reshape(n, 3)
+    return array1, array2
+
 #==============================================================================
 class RotamerSuperpose(object):
     ''' Class to superimpose Atom objects on one-another.
@@ -269,17 +432,14 @@ class RotamerSuperpose(object):
             self.num_atoms_used_for_superposition = len(ref_backbone_atoms)
             super_imposer.set_atoms(ref_backbone_atoms, temp_backbone_atoms)
             super_imposer.apply(self.template_atoms)
-            array1, array2 = np.array([0,0,0]), np.array([0,0,0])
-            for atom1, atom2 in zip(ref_backbone_atoms, temp_backbone_atoms):
-                array1 = np.vstack((array1, list(atom1.get_coord())))
-                array2 = np.vstack((array2, list(atom2.get_coord())))
-            diff = array1[1:]-array2[1:]
-            self.backbone_rmsd = np.sqrt(sum(sum(diff**2))/array1[1:].shape[0])
-            for atom1, atom2 in zip(self.reference_atoms, self.template_atoms):
-                array1 = np.vstack((array1, list(atom1.get_coord())))
-                array2 = np.vstack((array2, list(atom2.get_coord())))
-            diff = array1[1:]-array2[1:]
-            self.rmsd = np.sqrt(sum(sum(diff**2))/array1[1:].shape[0])
+            array1, array2 = atom_coordinates(ref_backbone_atoms, temp_backbone_atoms)
+            diff = array1-array2
+            self.backbone_rmsd = np.sqrt((diff**2).sum()/array1.shape[0])
+            # the RMSD over all atoms also counts the backbone atoms again
+            all_array1, all_array2 = atom_coordinates(self.reference_atoms, self.template_atoms)
+            array1, array2 = np.concatenate((array1, all_array1)), np.concatenate((array2, all_array2))
+            diff = array1-array2
+            self.rmsd = np.sqrt((diff**2).sum()/array1.shape[0])
             return self.template_atoms
         except Exception as msg:
             if self.reference_atoms!='x':
@@ -0,0 +1,149 @@
+"""
+Lookup index of the structure and model metadata shown with Foldseek search hits.
+
+The index maps the protein/entry names used in the Foldseek databases to (name, state, class, family, species,
+protein name, entry name, accession, gene) tuples, per database. It is built by the build_structure_info_index
+command (or on first use) and stored in the cache under a version derived from the structure and model tables and a
+modification stamp, so it is rebuilt as soon as structures or models are added or removed, or when a build command
+that edits their rows calls invalidate().
+"""
+from django.core.cache import cache
+from django.db.models import Count, Max, OuterRef, Subquery
+
+from protein.models import Gene
+from structure.models import Structure, StructureModel
+
+import time
+
+
+INDEX_KEY = 'structure_info_index'
+# databases in the order in which their entries take precedence, later databases override earlier ones
+DATABASES = ['af_foldseek_db', 'raw_foldseek_db', 'ref_foldseek_db']
+RAW_STRUCTURE_TYPES = ['x-ray-diffraction', 'electron-microscopy', 'electron-crystallography']
+REFINED_STRUCTURE_TYPES = ['af-signprot-refined-cem', 'af-signprot-refined-xray']
+
+# index loaded in this process, with its version
+_loaded_index = (None, None)
+
+
+def get_index_version():
+    """Version of the index, changes whenever structures or models are added or removed, or the index is invalidated."""
+    version = [cache.get(INDEX_KEY + '_stamp', '0')]
+    for model in [Structure, StructureModel]:
+        stats = model.objects.aggregate(count=Count('id'), max_id=Max('id'))
+        version += [str(stats['count']), str(stats['max_id'])]
+    return "-".join(version)
+
+
+def invalidate():
+    """Mark the index as outdated, for changes to existing structures or models, e.g. their states."""
+    cache.set(INDEX_KEY + '_stamp', str(time.time()), None)
+
+
+def build_index():
+    """Query the metadata of all structures and models, as in StructureBlastView.get_structure_info."""
+    index = {}
+
+    gene_subquery_models = Gene.objects.filter(proteins=OuterRef('protein__pk')).values('name')[:1]
+    af_structures = StructureModel.objects.filter(main_template__isnull=True).annotate(gene_name=Subquery(gene_subquery_models)
+    ).values_list(
+        'protein__entry_name', 'state__slug',
+        'protein__family__parent__parent__parent__name',  # Class
+        'protein__family__parent__name',  # Family
+        'protein__species__common_name',
+        'protein__name',
+        'protein__entry_name',
+        'protein__accession',
+        'gene_name',
+    )
+    index['af_foldseek_db'] = {'{}_{}'.format(item[0], item[1]): item for item in af_structures}
+
+    gene_subquery_exp = Gene.objects.filter(proteins=OuterRef('protein_conformation__protein__parent__pk')).values('name')[:1]
+    exp_structures = Structure.objects.filter(
+        structure_type__slug__in=RAW_STRUCTURE_TYPES,
+        protein_conformation__protein__accession__isnull=True
+    ).annotate(
+        gene_name=Subquery(gene_subquery_exp)
+    ).values_list(
+        'pdb_code__index',
+        'state__slug',
+        'protein_conformation__protein__family__parent__parent__parent__name',  # Class
+        'protein_conformation__protein__family__parent__name',  # Family
+        'protein_conformation__protein__species__common_name',
+        'protein_conformation__protein__parent__name',  # Parent name
+        'protein_conformation__protein__parent__entry_name',  # Parent entry name
+        'protein_conformation__protein__parent__accession',  # Parent accession
+        'gene_name'
+    )
+    index['raw_foldseek_db'] = {item[0]: item for item in exp_structures}
+
+    gene_subquery_ref = Gene.objects.filter(proteins=OuterRef('protein_conformation__protein__pk')).values('name')[:1]
+    ref_structures = Structure.objects.filter(
+        structure_type__slug__in=REFINED_STRUCTURE_TYPES,
+        protein_conformation__protein__accession__isnull=False
+    ).annotate(
+        gene_name=Subquery(gene_subquery_ref)
+    ).values_list(
+        'pdb_code__index',
+        'state__slug',
+        'protein_conformation__protein__family__parent__parent__parent__name',  # Class
+        'protein_conformation__protein__family__parent__name',  # Family
+        'protein_conformation__protein__species__common_name',
+        'protein_conformation__protein__name',  # Regular protein name
+        'protein_conformation__protein__entry_name',  # Regular entry name
+        'protein_conformation__protein__accession',  # Regular accession
+        'gene_name'
+    )
+    index['ref_foldseek_db'] = {item[0]: item for item in ref_structures}
+
+    gene_subquery_models = Gene.objects.filter(proteins=OuterRef('protein__parent__pk')).values('name')[:1]
+    ref_models = StructureModel.objects.filter(main_template__isnull=False).annotate(gene_name=Subquery(gene_subquery_models)
+    ).values_list(
+        'protein__entry_name',
+        'state__slug',
+        'protein__family__parent__parent__parent__name',  # Class
+        'protein__family__parent__name',  # Family
+        'protein__species__common_name',
+        'protein__parent__name',
+        'protein__parent__entry_name',
+        'protein__parent__accession',
+        'gene_name',
+    )
+    index['ref_foldseek_db'].update({item[0]: item for item in ref_models})
+
+    return index
+
+
+def get_index(rebuild=False):
+    """Return the index of the current version, from this process, the cache or by building it."""
+    global _loaded_index
+    version = get_index_version()
+    if not rebuild and _loaded_index[0] == version:
+        return _loaded_index[1]
+
+    key = '{}_{}'.format(INDEX_KEY, version)
+    index = None if rebuild else cache.get(key)
+    if index is None:
+        index = build_index()
+        cache.set(key, index, None)
+        # remove the index of the previous version
+        previous_version = cache.get(INDEX_KEY + '_version')
+        if previous_version and previous_version != version:
+            cache.delete('{}_{}'.format(INDEX_KEY, previous_version))
+        cache.set(INDEX_KEY + '_version', version, None)
+    _loaded_index = (version, index)
+    return index
+
+
+def lookup(names, databases):
+    """Return {name: metadata tuple} of the given hit names in the selected databases."""
+    index = get_index()
+    info = {}
+    for database in DATABASES:
+        if database not in databases:
+            continue
+        entries = index.get(database, {})
+        for name in names:
+            if name in entries:
+                info[name] = entries[name]
+    return info
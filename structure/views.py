@@ -1,7 +1,7 @@
 from django.shortcuts import render
 from django.conf import settings
 from django.views.generic import TemplateView, View
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.db.models import Count, Q, Prefetch, TextField, Avg, Case, When, IntegerField, F, Value, CharField, Subquery, OuterRef, Exists
 from django.db.models.functions import Concat
 from django import forms
@@ -14,6 +14,7 @@ from structure.models import Structure, StructureModel, StructureComplexModel, S
 from structure.functions import CASelector, SelectionParser, GenericNumbersSelector, SubstructureSelector, ModelRotamer
 from structure.assign_generic_numbers_gpcr import GenericNumbering, GenericNumberingFromDB
 from structure.structural_superposition import ProteinSuperpose, FragmentSuperpose, ConvertSuperpose
+from structure import foldseek_queue, structure_info_index
 from structure.forms import *
 from signprot.models import SignprotComplex, SignprotStructure, SignprotStructureExtraProteins
 from interaction.models import ResidueFragmentInteraction,StructureLigandInteraction
@@ -57,8 +58,6 @@ import smtplib
 
 # Imports for Structure_Blast
 import tempfile
-import uuid
-import docker
 import threading
 from functools import wraps
 from django.utils.decorators import method_decorator
@@ -2893,7 +2892,13 @@ class SuperpositionWorkflowResults(TemplateView):
                 out_structs = []
                 self.message = msg
         else:
-            superposition = ProteinSuperpose(deepcopy(ref_file), alt_files, selection)
+            # generic numbers of structures in the DB are taken from the DB instead of being assigned with BLAST
+            ref_structure = None
+            if 'ref_file' not in self.request.session.keys() and selection.reference != [] and selection.reference[0].type == 'structure':
+                ref_structure = selection.reference[0].item
+            alt_structures = [None] * len(self.request.session.get('alt_files', []))
+            alt_structures += [x.item if x.type == 'structure' else None for x in selection.targets if x.type in ['structure', 'signprot', 'structure_model', 'structure_model_Inactive', 'structure_model_Intermediate', 'structure_model_Active']]
+            superposition = ProteinSuperpose(deepcopy(ref_file), alt_files, selection, ref_structure, alt_structures)
             out_structs = superposition.run()
 
         alt_file_names = []
@@ -4278,9 +4283,31 @@ class StructureBlastView(View):
 
     def get(self, request):
         """
-        Handle GET requests.
+        Handle GET requests, with a job id the status or the results of a submitted search are shown.
         """
-        return render(request, self.template_name)
+        job_id = request.GET.get('job')
+        if not job_id:
+            return render(request, self.template_name)
+
+        try:
+            job = foldseek_queue.FoldseekJob(job_id)
+        except ValueError:
+            return self.render_error(request, "Unknown search job.")
+        job_status = job.get_status()
+        if job_status is None:
+            return self.render_error(request, "This search has expired, please submit the structure again.")
+
+        if request.GET.get('format') == 'json':
+            return JsonResponse({'job': job_id, 'status': job_status['status'], 'error': job_status.get('error')})
+
+        if job_status['status'] == 'failed':
+            return self.render_error(request, job_status['error'])
+        if job_status['status'] != 'done':
+            return render(request, self.template_name, {'job_id': job_id, 'job_status': job_status['status']})
+
+        self.structure_type = list(job_status['databases'].keys())
+        data = self.parse_and_enhance_results(job.result_path)
+        return render(request, self.template_name, {'data': data})
 
     def post(self, request):
         """
@@ -4314,19 +4341,17 @@ class StructureBlastView(View):
                     return self.render_error(request, "Invalid alignment method selected. Please try again.")
 
                 fdb = self.get_combined_fdb()
-                print('FDB')
-                print(fdb)
-
-                result_file_path, error_message = self.run_foldseek(temp_file_path, fdb, alignment_type)
-                print('RESULT got')
-                if error_message:
-                    return self.render_error(request, error_message)
-                if not result_file_path:
-                    return self.render_error(request, "An error occurred while processing your request. Please try again later.")
+                databases = {db_name: fdb[db_name] for db_name in self.structure_type}
 
-                data = self.parse_and_enhance_results(result_file_path)
+                # the search runs in the background, the results page polls the job
+                with open(temp_file_path, 'rb') as f:
+                    file_content = f.read()
+                try:
+                    job_id = foldseek_queue.submit(file_content, file_extension, databases, alignment_type)
+                except foldseek_queue.QueueFull:
+                    return render(request, 'error_503.html', status=503)
 
-                return render(request, self.template_name, {'data': data})
+                return redirect('{}?job={}'.format(request.path, job_id))
 
         except Exception as e:
             return self.render_error(request, "An unexpected error occurred. Please try again later.")
@@ -4408,99 +4433,6 @@ class StructureBlastView(View):
                     return True
         return False
 
-    def run_foldseek(self, temp_file_path, fdb, alignment_type):
-        """
-        Execute the Foldseek tool with the given parameters.
-        """
-
-        if not self.validate_structure_file(temp_file_path):
-            return None, "Invalid structure file: No recognizable protein structure data found"
-
-        allowed_extensions = ['.pdb', '.cif', '.mmcif']
-        file_extension = os.path.splitext(temp_file_path)[1].lower()
-        if file_extension not in allowed_extensions:
-            return None, f"Unsupported file format. Allowed formats are: {', '.join(allowed_extensions)}"
-
-        client = docker.from_env()
-        container_name = f'foldseek_run_{uuid.uuid4()}'
-
-        with self.manage_temp_dir() as temp_dir:
-            input_dir = os.path.join(temp_dir, 'input')
-            output_dir = os.path.join(temp_dir, 'output')
-
-            for dir_path in [input_dir, output_dir]:
-                os.makedirs(dir_path)
-
-            input_file_name = os.path.basename(temp_file_path)
-            input_file = os.path.join(input_dir, input_file_name)
-            shutil.copy(temp_file_path, input_file)
-
-            link_commands = []
-            for db_name in self.structure_type:
-                link_commands.append(f"find /{db_name} -maxdepth 1 -exec ln -s {{}} /db/ \\;")
-
-            link_command_str = " && ".join(link_commands)
-
-            command = [
-                'sh', '-c',
-                f'mkdir -p /db && {link_command_str} && foldseek easy-search /input/{input_file_name} /db /output/result.txt /tmp --alignment-type {alignment_type} --format-output "query,target,ttmscore,lddt,evalue"'
-            ]
-
-            try:
-                container = client.containers.run(
-                    'foldseek:latest',
-                    command=command,
-                    name=container_name,
-                    volumes={
-                        input_dir: {'bind': '/input', 'mode': 'ro'},
-                        fdb['af_foldseek_db']: {'bind': '/af_foldseek_db', 'mode': 'ro'},
-                        fdb['ref_foldseek_db']: {'bind': '/ref_foldseek_db', 'mode': 'ro'},
-                        fdb['raw_foldseek_db']: {'bind': '/raw_foldseek_db', 'mode': 'ro'},
-                        output_dir: {'bind': '/output', 'mode': 'rw'},
-                    },
-                    remove=False,
-                    detach=True
-                )
-
-                # print('CONTAINER SET')
-
-                result = container.wait()
-
-                logs = container.logs().decode('utf-8')
-                if result['StatusCode'] != 0:
-                    return None, f"Foldseek execution failed: {logs}"
-
-                result_file = os.path.join(output_dir, 'result.txt')
-                if not os.path.exists(result_file):
-                    return None, "Foldseek did not produce any results"
-
-                if os.path.getsize(result_file) == 0:
-                    return None, "No structures found in the input file"
-
-                final_result_path = tempfile.mktemp(suffix='.txt', prefix='foldseek_result_')
-                self.cleanup_resources.append(final_result_path)
-                shutil.copy(result_file, final_result_path)
-
-                return final_result_path, None
-
-            except Exception as e:
-                # If an exception occurs, try to remove the container by its name
-                try:
-                    container_to_remove = client.containers.get(container_name)
-                    container_to_remove.remove(force=True)
-                except Exception as inner_e:
-                    # print(f"Error removing container by name: {str(inner_e)}")
-                    pass
-                return None, f"An error occurred during Foldseek execution: {str(e)}"
-
-            finally:
-                try:
-                    container_to_remove = client.containers.get(container_name)
-                    container_to_remove.remove(force=True)
-                except Exception as e:
-                    # print(f"Error removing container: {str(e)}")
-                    pass
-
     def parse_and_enhance_results(self, result_file_path):
         """
         Parse the result file and enhance it with additional database information.
@@ -4527,7 +4459,7 @@ class StructureBlastView(View):
         except Exception as e:
             print('Exception')
             print(e)
-        structure_info = self.get_structure_info()
+        structure_info = self.get_structure_info([entry['protein'] for entry in temp_data])
         return self.enhance_data_with_db_info(temp_data, structure_info)
 
     @staticmethod
@@ -4545,118 +4477,12 @@ class StructureBlastView(View):
             return 'Refined experimental structure', f'refined/{protein.replace("_refined", "")}', ''
         return '', '', ''
 
-    def get_structure_info(self):
+    def get_structure_info(self, proteins):
         """
-        Retrieve structure information from the database for all selected structure types.
+        Retrieve the structure information of the hit proteins from the structure info index, for all selected
+        structure types.
         """
-        structures_info = {}
-        filter_structures = []
-
-        if 'af_foldseek_db' in self.structure_type:
-            try:
-                gene_subquery_models = Gene.objects.filter(proteins=OuterRef('protein__pk')).values('name')[:1]
-
-                af_structures = StructureModel.objects.filter(main_template__isnull=True).annotate( gene_name=Subquery(gene_subquery_models)
-                ).values_list(
-                    'protein__entry_name', 'state__slug',
-                    'protein__family__parent__parent__parent__name',  # Class
-                    'protein__family__parent__name',  # Family
-                    'protein__species__common_name',
-                    'protein__name',
-                    'protein__entry_name',
-                    'protein__accession',
-                    'gene_name',
-                )
-                print('Full query sucess')
-            except Exception as e:
-                print(e)
-                print('full first fail')
-
-            structures_info.update({f'{item[0]}_{item[1]}': item for item in af_structures})
-
-        if 'raw_foldseek_db' in self.structure_type:
-
-            filter_structures.extend(['x-ray-diffraction', 'electron-microscopy', 'electron-crystallography'])
-            try:
-                gene_subquery_exp = Gene.objects.filter(proteins=OuterRef('protein_conformation__protein__parent__pk')).values('name')[:1]
-            except Exception as e:
-                print('Sub failed')
-                print(e)
-            print('RAw sub succs')
-            try:
-                exp_structures_info_null_accession = Structure.objects.filter(
-                    structure_type__slug__in=filter_structures,
-                    protein_conformation__protein__accession__isnull=True
-                ).annotate(
-                    gene_name=Subquery(gene_subquery_exp)
-                ).values_list(
-                    'pdb_code__index',
-                    'state__slug',
-                    'protein_conformation__protein__family__parent__parent__parent__name',  # Class
-                    'protein_conformation__protein__family__parent__name',  # Family
-                    'protein_conformation__protein__species__common_name',
-                    'protein_conformation__protein__parent__name',  # Parent name
-                    'protein_conformation__protein__parent__entry_name',  # Parent entry name
-                    'protein_conformation__protein__parent__accession',  # Parent accession
-                    'gene_name'
-                )
-
-                try:
-                    structures_info.update({item[0]: item for item in exp_structures_info_null_accession})
-                except Exception as e:
-                    return
-
-            except Exception as e:
-                # print('Raw failed')
-                # print(e)
-                return
-
-        if 'ref_foldseek_db' in self.structure_type:
-            filter_structures.extend(['af-signprot-refined-cem', 'af-signprot-refined-xray'])
-            gene_subquery_ref = Gene.objects.filter(proteins=OuterRef('protein_conformation__protein__pk')).values('name')[:1]
-
-            try:
-                ref_structures_info_null_accession = Structure.objects.filter(
-                    structure_type__slug__in=filter_structures,
-                    protein_conformation__protein__accession__isnull=False
-                ).annotate(
-                    gene_name=Subquery(gene_subquery_ref)
-                ).values_list(
-                    'pdb_code__index',
-                    'state__slug',
-                    'protein_conformation__protein__family__parent__parent__parent__name',  # Class
-                    'protein_conformation__protein__family__parent__name',  # Family
-                    'protein_conformation__protein__species__common_name',
-                    'protein_conformation__protein__name',  # Regular protein name
-                    'protein_conformation__protein__entry_name',  # Regular entry name
-                    'protein_conformation__protein__accession',  # Regular accession
-                    'gene_name'
-                )
-
-                structures_info.update({item[0]: item for item in ref_structures_info_null_accession})
-
-                gene_subquery_models = Gene.objects.filter(proteins=OuterRef('protein__parent__pk')).values('name')[:1]
-
-                ref_structures = StructureModel.objects.filter(main_template__isnull=False).annotate( gene_name=Subquery(gene_subquery_models)
-                ).values_list(
-                    'protein__entry_name', 
-                    'state__slug',
-                    'protein__family__parent__parent__parent__name',  # Class
-                    'protein__family__parent__name',  # Family
-                    'protein__species__common_name',
-                    'protein__parent__name',
-                    'protein__parent__entry_name',
-                    'protein__parent__accession',
-                    'gene_name',
-                )
-
-                structures_info.update({item[0]: item for item in ref_structures})
-
-            except Exception as e:
-                print('REF failed')
-                print(e)
-
-        return structures_info
+        return structure_info_index.lookup(set(proteins), self.structure_type)
 
     @staticmethod
     def enhance_data_with_db_info(temp_data, structures_info):
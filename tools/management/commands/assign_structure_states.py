@@ -8,6 +8,7 @@ from protein.models import ProteinFamily, ProteinState
 from residue.models import Residue
 from signprot.models import SignprotComplex
 from structure.models import Structure
+from structure import structure_info_index
 
 import logging
 import pandas as pd
@@ -351,6 +352,9 @@ class Command(BaseCommand):
 
             self.logger.info("DONE assigning the \"representative\" tag for unique structure-state complexes")
 
+        # the states are shown with the structure similarity search hits
+        structure_info_index.invalidate()
+
 def getDistanceMatrix(node, pdbs):
     if node.is_leaf():
         return [{pdbs[node.id]: node.dist}, {pdbs[node.id]+"_"+pdbs[node.id]: node.dist}]
@@ -28,20 +28,10 @@ class Command(BaseBuild):
     def handle(self, *args, **options):
         try:
             self.logger.info('CREATING ALL INTERACTIONS')
-            self.prepare_input(options['proc'], self.pdbs)
+            failed = compute_interactions_batch(list(self.pdbs), options['proc'], do_interactions=True, do_peptide_ligand=True)
+            for pdb, msg in failed:
+                self.logger.error('Issue making interactions for {}: {}'.format(pdb, msg))
         except Exception as msg:
             print(msg)
             self.logger.error(msg)
         self.logger.info('COMPLETED ALL INTERACTIONS')
-
-    def main_func(self, positions, iteration,count,lock):
-        pdbs = self.pdbs
-        while count.value<len(pdbs):
-            with lock:
-                pdb = pdbs[count.value]
-                count.value +=1
-            try:
-                # compute_interactions(pdb, True)
-                compute_interactions(pdb, do_interactions=True, do_peptide_ligand=True, save_to_db=True)
-            except:
-                print('Issue making interactions for',pdb)
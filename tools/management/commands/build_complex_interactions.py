@@ -45,13 +45,5 @@ class Command(BaseBuild):
         test_model_updates(self.all_models, self.tracker, check=True)
         self.logger.info('COMPLETED COMPLEX INTERACTIONS')
 
-    def main_func(self, positions, iteration,count,lock):
-        pdbs = self.pdbs
-        while count.value<len(pdbs):
-            with lock:
-                pdb = pdbs[count.value]
-                count.value +=1
-            try:
-                compute_interactions(pdb, do_complexes=True, save_to_db=True)
-            except:
-                print('Issue making interactions for',pdb)
+    def process_item(self, pdb, iteration):
+        compute_interactions(pdb, do_complexes=True, save_to_db=True)
@@ -0,0 +1,54 @@
+from build.management.commands.base_build import Command as BaseBuild
+from contactnetwork.models import InteractingResiduePair, ResidueContact
+
+from django.db.models import Count, Sum
+
+import logging
+
+class Command(BaseBuild):
+
+    help = "Summarize the interactions of all structures into the residue contact table. Interaction builds refresh the \
+        contacts of their structures, by default only structures whose contacts do not match their interactions are \
+        rebuilt."
+
+    logger = logging.getLogger(__name__)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full',
+            action='store_true',
+            dest='full',
+            default=False,
+            help='Rebuild the contacts of all structures, one structure at a time')
+        parser.add_argument('--purge',
+            action='store_true',
+            dest='purge',
+            default=False,
+            help='Empty the contact table before rebuilding the contacts of all structures')
+
+    def get_stale_structures(self):
+        """Structures whose contacts are missing or outdated. Every source interaction adds one to the atompaircount of
+        a contact, so the contacts of a structure are outdated when their sum differs from its number of interactions."""
+        interaction_counts = dict(ResidueContact.get_source_interactions().values(
+            'interacting_pair__referenced_structure_id').annotate(count=Count('id')).values_list(
+            'interacting_pair__referenced_structure_id', 'count'))
+        contact_counts = dict(ResidueContact.objects.values('structure_id').annotate(
+            count=Sum('atompaircount')).values_list('structure_id', 'count'))
+        structures = set(interaction_counts.keys()) | set(contact_counts.keys())
+        return [s for s in sorted(structures) if interaction_counts.get(s, 0) != contact_counts.get(s, 0)]
+
+    def handle(self, *args, **options):
+        self.logger.info('BUILDING RESIDUE CONTACTS')
+        if options['purge']:
+            ResidueContact.truncate()
+
+        if options['full'] or options['purge']:
+            structures = sorted(set(InteractingResiduePair.objects.values_list('referenced_structure_id', flat=True).distinct())
+                | set(ResidueContact.objects.values_list('structure_id', flat=True).distinct()))
+        else:
+            structures = self.get_stale_structures()
+        for structure in structures:
+            try:
+                ResidueContact.refresh([structure])
+            except Exception as msg:
+                self.logger.error('Issue building residue contacts for structure {}: {}'.format(structure, msg))
+        self.logger.info('COMPLETED RESIDUE CONTACTS, {} structures rebuilt'.format(len(structures)))